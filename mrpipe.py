@@ -28,7 +28,7 @@ if __name__ == '__main__':
         logger.debug("############## Step Mode #################")
         job = PipeJob.PipeJob.fromPickled(args.input)
         if job:
-            job.runJob()
+            job.runJob(callerJobDir=args.stepCaller)
         else:
             logger.critical(f"Job Step could not be loaded, please check error above.")
             logger.critical(f"Probably the .pkl file does not exist under the following path: {args.input}")
@@ -68,6 +68,36 @@ if __name__ == '__main__':
         pipe.configure(reconfigure=False, filterJobs=False)
         pipe.export_all_modules_as_scripts()
 
+    elif args.mode == "gc":
+        logger.process("############## Garbage Collection Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.collectGarbage()
+
+    elif args.mode == "collect":
+        logger.process("############## Log Collection Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.collectLogs()
+
+    elif args.mode == "stats":
+        logger.process("############## Statistics Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.stats()
+
+    elif args.mode == "trace":
+        logger.process("############## Trace Export Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.trace()
+
+    elif args.mode == "efficiency":
+        logger.process("############## Efficiency Report Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.efficiency()
+
+    elif args.mode == "metrics":
+        logger.process("############## Metrics Export Mode #################")
+        pipe = Pipe.Pipe(args=args)
+        pipe.metrics()
+
 
     sys.exit()
 
@@ -6,6 +6,7 @@ from mrpipe.meta.PathClass import Path
 
 
 class EDDYDiffusion(Task):
+    stageIO = True
 
     def __init__(self, inputImage: ImageWithSideCar, inputMask: Path, acqparam: Path, index: Path, bval: Path, bvec: Path, topupBasename:Path,
                  outputBasename: Path,  expectedOutputList: List[Path], session, repol = True, data_is_shelled = True, residuals = True, cnr_maps = True,
@@ -3,6 +3,7 @@ from mrpipe.meta.PathClass import Path
 
 
 class TOPUP(Task):
+    stageIO = True
 
     def __init__(self, inputImage: Path, acqparam: Path, config: Path, outputDir: Path, outputImage: Path, outFieldcoef: Path, outMovepar: Path, session, name: str = "dwidenoise", clobber=False):
         super().__init__(name=name, clobber=clobber, session=session)
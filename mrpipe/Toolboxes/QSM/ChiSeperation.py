@@ -7,6 +7,7 @@ logger = LoggerModule.Logger()
 
 
 class ChiSeperation(Task):
+    stageIO = True
     def __init__(self, session, mag4d_path, pha4d_path, brainmask_path, outdir, TEms, b0_direction, CFs, Toolboxes, pre_string,
                  chi_sep_dir, vendor, outfiles, name="chiSep", clobber=False):
         super().__init__(name=name, clobber=clobber, session=session)
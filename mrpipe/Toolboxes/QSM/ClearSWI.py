@@ -7,6 +7,7 @@ from mrpipe.meta import LoggerModule
 logger = LoggerModule.Logger()
 
 class ClearSWI(Task):
+    stageIO = True
 
     def __init__(self, session, mag4d_path: Path, pha4d_path: Path, TEms: List[float], outputDir: Path,  outputFiles: List[Path], clearswiSIF, unwrapping_algorithm: str = "laplacian", name: str = "clearswi", clobber=False):
         super().__init__(name=name, clobber=clobber, session=session)
@@ -1,6 +1,7 @@
 from typing import List
 from mrpipe.meta import LoggerModule
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.GarbageCollector import GarbageCollector
 from mrpipe.Helper import Helper
 from abc import ABC, abstractmethod
 from enum import Enum
@@ -21,6 +22,12 @@ class TaskStatus(Enum):
 
 
 class Task(ABC):
+    # True for tasks which only convert an existing file into another representation (e.g. its compression). They are
+    # not the producer of that file, see FileRegistry.
+    isConversion = False
+    # True for I/O heavy tasks which may run on node-local scratch space (--stageIO), see Scheduler.taskCommand
+    stageIO = False
+
     def __init__(self, name: str, session, parent = None, clobber: bool = False):
         #settable
         self.clobber = clobber
@@ -94,7 +101,7 @@ class Task(ABC):
         if self.getState() == TaskStatus.isPreComputed:
             return True
         for file in self.outFiles:
-            if not file.exists():
+            if not file.exists() and not GarbageCollector().isCollected(file):  # intermediates removed after use still count as done
                 logger.info(f"Outfile contains file which does not exist yet, need to compute task. File: {file}")
                 return False
         #self.state = TaskStatus.isPreComputed #was duplicated
@@ -115,7 +122,7 @@ class Task(ABC):
             if not isinstance(el, Path):
                 logger.error(f"Could not add file to InFiles for task '{self.name}', file is not instance of PathClass or [PathClass]: {type(el)}; {str(el)}")
             else:
-                if self.checkUnique(file):
+                if self.checkUnique(el, self.inFiles):
                     self.inFiles.append(el)
 
     def createOutDirs(self):
@@ -131,7 +138,7 @@ class Task(ABC):
                     f"Could not add file to OutFiles, file is not instance of PathClass or [PathClass]: {type(el)}; {str(el)}; Task Name: {self.name}")
                 logger.error(str(el))
             else:
-                if self.checkUnique(file):
+                if self.checkUnique(el, self.outFiles):
                     self.outFiles.append(el)
         self.checkIfDone()
 
@@ -140,8 +147,11 @@ class Task(ABC):
             for file in self.outFiles:
                 file.remove()
 
-    def checkUnique(self, file):
-        if file in self.inFiles or file in self.outFiles:
+    def checkUnique(self, file, fileList=None):
+        # A file may be in- and outfile of the same task (e.g. modified in place), but not twice in the same list.
+        if fileList is None:
+            fileList = self.inFiles + self.outFiles
+        if file in fileList:
             logger.warning(f'File {file} already exists in InFiles or OutFiles')
             return False
         else:
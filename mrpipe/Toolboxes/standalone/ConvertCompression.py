@@ -0,0 +1,48 @@
+from mrpipe.Toolboxes.Task import Task, TaskStatus
+import os
+from mrpipe.Helper import Helper
+from mrpipe.meta.PathClass import Path
+
+
+class ConvertCompression(Task):
+    # Converts a file into its other compression variant (x.nii <-> x.nii.gz). Scheduled by the pipe for files which
+    # exist in a different variant than declared, see CompressionManager.
+    isConversion = True
+
+    def __init__(self, infile: Path, outfile: Path, session, nthreads: int = 1, keepSource: bool = False, name: str = "ConvertCompression", clobber=False):
+        super().__init__(name=name, clobber=clobber, session=session)
+        self.infile = infile
+        self.outfile = outfile
+        self.nthreads = nthreads
+        self.keepSource = keepSource
+        self.command = os.path.join(Helper.get_libpath(), "Toolboxes", "submodules", "custom", "ConvertCompression.py")
+
+        # add input and output images
+        self.addInFiles([self.infile])
+        self.addOutFiles([self.outfile])
+
+    def _outfileOnDisk(self) -> bool:
+        # the outfile is reported as existing while its conversion is pending, so look at the declared file only
+        return self.outfile.exists(acceptZipped=False, acceptUnzipped=False, acceptCache=False)
+
+    def checkIfDone(self) -> bool:
+        if self.getState() == TaskStatus.recompute:
+            return False
+        if self.getState() == TaskStatus.isPreComputed:
+            return True
+        if not self._outfileOnDisk():
+            return False
+        self.setStatePrecomputed()
+        return True
+
+    def verifyOutFiles(self):
+        if self._outfileOnDisk() and (not self.clobber):
+            self.state = TaskStatus.outFilesNotVerfiable
+            return False
+        return True
+
+    def getCommand(self):
+        command = f"python {self.command} -s {self.infile} -t {self.outfile} -n {self.nthreads}"
+        if self.keepSource:
+            command += " -k"
+        return command
@@ -0,0 +1,28 @@
+from mrpipe.Toolboxes.Task import Task
+import os
+from mrpipe.Helper import Helper
+from mrpipe.meta.PathClass import Path
+
+
+class DWIShellVis(Task):
+    # Rotating 3D view of the diffusion directions per shell. Renderings are shared between sessions with the same
+    # protocol through cacheDir (keyed by a hash of the bvals and bvecs).
+    def __init__(self, bval: Path, bvec: Path, outfile: Path, session, cacheDir: Path = None, bvalTolerance: int = 20,
+                 name: str = "DWIShellVis", clobber=False):
+        super().__init__(name=name, clobber=clobber, session=session)
+        self.bval = bval
+        self.bvec = bvec
+        self.outfile = outfile
+        self.cacheDir = cacheDir
+        self.bvalTolerance = bvalTolerance
+        self.command = os.path.join(Helper.get_libpath(), "Toolboxes", "submodules", "custom", "DWIShellVis.py")
+
+        # add input and output images
+        self.addInFiles([self.bval, self.bvec])
+        self.addOutFiles([self.outfile])
+
+    def getCommand(self):
+        command = f"python {self.command} -b {self.bval} -v {self.bvec} -o {self.outfile} -t {self.bvalTolerance}"
+        if self.cacheDir is not None:
+            command += f" -c {self.cacheDir}"
+        return command
@@ -0,0 +1,32 @@
+from mrpipe.Toolboxes.Task import Task
+import os
+from mrpipe.Helper import Helper
+from mrpipe.meta.PathClass import Path
+from mrpipe.meta import LoggerModule
+logger = LoggerModule.Logger()
+
+ValidMaterializeModes = ["auto", "reflink", "hardlink", "symlink", "copy"]
+
+
+class MaterializeInput(Task):
+    # Makes a raw input file available in the derivatives tree. Replaces copying files during configuration: the file
+    # is reflinked (or copied where reflinks are not supported) when the job runs, hard or symbolic links on request.
+    def __init__(self, infile: Path, outfile: Path, session, mode: str = "auto", name: str = "MaterializeInput", clobber=False):
+        super().__init__(name=name, clobber=clobber, session=session)
+        self.infile = infile
+        self.outfile = outfile
+        if mode not in ValidMaterializeModes:
+            logger.error(f"Invalid materialization mode '{mode}', must be one of {ValidMaterializeModes}. Using auto.")
+            mode = "auto"
+        self.mode = mode
+        self.command = os.path.join(Helper.get_libpath(), "Toolboxes", "submodules", "custom", "MaterializeInput.py")
+
+        # add input and output images
+        self.addInFiles([self.infile])
+        self.addOutFiles([self.outfile])
+
+    def getCommand(self):
+        command = f"python {self.command} -s {self.infile} -t {self.outfile} -m {self.mode}"
+        if self.clobber:
+            command += " -c"
+        return command
@@ -19,7 +19,7 @@ class PINGU_PVS(Task):
         self.addOutFiles([self.output_image])
 
     def getCommand(self):
-        self.output_image.directory = self.temp_dir.createDirectory()
+        self.temp_dir.createDirectory()
         command = "singularity run --nv " + \
                   f"-B {self.input_image.get_directory()} " + \
                   f"-B {self.temp_dir} " + \
@@ -6,7 +6,6 @@ from scipy.ndimage import label
 import scipy.ndimage as ndi
 from skimage.measure import regionprops, marching_cubes, mesh_surface_area
 from skimage.morphology import binary_dilation, convex_hull_image
-from scipy.spatial.distance import cdist
 import pandas as pd
 import argparse
 
@@ -32,27 +31,22 @@ def get_voxel_dims(affine):
     return np.array([sx, sy, sz])
 
 
-def calculate_min_distance(lesion_mask, ventricle_mask):
-    """Calculate minimum distance from lesion to ventricle edge."""
-    # Find edges
+def ventricle_edge_distance_map(ventricle_mask):
+    """
+    Euclidean distance (in voxels) of every voxel to the closest voxel of the ventricle edge, i.e. the voxels just outside
+    the ventricles. Computed once for all lesions; None if there is no ventricle edge.
+    """
     ventricle_edge = binary_dilation(ventricle_mask) & ~ventricle_mask
     if not np.any(ventricle_edge):
-        return float('inf')  # No ventricle edge found
-
-    # Get coordinates of edges
-    ventricle_edge_coords = np.array(np.where(ventricle_edge)).T
-
-    if not np.any(lesion_mask):
-        return float('inf')  # No lesion found
+        return None  # No ventricle edge found
+    return ndi.distance_transform_edt(~ventricle_edge)
 
-    lesion_coords = np.array(np.where(lesion_mask)).T
 
-    if len(ventricle_edge_coords) == 0 or len(lesion_coords) == 0:
-        return float('inf')
-
-    # Calculate minimum Euclidean distance
-    distances = cdist(lesion_coords, ventricle_edge_coords, 'euclidean')
-    return np.min(distances)
+def calculate_min_distance(lesion_mask, edge_distance):
+    """Calculate minimum distance from lesion to ventricle edge, lesion_mask and edge_distance cropped alike."""
+    if edge_distance is None or not np.any(lesion_mask):
+        return float('inf')  # No ventricle edge or no lesion found
+    return np.min(edge_distance[lesion_mask])
 
 
 def calculate_eigenvalues(component_mask, affine):
@@ -93,7 +87,7 @@ def calculate_eigenvalues(component_mask, affine):
         return padded_eigvals, 0.0
 
 
-def calculate_shape_metrics(component_mask, affine):
+def calculate_shape_metrics(component_mask, affine, offset=(0, 0, 0)):
     """
     Calculate various shape metrics for a component.
     
@@ -115,6 +109,9 @@ def calculate_shape_metrics(component_mask, affine):
        
     6. Curvature: Approximated based on principles from differential geometry, simplified for discrete volumes
        as described in Pottmann, H., et al. (2007). Discrete surfaces for architectural design. Curves and Surface Design.
+
+    component_mask may be cropped from the full volume, offset is the index of its first voxel. The mesh is shifted back
+    to full volume coordinates before scaling, so the metrics do not depend on the crop.
     """
     # Get voxel dimensions in mm
     voxel_dims = get_voxel_dims(affine)
@@ -124,7 +121,12 @@ def calculate_shape_metrics(component_mask, affine):
     volume = np.sum(component_mask) * voxel_volume
 
      # Calculate surface area using marching cubes
-    verts, faces, _, _ = marching_cubes(component_mask, spacing=voxel_dims)
+    verts, faces, _, _ = marching_cubes(component_mask)
+    # back to full volume coordinates, then scaled the way marching_cubes(spacing=voxel_dims) does it, so the area is
+    # identical to running it on the full volume
+    verts = verts + np.asarray(offset, dtype=verts.dtype)
+    if not np.array_equal(voxel_dims, (1, 1, 1)):
+        verts = verts * voxel_dims
     # Calculate surface area
     surface_area = mesh_surface_area(verts, faces)
 
@@ -157,35 +159,27 @@ def calculate_shape_metrics(component_mask, affine):
     }
 
 
+ATTRIBUTE_COLUMNS = {
+    'volume': 'Volume_mm3',
+    'distance': 'Min_Distance_to_Ventricle_mm',
+    'fa': 'Fractional_Anisotropy',
+    'compactness': 'Compactness',
+    'sphericity': 'Sphericity',
+    'circularity': 'Circularity',
+    'solidity': 'Solidity',
+}
+
+
 def create_attribute_image(labeled_lesions, num_components, attribute_type, results_df, lesion_affine, lesion_header):
     """Create a NIFTI image with lesions colored by the selected attribute."""
-    # Initialize an empty volume with the same shape as the labeled lesions
-    attribute_img = np.zeros_like(labeled_lesions, dtype=np.float32)
-    
-    # Map each component to its attribute value
-    for component_idx in range(1, num_components + 1):
-        component_mask = labeled_lesions == component_idx
-        
-        # Get the attribute value for this component
-        if attribute_type == 'volume':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Volume_mm3'].values[0]
-        elif attribute_type == 'distance':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Min_Distance_to_Ventricle_mm'].values[0]
-        elif attribute_type == 'fa':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Fractional_Anisotropy'].values[0]
-        elif attribute_type == 'compactness':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Compactness'].values[0]
-        elif attribute_type == 'sphericity':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Sphericity'].values[0]
-        elif attribute_type == 'circularity':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Circularity'].values[0]
-        elif attribute_type == 'solidity':
-            value = results_df.loc[results_df['Component_ID'] == component_idx, 'Solidity'].values[0]
-        else:
-            raise ValueError(f"Invalid attribute type: {attribute_type}")
-        
-        # Assign the attribute value to the component voxels
-        attribute_img[component_mask] = value
+    if attribute_type not in ATTRIBUTE_COLUMNS:
+        raise ValueError(f"Invalid attribute type: {attribute_type}")
+
+    # Value per component ID (0 is background), looked up for all voxels at once
+    values = np.zeros(num_components + 1, dtype=np.float32)
+    if num_components > 0 and not results_df.empty:  # without lesions, results_df has no columns and the image stays 0
+        values[results_df['Component_ID'].to_numpy()] = results_df[ATTRIBUTE_COLUMNS[attribute_type]].to_numpy()
+    attribute_img = values[labeled_lesions]
     
     # Create a new NIFTI image
     nifti_img = nib.Nifti1Image(attribute_img, lesion_affine, lesion_header)
@@ -224,6 +218,7 @@ def analyze_lesions(lesion_file, ventricle_file, output_csv, attribute_type='vol
 
     # Convert ventricle mask to binary
     ventricle_mask = ventricle_data > 0
+    edge_distance = ventricle_edge_distance_map(ventricle_mask)
 
     # Calculate voxel volume
     voxel_vol = get_voxel_volume(lesion_affine)
@@ -233,16 +228,21 @@ def analyze_lesions(lesion_file, ventricle_file, output_csv, attribute_type='vol
 
     print(f"Found {num_components} lesion components")
 
-    # Analyze each lesion component
-    for component_idx in tqdm(range(1, num_components + 1)):
+    # Analyze each lesion component within its bounding box (plus one voxel, so marching cubes closes the surface)
+    for component_idx, bbox in enumerate(tqdm(ndi.find_objects(labeled_lesions)), start=1):
+        if bbox is None:
+            continue
+        crop = tuple(slice(max(sl.start - 1, 0), min(sl.stop + 1, size)) for sl, size in zip(bbox, labeled_lesions.shape))
+        offset = tuple(sl.start for sl in crop)
+
         # Extract this component
-        component_mask = labeled_lesions == component_idx
+        component_mask = labeled_lesions[crop] == component_idx
 
         # Calculate volume
         volume_mm3 = np.sum(component_mask) * voxel_vol
 
         # Calculate minimum distance to ventricle
-        min_dist = calculate_min_distance(component_mask, ventricle_mask)
+        min_dist = calculate_min_distance(component_mask, edge_distance[crop] if edge_distance is not None else None)
 
         # Calculate eigenvalues and fractional anisotropy
         if np.sum(component_mask) > 1:  # Need at least 2 voxels for eigenvalue decomposition
@@ -255,7 +255,7 @@ def analyze_lesions(lesion_file, ventricle_file, output_csv, attribute_type='vol
         min_dist_mm = min_dist * np.mean([np.sqrt(np.sum(lesion_affine[:3, i] ** 2)) for i in range(3)])
         
         # Calculate shape metrics
-        shape_metrics = calculate_shape_metrics(component_mask, lesion_affine)
+        shape_metrics = calculate_shape_metrics(component_mask, lesion_affine, offset)
 
         # Store results
         result_dict = {
@@ -280,7 +280,7 @@ def analyze_lesions(lesion_file, ventricle_file, output_csv, attribute_type='vol
     
 
     if attribute_type == 'all':
-        for attribute in ['volume', 'distance', 'fa', 'compactness', 'sphericity', 'circularity', 'solidity']:
+        for attribute in ATTRIBUTE_COLUMNS:
             output_nifti = f"{output_stem}_{attribute}.nii.gz"
             attribute_img = create_attribute_image(
                 labeled_lesions,
@@ -292,7 +292,7 @@ def analyze_lesions(lesion_file, ventricle_file, output_csv, attribute_type='vol
             )
             nib.save(attribute_img, output_nifti)
             print(f"Attribute image saved to {output_nifti}")
-    elif attribute_type in ['volume', 'distance', 'fa', 'compactness', 'sphericity', 'circularity', 'solidity']:
+    elif attribute_type in ATTRIBUTE_COLUMNS:
         # Create attribute image
         output_nifti = f"{output_stem}_{attribute_type}.nii.gz"
         attribute_img = create_attribute_image(
@@ -0,0 +1,36 @@
+import argparse
+from argparse import RawTextHelpFormatter
+import os
+import sys
+
+# the conversion itself is shared with the conversions the pipe runs during configuration
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+from mrpipe.meta.CompressionManager import CompressionManager
+
+parser = argparse.ArgumentParser(
+        description='Compress or decompress a file with gzip, depending on whether the target ends with .gz.\n'
+                    'Uses pigz with several threads if it is available, gzip from the python standard library otherwise.',
+        formatter_class=RawTextHelpFormatter)
+
+parser.add_argument('-s', '--source', dest="source", type=str, required=True,
+                    help="Existing input file.")
+parser.add_argument('-t', '--target', dest="target", type=str, required=True,
+                    help="Output file. Compressed if it ends with .gz, decompressed otherwise.")
+parser.add_argument('-n', '--nthreads', dest="nthreads", type=int, default=1,
+                    help="Number of threads used by pigz.")
+parser.add_argument('-k', '--keep', dest='keep', action='store_true',
+                    help='Keep the source file. By default it is removed after a successful conversion.')
+args = parser.parse_args()
+
+if os.path.isfile(args.target) and not os.path.isfile(args.source):
+    print(f"Already converted: {args.target}")
+    sys.exit(0)
+if not os.path.isfile(args.source):
+    raise IOError("Input File does not exist: {}".format(args.source))
+
+compress = args.target.endswith(".gz")
+if compress == args.source.endswith(".gz"):
+    raise ValueError(f"Source and target have the same compression: {args.source}, {args.target}")
+
+CompressionManager.convert(args.source, args.target, removeSource=not args.keep, threads=args.nthreads)
+print(f"{'Compressed' if compress else 'Decompressed'} {args.source} -> {args.target}")
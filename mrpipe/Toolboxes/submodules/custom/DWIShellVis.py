@@ -0,0 +1,166 @@
+import argparse
+from argparse import RawTextHelpFormatter
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import matplotlib.colors as colors
+from matplotlib.lines import Line2D
+from matplotlib import animation
+
+# the shell analysis is shared with the protocol fingerprint of the scan inventory (pure numpy, no other mrpipe imports)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, os.pardir)))
+from mrpipe.meta import DWIProtocol
+
+parser = argparse.ArgumentParser(
+        description='Render a rotating 3D view of the diffusion directions of a DWI protocol, one arrow per volume\n'
+                    'colored by shell. Videos are cached by protocol: sessions with identical bvals and bvecs share\n'
+                    'one rendering, the output is hard linked (or copied) from the cache.',
+        formatter_class=RawTextHelpFormatter)
+
+parser.add_argument('-b', '--bval', dest="bval", type=str, required=True,
+                    help="bval file of the DWI image.")
+parser.add_argument('-v', '--bvec', dest="bvec", type=str, required=True,
+                    help="bvec file of the DWI image.")
+parser.add_argument('-o', '--output', dest="output", type=str, required=True,
+                    help="Output video, .mp4 or .gif.")
+parser.add_argument('-c', '--cache', dest="cache", type=str, default=None,
+                    help="Directory with the rendered videos by protocol. Without it, the video is always rendered.")
+parser.add_argument('-t', '--bvalTolerance', dest="bvalTolerance", type=float, default=20,
+                    help="b-values within this tolerance belong to the same shell, b-values below it are b0.")
+args = parser.parse_args()
+
+# change this whenever the rendering changes, it invalidates all cached videos
+RenderVersion = 2
+Figsize = (4, 4)
+Dpi = 104
+Elev = 20
+Frames = 20
+Fps = 6
+
+
+def readDWIScheme(bvalPath, bvecPath):
+    bvals = np.atleast_1d(np.loadtxt(bvalPath, dtype=float, ndmin=1)).ravel()
+    bvecs = np.loadtxt(bvecPath, dtype=float, ndmin=2)
+    if bvecs.shape[1] != 3:
+        bvecs = bvecs.T
+    if bvecs.shape != (len(bvals), 3):
+        raise ValueError(f"Mismatched bvals/bvecs shape: bvals: {bvals.shape}, bvecs: {bvecs.shape}")
+    return bvals, bvecs
+
+
+def protocolHash(bvals, bvecs, bvalTolerance):
+    # rounded like the plot: variations of the scanner in the last digits must not cause new renderings
+    h = hashlib.sha1()
+    h.update(f"{RenderVersion};{bvalTolerance}".encode())
+    h.update(np.round(bvals / 10).astype(np.int64).tobytes())
+    h.update(np.round(bvecs, 3).astype(np.float64).tobytes())
+    return h.hexdigest()
+
+
+def shellReport(bvals, bvecs, tol):
+    # same shells, b0 threshold and tolerances as the protocol analysis of the DWI image series
+    return DWIProtocol.analyzeProtocol(bvals, bvecs, bTol=tol, b0Max=tol)
+
+
+def plotShells(ax, bvals, bvecs, report):
+    bvecs = DWIProtocol.normalizeVectors(bvecs)
+    allIdxs = np.concatenate([np.asarray(s["indices"], dtype=int) for s in report]) if report else np.array([], dtype=int)
+    bForScale = bvals[allIdxs] if len(allIdxs) else np.array([1.0])
+    bMax = float(np.max(bForScale)) if np.any(bForScale > 0) else 1.0
+    colorMap = colors.ListedColormap(["#E41A1C", "#4DAF4A", "#984EA3", "#F781BF", "#FF7F00", "#A65628", "#377EB8"])
+
+    legendHandles = []
+    for i, shell in enumerate(report):
+        idxs = np.asarray(shell["indices"], dtype=int)
+        lengths = 0.2 + 0.8 * bvals[idxs] / bMax
+        U, V, W = (bvecs[idxs] * lengths[:, None]).T
+        ax.quiver(np.zeros_like(U), np.zeros_like(V), np.zeros_like(W), U, V, W,
+                  length=1.0, normalize=False, color=colorMap(i), linewidth=0.8, arrow_length_ratio=0.12, alpha=0.4)
+        label = f"b≈{int(round(shell['shell_b']))} | {shell['n_dirs']} dirs | {'full' if shell['is_full_shell'] else 'half'}"
+        legendHandles.append(Line2D([0], [0], color=colorMap(i), lw=3, label=label))
+
+    ax.set_box_aspect([1, 1, 1])
+    ax.set_xlim([-1, 1])
+    ax.set_ylim([-1, 1])
+    ax.set_zlim([-1, 1])
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('Z')
+    ax.legend(handles=legendHandles, title="b-shells", loc='lower center', bbox_to_anchor=(0.5, -0.2), borderaxespad=0.)
+    plt.tight_layout()
+    ax.grid(False)
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_zticks([])
+
+
+def render(bvals, bvecs, report, filename):
+    fig = plt.figure(figsize=Figsize)
+    ax = fig.add_subplot(111, projection='3d')
+    plotShells(ax, bvals, bvecs, report)
+
+    def animate(f):
+        ax.view_init(elev=Elev, azim=360.0 * f / Frames)
+        return (fig,)
+
+    anim = animation.FuncAnimation(fig, animate, init_func=lambda: animate(0), frames=Frames, interval=1000 / Fps, blit=False)
+    if filename.lower().endswith(".gif"):
+        anim.save(filename, writer="pillow", fps=Fps)
+    else:
+        anim.save(filename, writer=animation.FFMpegWriter(fps=Fps, bitrate=3000), dpi=Dpi)
+    plt.close(fig)
+
+
+def renderAtomically(bvals, bvecs, report, target):
+    # render under a temporary name in the target directory: concurrent tasks rendering the same protocol never see a
+    # partial video, the last one to finish simply replaces the identical file
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    suffix = os.path.splitext(target)[1]
+    fd, tmpTarget = tempfile.mkstemp(prefix="." + os.path.basename(target) + ".", suffix=suffix, dir=os.path.dirname(target))
+    os.close(fd)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmpTarget, 0o666 & ~umask)
+    try:
+        render(bvals, bvecs, report, tmpTarget)
+        os.replace(tmpTarget, target)
+    finally:
+        if os.path.exists(tmpTarget):
+            os.remove(tmpTarget)
+
+
+def linkOrCopy(source, target):
+    tmpTarget = f"{target}.{os.getpid()}.tmp"
+    try:
+        os.link(source, tmpTarget)
+    except OSError:
+        shutil.copyfile(source, tmpTarget)
+    os.replace(tmpTarget, target)
+
+
+bvals, bvecs = readDWIScheme(args.bval, args.bvec)
+report = shellReport(bvals, bvecs, args.bvalTolerance)
+# the plot shows the b-values rounded to 10, like the protocol structure in the scan inventory
+plotBvals = np.round(bvals / 10) * 10
+output = os.path.abspath(args.output)
+os.makedirs(os.path.dirname(output), exist_ok=True)
+
+if args.cache is None:
+    renderAtomically(plotBvals, bvecs, report, output)
+    print(f"Rendered {output}")
+    sys.exit(0)
+
+cached = os.path.join(args.cache, protocolHash(bvals, bvecs, args.bvalTolerance) + os.path.splitext(output)[1])
+if os.path.isfile(cached):
+    print(f"Protocol already rendered: {cached}")
+else:
+    renderAtomically(plotBvals, bvecs, report, cached)
+    print(f"Rendered {cached}")
+linkOrCopy(cached, output)
+print(f"Wrote {output}")
@@ -0,0 +1,109 @@
+import argparse
+from argparse import RawTextHelpFormatter
+import os
+import sys
+import gzip
+import shutil
+import fcntl
+import tempfile
+
+# FICLONE from linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+parser = argparse.ArgumentParser(
+        description='Materialize an input file at a new location without copying its content where possible.\n'
+                    'By default tries a reflink (copy-on-write clone) and falls back to a copy. Hard and symbolic links share the\n'
+                    'content with the raw file, a tool writing in place would change it, so they are only used if requested.\n'
+                    'If source and target differ in compression (.gz), the file is (de)compressed instead.',
+        formatter_class=RawTextHelpFormatter)
+
+parser.add_argument('-s', '--source', dest="source", type=str, required=True,
+                    help="Existing input file.")
+parser.add_argument('-t', '--target', dest="target", type=str, required=True,
+                    help="Location at which the file should appear.")
+parser.add_argument('-m', '--mode', dest="mode", type=str, default="auto",
+                    choices=["auto", "reflink", "hardlink", "symlink", "copy"],
+                    help="auto tries a reflink and falls back to copy. Any other value tries only this method and then falls back to copy.")
+parser.add_argument('-c', '--clobber', dest='clobber', action='store_true',
+                    help='Replace an existing target.')
+args = parser.parse_args()
+
+
+def reflink(source, target):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, target)
+
+
+def hardlink(source, target):
+    os.link(source, target)
+
+
+def symlink(source, target):
+    os.symlink(source, target)
+
+
+def copy(source, target):
+    shutil.copy2(source, target)
+
+
+def compress(source, target):
+    with open(source, "rb") as f_in, gzip.open(target, "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out, length=1 << 20)
+
+
+def decompress(source, target):
+    with gzip.open(source, "rb") as f_in, open(target, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, length=1 << 20)
+
+
+methods = {"reflink": reflink, "hardlink": hardlink, "symlink": symlink, "copy": copy}
+
+source = os.path.realpath(args.source)
+target = os.path.abspath(args.target)
+
+if not os.path.isfile(source):
+    raise IOError("Input File does not exist: {}".format(args.source))
+
+if os.path.lexists(target):
+    if os.path.exists(target) and os.path.samefile(source, target):
+        print(f"Target already points to the source file: {target}")
+        sys.exit(0)
+    if not args.clobber:
+        raise IOError("Output file already exists and clobber is False: {}".format(target))
+
+os.makedirs(os.path.dirname(target), exist_ok=True)
+
+sourceZipped = source.endswith(".gz")
+targetZipped = target.endswith(".gz")
+if sourceZipped and not targetZipped:
+    candidates = [("decompress", decompress)]
+elif targetZipped and not sourceZipped:
+    candidates = [("compress", compress)]
+elif args.mode == "auto":
+    candidates = [("reflink", reflink), ("copy", copy)]
+else:
+    candidates = [(args.mode, methods[args.mode]), ("copy", copy)]
+
+# create the target under a temporary name in the same directory and move it into place atomically, so that an
+# interrupted run never leaves a partial file at the target location.
+fd, tmpTarget = tempfile.mkstemp(prefix="." + os.path.basename(target) + ".", dir=os.path.dirname(target))
+os.close(fd)
+try:
+    for name, method in candidates:
+        try:
+            os.remove(tmpTarget)
+        except FileNotFoundError:
+            pass
+        try:
+            method(source, tmpTarget)
+        except (OSError, NotImplementedError) as e:
+            print(f"{name} not possible ({e}), trying next method.")
+            continue
+        os.replace(tmpTarget, target)
+        print(f"Materialized {source} -> {target} ({name})")
+        sys.exit(0)
+    raise IOError(f"Could not materialize {source} at {target}.")
+finally:
+    if os.path.lexists(tmpTarget):
+        os.remove(tmpTarget)
@@ -0,0 +1,146 @@
+import argparse
+from argparse import RawTextHelpFormatter
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+parser = argparse.ArgumentParser(
+        description='Run a command on node-local scratch space.\n'
+                    'The directories of all declared input and output files are mirrored below a local directory: declared inputs are copied,\n'
+                    'everything else already present in these directories is symlinked. Paths in the command pointing into these directories\n'
+                    'are rewritten to the mirror. If the command succeeds and wrote all declared outputs, every file it created is moved back\n'
+                    'atomically (all files are copied next to their destination first and renamed into place afterwards). If it fails,\n'
+                    'nothing is copied back.\n'
+                    'The command is run by bash as a whole, so it may contain && or redirections. The local directory is added to the\n'
+                    'singularity / apptainer bind paths, so container tasks see their staged files.',
+        formatter_class=RawTextHelpFormatter)
+
+parser.add_argument('-m', '--manifest', dest="manifest", type=str, required=True,
+                    help="Json file with the lists 'inputs' and 'outputs' of the declared files of the task.")
+parser.add_argument('-r', '--root', dest="root", type=str, default=None,
+                    help="Node-local directory to stage into. Defaults to $SLURM_TMPDIR, $TMPDIR or /tmp.")
+parser.add_argument('command', nargs=argparse.REMAINDER,
+                    help="Command to run as one (quoted) argument, separated by --.")
+args = parser.parse_args()
+
+command = " ".join(args.command[1:] if args.command and args.command[0] == "--" else args.command)
+if not command.strip():
+    raise ValueError("No command given.")
+
+with open(args.manifest, "r") as f:
+    manifest = json.load(f)
+inputs = [os.path.abspath(p) for p in manifest.get("inputs", [])]
+outputs = [os.path.abspath(p) for p in manifest.get("outputs", [])]
+outputDirs = [os.path.abspath(p) for p in manifest.get("outputDirs", [])]
+
+root = args.root or os.environ.get("SLURM_TMPDIR") or os.environ.get("TMPDIR") or tempfile.gettempdir()
+os.makedirs(root, exist_ok=True)
+localRoot = tempfile.mkdtemp(prefix="mrpipe_stage_", dir=root)
+
+
+def local(path):
+    return localRoot + path
+
+
+def variants(path):
+    return {path, path[:-3] if path.endswith(".gz") else path + ".gz"}
+
+
+# directories to mirror, shallow ones first
+mirrored = sorted({os.path.dirname(p) for p in inputs + outputs} | set(outputDirs), key=len)
+reserved = set(mirrored)
+for directory in mirrored:
+    while directory != os.sep:
+        directory = os.path.dirname(directory)
+        reserved.add(directory)
+for p in inputs + outputs:
+    reserved |= variants(p)
+
+
+def stage():
+    for directory in mirrored:
+        os.makedirs(local(directory), exist_ok=True)
+    for p in inputs:
+        if os.path.isdir(p):
+            shutil.copytree(p, local(p), symlinks=True, dirs_exist_ok=True)
+        elif os.path.isfile(p):
+            shutil.copy2(p, local(p))
+    for directory in mirrored:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            source = os.path.join(directory, entry)
+            if source in reserved or os.path.lexists(local(source)):
+                continue
+            os.symlink(source, local(source))
+
+
+def rewrite(command):
+    # replaces every occurrence of a mirrored directory at the start of a path, e.g. also within quoted matlab calls
+    pattern = re.compile(r"(?<![\w.\-/])(" + "|".join(re.escape(d) for d in sorted(mirrored, key=len, reverse=True)) + r")(?![\w.\-])")
+    return pattern.sub(lambda m: local(m.group(1)), command)
+
+
+def containerEnvironment():
+    # containers only see bound directories: the local copies and the originals the symlinks of the mirror point to
+    env = os.environ.copy()
+    binds = ",".join([localRoot] + [d for d in mirrored if os.path.isdir(d)])
+    for variable in ["SINGULARITY_BINDPATH", "APPTAINER_BINDPATH"]:
+        env[variable] = f"{env[variable]},{binds}" if env.get(variable) else binds
+    return env
+
+
+def createdFiles():
+    # regular files written by the command below the mirrored directories, apart from the staged inputs
+    staged = {local(p) for p in inputs}
+    files = set()
+    for directory in mirrored:
+        for base, dirs, names in os.walk(local(directory)):
+            for name in names:
+                path = os.path.join(base, name)
+                if path in staged or os.path.islink(path) or any(path.startswith(local(p) + os.sep) for p in inputs):
+                    continue
+                files.add(path)
+    return sorted(files)
+
+
+def copyBack(files):
+    pending = []
+    try:
+        for path in files:
+            target = path[len(localRoot):]
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmpTarget = tempfile.mkstemp(prefix="." + os.path.basename(target) + ".", suffix=".stage", dir=os.path.dirname(target))
+            os.close(fd)
+            pending.append((tmpTarget, target))
+            shutil.copy2(path, tmpTarget)
+    except Exception:
+        for tmpTarget, _ in pending:
+            if os.path.exists(tmpTarget):
+                os.remove(tmpTarget)
+        raise
+    for tmpTarget, target in pending:
+        os.replace(tmpTarget, target)
+
+
+try:
+    stage()
+    localCommand = rewrite(command)
+    print(f"Staged task in {localRoot}: {localCommand}", flush=True)
+    returncode = subprocess.call(localCommand, shell=True, executable="/bin/bash", env=containerEnvironment())
+    if returncode != 0:
+        print(f"Command failed with exit code {returncode}, not copying back any output.", flush=True)
+        sys.exit(returncode)
+    missing = [p for p in outputs if not any(os.path.lexists(local(v)) or os.path.lexists(v) for v in variants(p))]
+    if missing:
+        print(f"Command did not write the declared outputs {missing}, not copying back any output.", flush=True)
+        sys.exit(1)
+    files = createdFiles()
+    copyBack(files)
+    print(f"Copied back {len(files)} files.", flush=True)
+finally:
+    shutil.rmtree(localRoot, ignore_errors=True)
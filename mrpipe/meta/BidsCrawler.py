@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.DirectoryCache import DirectoryCache
+from mrpipe.meta.SidecarCache import SidecarCache
+
+logger = LoggerModule.Logger()
+
+
+class BidsCrawler:
+    """
+    Scans the raw BIDS tree once, in parallel, and keeps the result as a manifest on disk. Directories are read level by
+    level with a thread pool, which hides the per-request latency of network file systems. For every directory the
+    manifest stores its mtime, its subdirectories and for each file its size, mtime and (for json sidecars) a sha1 hash.
+    On reruns, directories whose mtime did not change are taken from the manifest and cost a single stat, plus one per
+    sidecar: editing a file in place does not change the directory mtime, so sidecars are hashed again if their size or
+    mtime changed.
+    All listings are handed to the DirectoryCache, so that subject, session, modality and file identification are
+    answered from memory. With storeSidecars, the parsed content of the json sidecars is kept in the manifest as well and
+    handed to the SidecarCache: a sidecar is parsed once when it is hashed and never opened again while unchanged.
+    """
+    manifestVersion = 2
+    sidecarEndings = (".json",)
+    _racyWindow = 2.0
+
+    def __init__(self, root, manifestPath=None, threads: int = 16, includeTopLevel=None, rescan: bool = False,
+                 storeSidecars: bool = True):
+        self.root = os.path.abspath(str(root))
+        self.manifestPath = str(manifestPath) if manifestPath is not None else None
+        self.threads = max(1, int(threads))
+        self.includeTopLevel = includeTopLevel
+        self.rescan = rescan
+        self.storeSidecars = storeSidecars
+        self.dirs = {}
+        self._previous = {}
+        self.scanned = 0
+        self.reused = 0
+
+    def _loadManifest(self):
+        if self.rescan or self.manifestPath is None or not os.path.isfile(self.manifestPath):
+            return {}
+        try:
+            with open(self.manifestPath, "r") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != self.manifestVersion or manifest.get("root") != self.root or \
+                    manifest.get("sidecars", False) != self.storeSidecars:
+                logger.info(f"BIDS manifest {self.manifestPath} does not match the current dataset, rescanning everything.")
+                return {}
+            return manifest.get("dirs", {})
+        except Exception as e:
+            logger.warning(f"Could not read BIDS manifest {self.manifestPath}, rescanning everything: {e}")
+            return {}
+
+    def writeManifest(self):
+        if self.manifestPath is None:
+            return
+        manifest = {"version": self.manifestVersion, "root": self.root, "created": time.time(),
+                    "sidecars": self.storeSidecars, "dirs": self.dirs}
+        tmpPath = self.manifestPath + ".tmp"
+        try:
+            with open(tmpPath, "w") as f:
+                json.dump(manifest, f, separators=(",", ":"))
+            os.replace(tmpPath, self.manifestPath)
+            logger.info(f"Wrote BIDS manifest: {self.manifestPath}")
+        except Exception as e:
+            logger.logExceptionError(f"Could not write BIDS manifest {self.manifestPath}", e)
+
+    @staticmethod
+    def _hashFile(path):
+        h = hashlib.sha1()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        except OSError:
+            return None
+        return h.hexdigest()
+
+    @staticmethod
+    def _hashAndParse(path):
+        # sidecars are small: read once, hash the bytes and parse them
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError:
+            return None, None
+        try:
+            attributes = json.loads(content)
+        except ValueError:
+            attributes = None  # read (and reported) again by whoever queries it
+        return hashlib.sha1(content).hexdigest(), attributes
+
+    def _abs(self, rel):
+        return self.root if rel == "." else os.path.join(self.root, rel)
+
+    def _scanDir(self, rel):
+        path = self._abs(rel)
+        previous = self._previous.get(rel)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return rel, None, False
+        if previous is not None and previous["m"] == mtime and previous["s"] - mtime >= self._racyWindow:
+            return rel, self._refreshSidecars(path, previous), False
+
+        previousFiles = previous["f"] if previous is not None else {}
+        record = {"m": mtime, "s": time.time(), "d": [], "f": {}}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            record["d"].append(entry.name)
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue  # broken symlink or vanished file
+                    size, fmtime = st.st_size, st.st_mtime
+                    if entry.name.endswith(self.sidecarEndings):
+                        old = previousFiles.get(entry.name)
+                        if old is not None and old[0] == size and old[1] == fmtime and old[2]:
+                            record["f"][entry.name] = old
+                            continue
+                        record["f"][entry.name] = self._sidecarEntry(entry.path, size, fmtime)
+                        continue
+                    record["f"][entry.name] = [size, fmtime, None]
+        except OSError as e:
+            logger.warning(f"Could not scan directory {path}: {e}")
+            return rel, None, False
+        record["d"].sort()
+        return rel, record, True
+
+    def _sidecarEntry(self, path, size, mtime):
+        if self.storeSidecars:
+            return [size, mtime, *self._hashAndParse(path)]
+        return [size, mtime, self._hashFile(path)]
+
+    def _refreshSidecars(self, path, record):
+        # record of an unchanged directory, with the entries of sidecars edited in place since the last run replaced
+        files = None
+        for name, old in record["f"].items():
+            if not name.endswith(self.sidecarEndings):
+                continue
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue  # vanished, the directory mtime changes with it and it is rescanned next time
+            if st.st_size == old[0] and st.st_mtime == old[1]:
+                continue
+            if files is None:
+                files = dict(record["f"])
+            files[name] = self._sidecarEntry(os.path.join(path, name), st.st_size, st.st_mtime)
+        if files is None:
+            return record
+        return {**record, "f": files}
+
+    def _descend(self, rel, record):
+        children = []
+        for name in record["d"]:
+            if name.startswith("."):
+                continue  # e.g. .git or .datalad
+            if rel == "." and self.includeTopLevel is not None and not self.includeTopLevel(name):
+                continue
+            children.append(name if rel == "." else os.path.join(rel, name))
+        return children
+
+    def crawl(self):
+        start = time.perf_counter()
+        self._previous = self._loadManifest()
+        self.dirs = {}
+        visited = set()
+        level = ["."]
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            while level:
+                nextLevel = []
+                for rel, record, scanned in pool.map(self._scanDir, level):
+                    if record is None:
+                        continue
+                    real = os.path.realpath(self._abs(rel))
+                    if real in visited:  # symlink loop
+                        continue
+                    visited.add(real)
+                    self.dirs[rel] = record
+                    if scanned:
+                        self.scanned += 1
+                    else:
+                        self.reused += 1
+                    nextLevel.extend(self._descend(rel, record))
+                level = nextLevel
+        self._previous = {}
+        self.seedDirectoryCache()
+        if self.storeSidecars:
+            self.seedSidecarCache()
+        self.writeManifest()
+        logger.process(f"Crawled BIDS directory {self.root}: {len(self.dirs)} directories ({self.scanned} scanned, {self.reused} unchanged since last run) in {time.perf_counter() - start:.1f}s.")
+        return self
+
+    def seedDirectoryCache(self):
+        cache = DirectoryCache()
+        for rel, record in self.dirs.items():
+            entries = {name: [True, None] for name in record["d"]}
+            entries.update({name: [False, info[0]] for name, info in record["f"].items()})
+            cache.seed(self._abs(rel), entries, record["m"], record["s"])
+
+    def seedSidecarCache(self):
+        cache = SidecarCache()
+        for rel, record in self.dirs.items():
+            for name, info in record["f"].items():
+                if len(info) > 3 and info[3] is not None:
+                    cache.seed(os.path.join(self._abs(rel), name), info[1], info[3])
+
+    def _record(self, path):
+        rel = os.path.relpath(os.path.abspath(str(path)), self.root)
+        return self.dirs.get(rel)
+
+    def listdir(self, path):
+        record = self._record(path)
+        if record is None:
+            return None
+        return record["d"] + list(record["f"].keys())
+
+    def fileInfo(self, path):
+        path = os.path.abspath(str(path))
+        record = self._record(os.path.dirname(path))
+        if record is None:
+            return None
+        info = record["f"].get(os.path.basename(path))
+        if info is None:
+            return None
+        return {"size": info[0], "mtime": info[1], "sha1": info[2]}
+
+    def sidecarHash(self, path):
+        info = self.fileInfo(path)
+        return info["sha1"] if info else None
@@ -0,0 +1,127 @@
+import os
+import gzip
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LoggerModule import Singleton
+from mrpipe.meta.DirectoryCache import DirectoryCache
+
+logger = LoggerModule.Logger()
+
+ValidCompressionPolicies = ["declared", "keep", "compress", "decompress"]
+
+
+class CompressionManager(metaclass=Singleton):
+    """
+    Decides what happens if a file is found in the other compression variant than the one it was declared with
+    (e.g. x.nii instead of x.nii.gz). Path.exists() used to (un)zip such files on the spot, single threaded and in
+    whatever process asked. Now the policy of the file's stage decides, and conversions are only recorded here. The
+    pipe turns them into tasks of a conversion job, on which the jobs reading these files depend.
+
+    Policies (separately for intermediate files, i.e. paths marked for cleanup, and final files):
+        declared:   convert to the declared file name (the previous behaviour)
+        keep:       use the file as it is found, never convert
+        compress:   convert to .gz if the file was found uncompressed, otherwise keep it
+        decompress: convert to uncompressed if the file was found compressed, otherwise keep it
+    """
+
+    def __init__(self):
+        self.finalPolicy = "declared"
+        self.intermediatePolicy = "keep"
+        self.collecting = False
+        self._requests = {}  # target path string -> [source path string, declared Path object]
+        self._lock = threading.Lock()
+
+    def configure(self, finalPolicy: str = None, intermediatePolicy: str = None):
+        for policy in [finalPolicy, intermediatePolicy]:
+            if policy is not None and policy not in ValidCompressionPolicies:
+                logger.error(f"Invalid compression policy '{policy}', must be one of {ValidCompressionPolicies}. Ignoring it.")
+        if finalPolicy in ValidCompressionPolicies:
+            self.finalPolicy = finalPolicy
+        if intermediatePolicy in ValidCompressionPolicies:
+            self.intermediatePolicy = intermediatePolicy
+        self.collecting = True
+        logger.info(f"Compression policy: final files: {self.finalPolicy}, intermediate files: {self.intermediatePolicy}")
+
+    def _target(self, declared: str, existing: str, intermediate: bool) -> str:
+        policy = self.intermediatePolicy if intermediate else self.finalPolicy
+        if policy == "declared":
+            return declared
+        if policy == "compress":
+            return declared if declared.endswith(".gz") else existing
+        if policy == "decompress":
+            return existing if declared.endswith(".gz") else declared
+        return existing
+
+    def resolve(self, path, existing: str, transform: bool = True) -> str:
+        # Called by Path.exists() if only the other compression variant (existing) of path exists. Returns the file
+        # name the Path should use from now on.
+        declared = str(path.path)
+        with self._lock:
+            if declared in self._requests:
+                return declared
+            if not transform or not self.collecting:
+                logger.warning(f"File does not exist as {declared}, but as {existing}. Assuming you also accept this version.")
+                return existing
+            target = self._target(declared, existing, getattr(path, "cleanup", False))
+            if target == existing:
+                logger.info(f"File does not exist as {declared}, but as {existing}. Keeping it as it is (compression policy).")
+                return existing
+            logger.info(f"File exists as {existing}, scheduling conversion to {declared}.")
+            self._requests[declared] = [existing, path]
+            return declared
+
+    def isPending(self, path) -> bool:
+        with self._lock:
+            return str(path) in self._requests
+
+    def getRequests(self):
+        # list of (source path string, target Path object)
+        with self._lock:
+            return [(source, target) for source, target in self._requests.values()]
+
+    def __len__(self):
+        return len(self._requests)
+
+    @staticmethod
+    def convert(source: str, target: str, removeSource: bool = True, threads: int = 1):
+        # (de)compresses source into target. Uses pigz if it is available, gzip from the standard library otherwise.
+        # Written under a temporary name and moved into place, so an interrupted conversion never leaves a partial
+        # target. Also used by the ConvertCompression task (custom/ConvertCompression.py).
+        tmpTarget = os.path.join(os.path.dirname(target), "." + os.path.basename(target) + ".tmp")
+        compress = target.endswith(".gz")
+        pigz = shutil.which("pigz")
+        try:
+            if pigz:
+                with open(source, "rb") as f_in, open(tmpTarget, "wb") as f_out:
+                    subprocess.run([pigz, "-c", "-p", str(max(1, threads))] + ([] if compress else ["-d"]),
+                                   stdin=f_in, stdout=f_out, check=True)
+            elif compress:
+                with open(source, "rb") as f_in, gzip.open(tmpTarget, "wb", compresslevel=6) as f_out:
+                    shutil.copyfileobj(f_in, f_out, length=1 << 20)
+            else:
+                with gzip.open(source, "rb") as f_in, open(tmpTarget, "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out, length=1 << 20)
+            os.replace(tmpTarget, target)
+        finally:
+            if os.path.exists(tmpTarget):
+                os.remove(tmpTarget)
+        if removeSource:
+            os.remove(source)
+
+    def convertLocal(self, requests, threads: int = 4):
+        # converts in a pool of threads within this process; zlib releases the GIL, so this scales with threads.
+        def run(request):
+            source, target = request
+            try:
+                self.convert(source, str(target))
+                DirectoryCache().invalidate(source)
+                return True
+            except Exception as e:
+                logger.logExceptionError(f"Could not convert {source} to {target}", e)
+                return False
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            results = list(pool.map(run, requests))
+        return sum(results)
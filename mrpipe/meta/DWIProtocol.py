@@ -0,0 +1,126 @@
+"""
+Analysis of DWI acquisition schemes (bvals / bvecs). Everything works on whole arrays: directions are compared through
+one matrix of dot products instead of pairwise loops, so schemes with several hundred volumes are analysed in
+milliseconds.
+"""
+import numpy as np
+
+
+def readBvals(path) -> np.ndarray:
+    # first row of a FSL style bval file, any whitespace as separator
+    return np.loadtxt(str(path), dtype=float, ndmin=2)[0]
+
+
+def readBvecs(path) -> np.ndarray:
+    # FSL style bvec file (3 rows x n volumes), returned as n x 3
+    bvecs = np.loadtxt(str(path), dtype=float, ndmin=2)
+    if bvecs.shape[0] >= 3:
+        return bvecs[:3].T
+    return bvecs
+
+
+def normalizeVectors(bvecs, eps=1e-12) -> np.ndarray:
+    bvecs = np.asarray(bvecs, dtype=float)
+    norms = np.linalg.norm(bvecs, axis=1, keepdims=True)
+    return bvecs / np.where(norms < eps, 1.0, norms)
+
+
+def foldToHemisphere(vectors):
+    # flips every direction onto the hemisphere of positive z (ties broken by y, then x), so that a direction and its
+    # antipode become the same vector
+    v = normalizeVectors(vectors)
+    sign = np.where(np.abs(v[:, 2]) > 1e-9, np.sign(v[:, 2]),
+                    np.where(np.abs(v[:, 1]) > 1e-9, np.sign(v[:, 1]), np.sign(v[:, 0])))
+    sign[sign == 0] = 1
+    return v * sign[:, None], sign
+
+
+def groupShells(bvals, tol=50) -> dict:
+    # shells start at the smallest b-value not assigned yet and contain all b-values up to tol above it;
+    # returns mean b-value of the shell -> volume indices
+    bvals = np.asarray(bvals, dtype=float)
+    order = np.argsort(bvals, kind="stable")
+    sortedB = bvals[order]
+    shells = {}
+    start = 0
+    while start < len(sortedB):
+        end = np.searchsorted(sortedB, sortedB[start] + tol, side="right")
+        members = order[start:end]
+        shells[float(np.mean(bvals[members]))] = members.tolist()
+        start = end
+    return shells
+
+
+def uniqueDirections(vectors, angTolDeg=1.0, antipodal=False):
+    # greedy grouping of directions within angTolDeg of the first direction of a group; with antipodal, a direction and
+    # its antipode count as the same axis. Returns the index of the first direction of each group and the groups.
+    v = normalizeVectors(vectors)
+    dots = v @ v.T
+    same = (np.abs(dots) if antipodal else dots) >= np.cos(np.deg2rad(angTolDeg))
+    used = np.zeros(len(v), dtype=bool)
+    reps = []
+    groups = []
+    for i in range(len(v)):
+        if used[i]:
+            continue
+        members = np.flatnonzero(same[i] & ~used)
+        used[members] = True
+        reps.append(i)
+        groups.append(members.tolist())
+    return reps, groups
+
+
+def hasAntipodes(vectors, angTolDeg=1.0) -> bool:
+    # True if the antipode of every direction is part of the scheme as well
+    if len(vectors) == 0:
+        return False
+    folded, sign = foldToHemisphere(vectors)
+    sameAxis = (folded @ folded.T) >= np.cos(np.deg2rad(angTolDeg))
+    opposite = sign[:, None] != sign[None, :]
+    return bool(np.all(np.any(sameAxis & opposite, axis=1)))
+
+
+def isFullShell(vectors) -> bool:
+    # directions on both sides of every axis
+    vectors = np.asarray(vectors, dtype=float)
+    return bool(len(vectors) and np.all(np.any(vectors < 0, axis=0)))
+
+
+def analyzeProtocol(bvals, bvecs, bTol=10, angTolDeg=1.0, excludeB0=True, b0Max=20) -> list:
+    bvals = np.asarray(bvals, dtype=float)
+    bvecs = np.asarray(bvecs, dtype=float)
+    if bvecs.ndim == 2 and bvecs.shape[1] != 3:
+        bvecs = bvecs.T
+    assert bvecs.ndim == 2 and bvecs.shape[1] == 3 and bvecs.shape[0] == bvals.shape[0], \
+        "Mismatched bvals/bvecs shape:\n bvals: {}\n bvecs: {}".format(bvals.shape, bvecs.shape)
+    report = []
+    for shellB, idxs in sorted(groupShells(bvals, tol=bTol).items()):
+        if excludeB0 and shellB <= b0Max:
+            continue
+        vecs = bvecs[idxs]
+        reps, _ = uniqueDirections(vecs, angTolDeg=angTolDeg)
+        axes, _ = uniqueDirections(vecs, angTolDeg=angTolDeg, antipodal=True)
+        report.append({
+            "shell_b": shellB,
+            "indices": idxs,
+            "n_dirs": len(reps),
+            "n_axes": len(axes),
+            "is_full_shell": isFullShell(vecs),
+            "has_antipodes": hasAntipodes(vecs, angTolDeg=angTolDeg)
+        })
+    return report
+
+
+def fingerprint(bvals, report, b0Max=20) -> str:
+    """
+    Acquisition scheme as a short string, identical for sessions acquired with the same protocol, e.g.
+    b0x7_b1000x32d32f_b2000x64d64f: the number of b0 volumes, then per shell the b-value (rounded to 10), the number of
+    volumes, of unique directions and whether it is a full (f) or half (h) shell. The directions themselves are not part
+    of it, they are rotated with the slice orientation of each session.
+    """
+    bvals = np.asarray(bvals, dtype=float)
+    parts = [f"b0x{int(np.sum(bvals <= b0Max))}"]
+    for shell in report:
+        parts.append(f"b{int(np.round(shell['shell_b'] / 10) * 10)}x{len(shell['indices'])}"
+                     f"d{shell['n_dirs']}{'f' if shell['is_full_shell'] else 'h'}")
+    return "_".join(parts)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Renders the job dependency graph of a pipe as svg (dagviz metro style). Pipe.visualize_dag2 starts this file as a
+# background process with the graph as json, so that configuration does not wait for the layout of large graphs.
+# Does not import mrpipe, it runs detached from the configuring process.
+import argparse
+import os
+import sys
+import json
+import hashlib
+import subprocess
+
+
+class DagRenderer:
+    """
+    nodes: job name -> processing module, edges: (dependency, job) pairs. The hash covers nodes, modules and edges, a
+    graph with the same hash as the last rendering is not rendered again.
+    """
+
+    def __init__(self, nodes: dict, edges: list):
+        self.nodes = dict(nodes)
+        self.edges = sorted({tuple(edge) for edge in edges})
+
+    def collapsed(self):
+        # one node per processing module, an edge wherever a job depends on a job of another module
+        nodes = {module: module for module in self.nodes.values()}
+        edges = [(self.nodes[a], self.nodes[b]) for a, b in self.edges if self.nodes[a] != self.nodes[b]]
+        return DagRenderer(nodes, edges)
+
+    def hash(self) -> str:
+        content = json.dumps([sorted(self.nodes.items()), self.edges], separators=(",", ":"))
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def hashPath(outPath):
+        return str(outPath) + ".sha1"
+
+    def isCurrent(self, outPath) -> bool:
+        try:
+            with open(DagRenderer.hashPath(outPath), "r") as f:
+                return os.path.isfile(str(outPath)) and f.read().strip() == self.hash()
+        except OSError:
+            return False
+
+    def save(self, path):
+        with open(str(path), "w") as f:
+            json.dump({"nodes": self.nodes, "edges": self.edges}, f)
+
+    @staticmethod
+    def load(path):
+        with open(str(path), "r") as f:
+            graph = json.load(f)
+        return DagRenderer(graph["nodes"], graph["edges"])
+
+    def render(self, outPath):
+        import networkx as nx
+        import dagviz
+        from dagviz.render import render
+        G = nx.DiGraph()
+        for name, module in self.nodes.items():
+            G.add_node(name, community=module)
+        G.add_edges_from(self.edges)
+        svg = render(dagviz.make_abstract_plot(G), dagviz.style.metro.svg_renderer())
+        tmpPath = f"{outPath}.{os.getpid()}.tmp"
+        with open(tmpPath, "wt") as f:
+            f.write(svg)
+        os.replace(tmpPath, str(outPath))
+        # the hash is written last: an interrupted rendering is repeated by the next configuration
+        with open(DagRenderer.hashPath(outPath), "w") as f:
+            f.write(self.hash())
+
+    def renderInBackground(self, outPath, logPath=None):
+        graphPath = str(outPath) + ".json"
+        self.save(graphPath)
+        log = open(str(logPath), "w") if logPath is not None else subprocess.DEVNULL
+        try:
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), graphPath, str(outPath)],
+                                       stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+        finally:
+            if logPath is not None:
+                log.close()
+        return process.pid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a job dependency graph saved by DagRenderer.save as svg.")
+    parser.add_argument("graph", help="Graph json written by DagRenderer.save.")
+    parser.add_argument("output", help="Output svg.")
+    args = parser.parse_args()
+    DagRenderer.load(args.graph).render(args.output)
+    os.remove(args.graph)
+    print(f"Rendered {args.output}")
@@ -0,0 +1,180 @@
+import os
+import time
+import glob
+import fnmatch
+import threading
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LoggerModule import Singleton
+
+logger = LoggerModule.Logger()
+
+
+class _Listing:
+    __slots__ = ("entries", "mtime", "scannedAt", "checkedAt")
+
+    def __init__(self, entries, mtime, scannedAt):
+        self.entries = entries  # name -> [isDir, size or None]; size is filled lazily
+        self.mtime = mtime
+        self.scannedAt = scannedAt
+        self.checkedAt = scannedAt
+
+
+class DirectoryCache(metaclass=Singleton):
+    """
+    Caches one os.scandir() snapshot per directory, so that existence and size checks of many files within the same
+    directory cost a single directory read instead of one stat per file (and per .gz variant).
+    A snapshot is trusted for revalidateSeconds. After that, the directory mtime is compared against the snapshot and
+    the directory is re-read if it changed. Snapshots of directories whose mtime is very close to the time they were
+    read are always re-read on revalidation, since file systems with coarse timestamps may not show a change otherwise.
+    Changes made through the Path class invalidate the affected directory immediately; everything else (e.g. tasks
+    writing their outputs) is covered by clear() once a job finished, or by the revalidation interval.
+    """
+    _racyWindow = 2.0
+
+    def __init__(self):
+        self.enabled = True
+        self.revalidateSeconds = 5.0
+        self._listings = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.scans = 0
+
+    def configure(self, enabled: bool = True, revalidateSeconds: float = None):
+        self.enabled = enabled
+        if revalidateSeconds is not None:
+            self.revalidateSeconds = max(0.0, float(revalidateSeconds))
+        if not enabled:
+            self.clear()
+        logger.info(f"Directory cache enabled: {self.enabled}, revalidation interval: {self.revalidateSeconds}s")
+
+    def _scan(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+            entries = {}
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        entries[entry.name] = [entry.is_dir(), None]
+                    except OSError:
+                        entries[entry.name] = [False, None]
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            mtime, entries = None, None
+        self.scans += 1
+        listing = _Listing(entries, mtime, time.time())
+        self._listings[directory] = listing
+        return listing
+
+    def _getListing(self, directory, refresh=False):
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is None or refresh:
+                return self._scan(directory)
+            now = time.time()
+            if now - listing.checkedAt < self.revalidateSeconds:
+                self.hits += 1
+                return listing
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != listing.mtime or (mtime is not None and listing.scannedAt - mtime < self._racyWindow):
+                return self._scan(directory)
+            listing.checkedAt = now
+            self.hits += 1
+            return listing
+
+    def _lookup(self, path, refresh=False):
+        directory, name = os.path.split(os.path.abspath(path))
+        if not name:  # root directory
+            return [True, None], None
+        listing = self._getListing(directory, refresh=refresh)
+        if listing.entries is None:
+            return None, listing
+        return listing.entries.get(name), listing
+
+    def isFile(self, path, refresh=False) -> bool:
+        if not self.enabled:
+            return os.path.isfile(path)
+        entry, _ = self._lookup(path, refresh)
+        return entry is not None and not entry[0]
+
+    def isDir(self, path, refresh=False) -> bool:
+        if not self.enabled:
+            return os.path.isdir(path)
+        entry, _ = self._lookup(path, refresh)
+        return entry is not None and entry[0]
+
+    def exists(self, path, refresh=False) -> bool:
+        if not self.enabled:
+            return os.path.exists(path)
+        entry, _ = self._lookup(path, refresh)
+        return entry is not None
+
+    def getSize(self, path, refresh=False):
+        if not self.enabled:
+            return os.path.getsize(path) if os.path.exists(path) else None
+        with self._lock:
+            entry, _ = self._lookup(path, refresh)
+            if entry is None:
+                return None
+            if entry[1] is None:
+                try:
+                    entry[1] = os.stat(path).st_size
+                except OSError:
+                    return None
+            return entry[1]
+
+    def listdir(self, directory, refresh=False):
+        if not self.enabled:
+            return os.listdir(directory)
+        listing = self._getListing(os.path.abspath(directory), refresh=refresh)
+        if listing.entries is None:
+            raise FileNotFoundError(f"No such directory: '{directory}'")
+        return list(listing.entries.keys())
+
+    def glob(self, pattern):
+        # glob.glob() for patterns whose wildcards are limited to the file name, answered from the cached listing.
+        pattern = str(pattern)
+        directory, basename = os.path.split(pattern)
+        if not self.enabled or glob.has_magic(directory) or "**" in basename:
+            return glob.glob(pattern)
+        try:
+            names = self.listdir(directory if directory else os.curdir)
+        except FileNotFoundError:
+            return []
+        if not glob.has_magic(basename):
+            return [pattern] if basename in names else []
+        if not basename.startswith("."):
+            names = [name for name in names if not name.startswith(".")]
+        return [os.path.join(directory, name) for name in fnmatch.filter(names, basename)]
+
+    def seed(self, directory, entries: dict, mtime, scannedAt=None):
+        # hands over a listing that was read elsewhere (e.g. by the BidsCrawler). entries: name -> [isDir, size or None]
+        if not self.enabled:
+            return
+        listing = _Listing(entries, mtime, scannedAt if scannedAt is not None else time.time())
+        listing.checkedAt = time.time()
+        with self._lock:
+            self._listings[os.path.abspath(directory)] = listing
+
+    def invalidate(self, path):
+        # drops the listing of the directory containing path (and the listing of path itself, if it is a directory)
+        path = os.path.abspath(path)
+        with self._lock:
+            self._listings.pop(os.path.dirname(path), None)
+            self._listings.pop(path, None)
+
+    def invalidateTree(self, directory):
+        directory = os.path.abspath(directory)
+        prefix = directory.rstrip(os.sep) + os.sep
+        with self._lock:
+            for key in [key for key in self._listings if key == directory or key.startswith(prefix)]:
+                del self._listings[key]
+            self._listings.pop(os.path.dirname(directory), None)
+
+    def clear(self):
+        with self._lock:
+            self._listings.clear()
+
+    def __len__(self):
+        return len(self._listings)
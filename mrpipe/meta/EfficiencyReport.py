@@ -0,0 +1,110 @@
+import os
+import math
+import time
+import html
+import pandas as pd
+from tabulate import tabulate
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LogQuery import LogQuery
+
+logger = LoggerModule.Logger()
+
+GB = 1024 ** 3
+
+
+class EfficiencyReport:
+    """
+    Compares the cores and memory requested for the tasks (cpusPerTask and memPerCPU of their job) with what the task
+    runs actually used, per processing module and task class. Only successful runs with known requests are considered.
+
+    Used cores are the cpu time of the process tree divided by the runtime. Wasted core hours are the requested minus
+    the used core hours. The recommendation covers 95 % of the runs: cpusPerTask is the 95th percentile of the used
+    cores (rounded up), memPerCPU is the largest peak memory plus headroom spread over these cores (whole GB, as
+    requested from Slurm).
+    """
+
+    memoryHeadroom = 1.2
+
+    def __init__(self, query: LogQuery, **filters):
+        self.query = query
+        self.filters = filters
+        self.table = None
+
+    def compute(self) -> pd.DataFrame:
+        runs = self.query.runs(**self.filters)
+        runs = runs[(runs["returncode"] == 0) & (runs["Realtime"] > 0) & runs["RequestedCPUs"].notna()].copy()
+        runs["usedCores"] = runs["Cputime"] / runs["Realtime"]
+        runs["requestedCoreHours"] = runs["RequestedCPUs"] * runs["Realtime"] / 3600
+        runs["usedCoreHours"] = runs["Cputime"] / 3600
+        table = runs.groupby(["processingmodule", "taskclass"], dropna=False).agg(
+            runs=("recordid", "count"),
+            requestedCores=("RequestedCPUs", "median"),
+            usedCoresMean=("usedCores", "mean"),
+            usedCoresP95=("usedCores", lambda s: s.quantile(0.95)),
+            requestedMemory=("RequestedMemory", "median"),
+            peakMemoryP95=("PeakRSS", lambda s: s.quantile(0.95)),
+            peakMemoryMax=("PeakRSS", "max"),
+            requestedCoreHours=("requestedCoreHours", "sum"),
+            usedCoreHours=("usedCoreHours", "sum"))
+        table["cpuEfficiency"] = table["usedCoreHours"] / table["requestedCoreHours"]
+        table["wastedCoreHours"] = (table["requestedCoreHours"] - table["usedCoreHours"]).clip(lower=0)
+        table["recommendedCpusPerTask"] = table["usedCoresP95"].map(lambda c: max(1, math.ceil(round(c, 1))) if pd.notna(c) else None)
+        table["recommendedMemPerCPU"] = [max(1, math.ceil(peak * EfficiencyReport.memoryHeadroom / GB / cpus))
+                                         if pd.notna(peak) and cpus else None
+                                         for peak, cpus in zip(table["peakMemoryMax"], table["recommendedCpusPerTask"])]
+        self.table = table.sort_values("wastedCoreHours", ascending=False)
+        return self.table
+
+    def formatted(self) -> pd.DataFrame:
+        table = self.compute() if self.table is None else self.table
+        out = pd.DataFrame(index=table.index)
+        out["runs"] = table["runs"]
+        out["cores requested"] = table["requestedCores"].round(1)
+        out["cores used (mean / p95)"] = table["usedCoresMean"].round(1).astype(str) + " / " + table["usedCoresP95"].round(1).astype(str)
+        out["cpu efficiency [%]"] = (table["cpuEfficiency"] * 100).round(1)
+        out["memory requested [GB]"] = (table["requestedMemory"] / GB).round(1)
+        out["peak memory (p95 / max) [GB]"] = (table["peakMemoryP95"] / GB).round(2).astype(str) + " / " + (table["peakMemoryMax"] / GB).round(2).astype(str)
+        out["wasted core hours"] = table["wastedCoreHours"].round(1)
+        out["recommended cpusPerTask"] = table["recommendedCpusPerTask"]
+        out["recommended memPerCPU [GB]"] = table["recommendedMemPerCPU"]
+        return out
+
+    def log(self):
+        table = self.formatted()
+        if table.empty:
+            logger.process("No successful task runs with recorded resource requests in the log database.")
+            return
+        logger.process(f"Resource efficiency per processing module and task class, {self.table['wastedCoreHours'].sum():.1f} core hours wasted in total:\n"
+                       + tabulate(table.rename_axis(["module", "task class"]).reset_index(), headers="keys", showindex=False))
+
+    def writeHTML(self, path):
+        table = self.formatted()
+        rows = []
+        for (module, taskClass), row in table.iterrows():
+            efficiency = row["cpu efficiency [%]"]
+            style = ' class="low"' if pd.notna(efficiency) and efficiency < 50 else ""
+            cells = "".join(f"<td>{html.escape(str(value))}</td>" for value in row.values)
+            rows.append(f"<tr{style}><td>{html.escape(str(module))}</td><td>{html.escape(str(taskClass))}</td>{cells}</tr>")
+        header = "".join(f"<th>{html.escape(column)}</th>" for column in ["module", "task class"] + list(table.columns))
+        document = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>mrpipe resource efficiency</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th {{ background: #eee; }}
+td:nth-child(-n+2) {{ text-align: left; }}
+tr.low {{ background: #fde2e2; }}
+</style></head><body>
+<h1>Resource efficiency</h1>
+<p>Generated {time.strftime("%Y-%m-%d %H:%M")} from {len(table)} task classes, {int(table["runs"].sum()) if not table.empty else 0} successful task runs.
+Rows with a cpu efficiency below 50 % are highlighted. {html.escape(" ".join((EfficiencyReport.__doc__ or "").split()))}</p>
+<table><thead><tr>{header}</tr></thead><tbody>
+{chr(10).join(rows)}
+</tbody></table></body></html>
+"""
+        tmpPath = str(path) + ".tmp"
+        with open(tmpPath, "w") as f:
+            f.write(document)
+        os.replace(tmpPath, str(path))
+        logger.process(f"Wrote resource efficiency report to {path}")
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import shutil
+import fnmatch
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LoggerModule import Singleton
+from mrpipe.meta.DirectoryCache import DirectoryCache
+
+logger = LoggerModule.Logger()
+
+ValidGCActions = ["delete", "archive", "report"]
+
+
+def _key(path) -> str:
+    # same identity as Path: absolute file name without a trailing .gz
+    key = os.path.abspath(str(path))
+    return key[:-3] if key.endswith(".gz") else key
+
+
+def _onDisk(path):
+    # the variant of path (x.nii / x.nii.gz) which exists on disk, or None
+    path = os.path.abspath(str(path))
+    for candidate in [path, path[:-3] if path.endswith(".gz") else path + ".gz"]:
+        if os.path.lexists(candidate):
+            return candidate
+    return None
+
+
+def _size(path) -> int:
+    if os.path.isdir(path) and not os.path.islink(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files
+                   if not os.path.islink(os.path.join(root, f)))
+    return os.lstat(path).st_size
+
+
+class GarbageCollector(metaclass=Singleton):
+    """
+    Removes intermediate files (paths marked with setCleanup()) once every task reading them has finished. Which tasks
+    write and read a file is taken from the file registry of the pipe (see FileRegistry), the state of the tasks from
+    their pickled jobs.
+
+    Every collected file is recorded in a ledger in the pipe directory. Tasks whose outputs were collected still count
+    as precomputed; if a task has to run again and needs a collected file, its producer is recomputed first
+    (see Pipe.reviveCollectedInputs). Files matching a pattern in the keep list (gcKeep.txt, one glob pattern per line,
+    matched against the full path or the file name) are never collected.
+
+    Actions:
+        delete:  remove the files
+        archive: move the files below an archive directory, mirroring their absolute path
+        report:  only list what would be collected
+    """
+
+    ledgerName = "gcLedger.json"
+    keepName = "gcKeep.txt"
+
+    def __init__(self):
+        self.pipePath = None
+        self.ledger = {}  # canonical path -> record of the collection
+        self.keepPatterns = []
+
+    def load(self, pipePath):
+        self.pipePath = str(pipePath)
+        ledgerPath = os.path.join(self.pipePath, GarbageCollector.ledgerName)
+        self.ledger = {}
+        if os.path.isfile(ledgerPath):
+            try:
+                with open(ledgerPath, "r") as f:
+                    self.ledger = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.logExceptionError(f"Could not read garbage collection ledger {ledgerPath}, ignoring it.", e)
+        # files which exist again (their producer was recomputed) are no longer collected
+        revived = [key for key in self.ledger if _onDisk(key)]
+        for key in revived:
+            del self.ledger[key]
+        if revived:
+            self._writeLedger()
+
+        keepPath = os.path.join(self.pipePath, GarbageCollector.keepName)
+        if os.path.isfile(keepPath):
+            with open(keepPath, "r") as f:
+                self.keepPatterns = [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+        else:
+            with open(keepPath, "w") as f:
+                f.write("# Intermediate files matching any of the following glob patterns are never removed by the garbage collector.\n"
+                        "# One pattern per line, matched against the full path or the file name, e.g.:\n"
+                        "# *_InverseWarped.nii.gz\n")
+            self.keepPatterns = []
+
+    def _writeLedger(self):
+        ledgerPath = os.path.join(self.pipePath, GarbageCollector.ledgerName)
+        tmpPath = ledgerPath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.ledger, f, indent=1)
+        os.replace(tmpPath, ledgerPath)
+
+    def isCollected(self, path) -> bool:
+        return bool(self.ledger) and _key(path) in self.ledger
+
+    def isKept(self, path) -> bool:
+        path = str(path)
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in self.keepPatterns)
+
+    def collectable(self, registry, jobDone):
+        # registry: as written by FileRegistry.save(), jobDone: callable(jobDir) -> True if the job does not run anymore
+        tasks = registry["tasks"]
+        jobs = {}
+
+        def taskDone(taskId):
+            task = tasks[taskId]
+            if task["job"] not in jobs:
+                jobs[task["job"]] = jobDone(task["job"])
+            # a failed task did not write all of its outputs and may be rerun, so it still needs its inputs
+            return jobs[task["job"]] and all(_onDisk(f) or self.isCollected(f) for f in task["outFiles"])
+
+        candidates = []
+        for path in registry.get("intermediate", []):
+            existing = _onDisk(path)
+            if existing is None or self.isKept(path):
+                continue
+            if all(taskDone(t) for t in registry["producers"].get(path, [])) and \
+                    all(taskDone(t) for t in registry["consumers"].get(path, [])):
+                candidates.append(existing)
+        return candidates
+
+    def collect(self, registry, jobDone, action: str = "delete", archiveRoot: str = None):
+        if action not in ValidGCActions:
+            logger.error(f"Invalid garbage collection action '{action}', must be one of {ValidGCActions}.")
+            return
+        if action == "archive" and not archiveRoot:
+            logger.error("Garbage collection action archive requires an archive directory (--gcArchiveRoot).")
+            return
+        candidates = self.collectable(registry, jobDone)
+        collected = 0
+        collectedBytes = 0
+        for path in candidates:
+            try:
+                size = _size(path)
+                if action == "report":
+                    logger.process(f"Collectable: {path} ({size / 1024 ** 2:.1f} MB)")
+                    collectedBytes += size
+                    continue
+                target = None
+                isDir = os.path.isdir(path) and not os.path.islink(path)
+                if action == "archive":
+                    target = os.path.join(archiveRoot, os.path.relpath(path, os.sep))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                elif isDir:
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                DirectoryCache().invalidate(path)
+                if isDir:
+                    DirectoryCache().invalidateTree(path)
+                self.ledger[_key(path)] = {"file": path, "action": action, "archive": target, "bytes": size,
+                                           "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+                collected += 1
+                collectedBytes += size
+            except OSError as e:
+                logger.logExceptionError(f"Could not collect intermediate file {path}", e)
+        if action == "report":
+            logger.process(f"{len(candidates)} intermediate files ({collectedBytes / 1024 ** 3:.2f} GB) can be collected.")
+            return
+        if collected:
+            self._writeLedger()
+        logger.process(f"Garbage collection ({action}): {collected} intermediate files, {collectedBytes / 1024 ** 3:.2f} GB.")
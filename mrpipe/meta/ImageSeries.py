@@ -8,17 +8,14 @@ from nibabel.nicom.utils import find_private_section
 from mrpipe.meta.ImageWithSideCar import ImageWithSideCar
 from mrpipe.meta import LoggerModule
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.DirectoryCache import DirectoryCache
+from mrpipe.meta import DWIProtocol
 from mrpipe.Helper import Helper
 from typing import List
 from numpy import cross
 import glob
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-import matplotlib.colors as colors
-import pandas as pd
-from matplotlib import animation
 
 logger = LoggerModule.Logger()
 
@@ -32,8 +29,8 @@ class MEGRE():
         self.phase = []
 
         if inputDirectory is not None:
-            niftiFiles = glob.glob(str(inputDirectory.join("*.nii*")))
-            jsonFiles = glob.glob(str(inputDirectory.join("*.json")))
+            niftiFiles = DirectoryCache().glob(str(inputDirectory.join("*.nii*")))
+            jsonFiles = DirectoryCache().glob(str(inputDirectory.join("*.json")))
             if len(niftiFiles) <= 1:
                 logger.error("No nifti files found. Will not proceed. Directory of files: " + str(inputDirectory))
                 #TODO maybe solve this more gracefully: if file is not found config exits, but realy the processing module should get removed with an error from the session.
@@ -174,6 +171,7 @@ class DWI():
         self.is_non_gaussian = None
         self.nb0s = None
         self.report = None
+        self.protocolFingerprint = None
         self.TotalReadoutTime = None
 
         #atributes of reverse encoded Image
@@ -186,14 +184,15 @@ class DWI():
         self.is_non_gaussian_reverse = None
         self.nb0s_reverse = None
         self.report_reverse = None
+        self.protocolFingerprint_reverse = None
         self.TotalReadoutTime_reverse = None
 
 
         if inputDirectory is not None:
-            potential_images4d_filepaths = list(glob.glob(str(inputDirectory.join("*.nii*"))))
-            potential_sidecar_filepaths = list(glob.glob(str(inputDirectory.join("*.json"))))
-            potential_bval_filepaths = list(glob.glob(str(inputDirectory.join("*.bval"))))
-            potential_bvec_filepaths = list(glob.glob(str(inputDirectory.join("*.bvec"))))
+            potential_images4d_filepaths = list(DirectoryCache().glob(str(inputDirectory.join("*.nii*"))))
+            potential_sidecar_filepaths = list(DirectoryCache().glob(str(inputDirectory.join("*.json"))))
+            potential_bval_filepaths = list(DirectoryCache().glob(str(inputDirectory.join("*.bval"))))
+            potential_bvec_filepaths = list(DirectoryCache().glob(str(inputDirectory.join("*.bvec"))))
 
             if len(potential_images4d_filepaths) < 1:
                 logger.error("No nifti files found. Will not proceed. Directory of files: " + str(inputDirectory))
@@ -302,8 +301,8 @@ class DWI():
         if self.image and self.image.imagePath.exists():
             if self.bval.exists():
                 # self.bval_vec = np.genfromtxt(self.bval, dtype=int, delimiter=' ', names=None) # some files have multiple spaces as seperator, the this does not work
-                self.diffShemeExact = pd.read_csv(self.bval, header=None, sep=r'\s+', nrows=1, dtype=float).values.flatten().tolist()
-                self.diffShemeRounded = list([np.round(y / 10) * 10 for y in self.diffShemeExact])
+                self.diffShemeExact = DWIProtocol.readBvals(self.bval).tolist()
+                self.diffShemeRounded = (np.round(np.asarray(self.diffShemeExact) / 10) * 10).tolist()
                 if not DWI.bavl_rounding_warning_thrown and len(self.diffShemeRounded) != len(self.diffShemeExact):
                     logger.error(f"DWI bval file contains minor variations in diffusion strength, shells will be rounded to determine protocol structure. Original: {self.diffShemeExact}, rounded: {self.diffShemeRounded}")
                 self.nb0s = sum([x <= self.bval_tol for x in self.diffShemeExact])
@@ -334,12 +333,13 @@ class DWI():
                 return False
             if self.bvec.exists():
                 # self.bvec_mat = np.genfromtxt(self.bvec, dtype=int, delimiter=' ', names=None)
-                self.bvec_mat = pd.read_csv(self.bvec, header=None, sep=r'\s+', nrows=3, dtype=float).to_numpy()
-                self.report = DWI.analyze_protocol(bvals=self.diffShemeExact,
-                                                   bvecs=self.bvec_mat,
-                                                   b_tol=self.bval_tol,
-                                                   b0_max=self.bval_tol)
+                self.bvec_mat = DWIProtocol.readBvecs(self.bvec)
+                self.report = DWIProtocol.analyzeProtocol(bvals=self.diffShemeExact,
+                                                          bvecs=self.bvec_mat,
+                                                          bTol=self.bval_tol,
+                                                          b0Max=self.bval_tol)
                 self.is_fullshell = all([r["is_full_shell"] for r in self.report])
+                self.protocolFingerprint = DWIProtocol.fingerprint(self.diffShemeExact, self.report, b0Max=self.bval_tol)
             else:
                 return False
         self.TotalReadoutTime = self.image.getAttribute("TotalReadoutTime")
@@ -349,8 +349,8 @@ class DWI():
         if self.image_reverse and self.image_reverse.imagePath.exists(acceptCache = True):
             if self.bval_reverse.exists(acceptCache = True):
                 # self.bval_vec = np.genfromtxt(self.bval, dtype=int, delimiter=' ', names=None) # some files have multiple spaces as seperator, the this does not work
-                self.diffShemeExact_reverse = pd.read_csv(self.bval_reverse, header=None, sep=r'\s+', nrows=1, dtype=float).values.flatten().tolist()
-                self.diffShemeRounded_reverse = list([np.round(y / 10) * 10 for y in self.diffShemeExact_reverse])
+                self.diffShemeExact_reverse = DWIProtocol.readBvals(self.bval_reverse).tolist()
+                self.diffShemeRounded_reverse = (np.round(np.asarray(self.diffShemeExact_reverse) / 10) * 10).tolist()
                 if not DWI.bavl_rounding_warning_thrown and len(self.diffShemeRounded_reverse) != len(self.diffShemeExact_reverse):
                     logger.error(f"DWI bval file contains minor variations in diffusion strength, shells will be rounded to determine protocol structure. Original: {self.diffShemeExact}, rounded: {self.diffShemeRounded}")
                 self.nb0s_reverse = sum([x <= self.bval_tol for x in self.diffShemeExact_reverse])
@@ -374,14 +374,15 @@ class DWI():
                     self.image_encoding_direction_reverse = self.image_reverse.getAttribute("PhaseEncodingAxis")
             else:
                 return False
-            if self.bvec.exists(acceptCache = True):
+            if self.bvec_reverse.exists(acceptCache = True):
                 # self.bvec_mat = np.genfromtxt(self.bvec, dtype=int, delimiter=' ', names=None)
-                self.bvec_mat_reverse = pd.read_csv(self.bvec_reverse, header=None, sep=r'\s+', nrows=3, dtype=float).to_numpy()
-                self.report_reverse = DWI.analyze_protocol(bvals=self.diffShemeExact_reverse,
-                                                           bvecs=self.bvec_mat_reverse,
-                                                           b_tol=self.bval_tol,
-                                                           b0_max=self.bval_tol)
+                self.bvec_mat_reverse = DWIProtocol.readBvecs(self.bvec_reverse)
+                self.report_reverse = DWIProtocol.analyzeProtocol(bvals=self.diffShemeExact_reverse,
+                                                                  bvecs=self.bvec_mat_reverse,
+                                                                  bTol=self.bval_tol,
+                                                                  b0Max=self.bval_tol)
                 self.is_fullshell_reverse  = all([r["is_full_shell"] for r in self.report_reverse])
+                self.protocolFingerprint_reverse = DWIProtocol.fingerprint(self.diffShemeExact_reverse, self.report_reverse, b0Max=self.bval_tol)
             else:
                 return False
             self.TotalReadoutTime_reverse = self.image_reverse.getAttribute("TotalReadoutTime")
@@ -437,259 +438,3 @@ class DWI():
             logger.error(f"Not enough directions in bval file ({len(self.diffShemeExact)} < {self.minDirections}): {self.image.imagePath}. IGNORING SESSION!")
             return False
         return True
-
-    def render_rotation_self(self, filename):
-        DWI.render_rotation(bvals=self.diffShemeRounded,
-                            bvecs=self.bvec_mat,
-                            report = self.report,
-                            filename=filename,
-                            figsize=(4, 4), dpi=104, elev=20, frames=20, fps=6, scale_mode="relative")
-
-
-    @staticmethod
-    def has_antipodes(vectors, ang_tol_deg=1.0):
-        """
-        Determine if for each unique direction, its antipode is present
-        within angular tolerance. Returns True if full-shell (antipodal
-        coverage), False if half-shell.
-        """
-
-        from collections import defaultdict
-        v = DWI.normalize_vectors(vectors)
-        n = len(v)
-        if n == 0:
-            return False
-        cos_tol = np.cos(np.deg2rad(ang_tol_deg))
-
-        # Build a quick search structure by hashing rounded coords
-        def key(vec, k=3):
-            return tuple(np.round(vec, k))
-
-        buckets = defaultdict(list)
-        for i, vec in enumerate(v):
-            buckets[key(vec)].append(i)
-        # For each direction, check existence of antipode within tolerance
-        for i in range(n):
-            antipode = -v[i]
-            # candidates: check near rounded key and neighboring roundings
-            found = False
-            # Try multiple rounding granularities for robustness
-            for k in (3, 2, 4):
-                cand = buckets.get(tuple(np.round(antipode, k)), [])
-                if cand:
-                    # verify angular match
-                    if np.max(v[cand] @ antipode) >= cos_tol:
-                        found = True
-                        break
-            if not found:
-                # also do a brute-force fallback if hashing misses
-                dots = v @ antipode
-                if np.max(dots) >= cos_tol:
-                    found = True
-            if not found:
-                return False
-        return True
-
-    @staticmethod
-    def normalize_vectors(bvecs, eps=1e-12):
-        bvecs = np.asarray(bvecs, dtype=float)
-        norms = np.linalg.norm(bvecs, axis=1, keepdims=True)
-        norms = np.where(norms < eps, 1.0, norms)
-        return bvecs / norms
-
-    @staticmethod
-    def group_shells(bvals, tol=50):
-        bvals = np.asarray(bvals).astype(float)
-        sorted_idx = np.argsort(bvals)
-        shells = []
-        for idx in sorted_idx:
-            b = bvals[idx]
-            placed = False
-            for sb, members in shells:
-                if abs(b - sb) <= tol:
-                    members.append(idx)
-                    placed = True
-                    break
-            if not placed:
-                shells.append([b, [idx]])
-        shell_map = {}
-        for _, members in shells:
-            b_mean = float(np.mean(bvals[members]))
-            shell_map[b_mean] = members
-        return shell_map
-
-    @staticmethod
-    def normalize_vectors(bvecs, eps=1e-12):
-        bvecs = np.asarray(bvecs, dtype=float)
-        norms = np.linalg.norm(bvecs, axis=1, keepdims=True)
-        norms = np.where(norms < eps, 1.0, norms)
-        return bvecs / norms
-
-    @staticmethod
-    def unique_directions(vectors, ang_tol_deg=1.0):
-        v = DWI.normalize_vectors(vectors)
-        used = np.zeros(len(v), dtype=bool)
-        reps = []
-        groups = []
-        cos_tol = np.cos(np.deg2rad(ang_tol_deg))
-        for i in range(len(v)):
-            if used[i]:
-                continue
-            rep = v[i]
-            same = []
-            for j in range(i, len(v)):
-                if used[j]:
-                    continue
-                c = np.dot(rep, v[j])
-                if c >= cos_tol:
-                    same.append(j)
-                    used[j] = True
-            reps.append(i)
-            groups.append(same)
-        return reps, groups
-
-    @staticmethod
-    def is_fullshell(vectors):
-        if not any(vectors[:, 0] < 0):
-            return False
-        if not any(vectors[:, 1] < 0):
-            return False
-        if not any(vectors[:, 2] < 0):
-            return False
-        return True
-
-    @staticmethod
-    def analyze_protocol(bvals, bvecs, b_tol=10, ang_tol_deg=1.0, exclude_b0=True, b0_max=20):
-        bvals = np.asarray(bvals).astype(float)
-        bvecs = np.asarray(bvecs).astype(float)
-        if bvecs.shape[1] != 3:
-            bvecs = np.transpose(bvecs)
-        assert bvecs.shape[1] == 3 and bvecs.shape[0] == bvals.shape[0], "Mismatched bvals/bvecs shape:\n bvals: {}\n bvecs: {}".format(bvals.shape, bvecs.shape)
-        shells = DWI.group_shells(bvals, tol=b_tol)
-        report = []
-        for shell_b, idxs in sorted(shells.items(), key=lambda kv: kv[0]):
-            if exclude_b0 and shell_b <= b0_max:
-                continue
-            vecs = bvecs[idxs]
-            reps, _ = DWI.unique_directions(vecs, ang_tol_deg=ang_tol_deg)
-            n_dirs = len(reps)
-            full = DWI.is_fullshell(vecs)
-            report.append({
-                "shell_b": shell_b,
-                "indices": idxs,
-                "n_dirs": n_dirs,
-                "is_full_shell": full
-            })
-        return report
-
-    @staticmethod
-    def plot_shells_as_arrows(ax, bvals, bvecs, report, elev=20, azim=30, scale_mode="relative"):
-        """
-        Plot arrows (quivers) from origin in direction of b-vectors.
-        Arrow length is scaled by corresponding b-value.
-        """
-
-        bvals = np.asarray(bvals).astype(float)
-        bvecs = DWI.normalize_vectors(np.asarray(bvecs).astype(float))
-
-        # Scaling
-        all_idxs = np.concatenate([np.asarray(s["indices"], dtype=int) for s in report]) if report else np.array([], dtype=int)
-        b_for_scale = bvals[all_idxs] if len(all_idxs) else np.array([1.0])
-        b_max = float(np.max(b_for_scale)) if np.any(b_for_scale > 0) else 1.0
-
-        def length_from_b(b):
-            if scale_mode == "absolute":
-                return b
-            return 0.2 + 0.8 * (b / b_max if b_max > 0 else 0.0)
-
-        color_map1 = ["#E41A1C", "#4DAF4A", "#984EA3", "#F781BF", "#FF7F00", "#A65628", "#377EB8"]
-        color_map = colors.ListedColormap(color_map1)
-        # colors = plt.get_cmap('tab10', max(1, len(report)))
-
-        legend_handles = []
-        for i, shell in enumerate(report):
-            idxs = np.asarray(shell["indices"], dtype=int)
-            vecs = bvecs[idxs]
-            bs = bvals[idxs]
-            lengths = np.vectorize(length_from_b)(bs)
-            U = vecs[:, 0] * lengths
-            V = vecs[:, 1] * lengths
-            W = vecs[:, 2] * lengths
-
-            ax.quiver(
-                np.zeros_like(U), np.zeros_like(V), np.zeros_like(W),
-                U, V, W,
-                length=1.0, normalize=False, color=color_map(i), linewidth=0.8, arrow_length_ratio=0.12, alpha=0.4,
-            )
-
-            # Build legend entry per shell (color only)
-            label = f"b≈{int(round(shell['shell_b']))} | {shell['n_dirs']} dirs | {'full' if shell['is_full_shell'] else 'half'}"
-            legend_handles.append(Line2D([0], [0], color=color_map(i), lw=3, label=label))
-
-        # # Context sphere
-        # u = np.linspace(0, 2*np.pi, 60)
-        # v = np.linspace(0, np.pi, 30)
-        # xs = np.outer(np.cos(u), np.sin(v))
-        # ys = np.outer(np.sin(u), np.sin(v))
-        # zs = np.outer(np.ones_like(u), np.cos(v))
-        # ax.plot_wireframe(xs, ys, zs, rstride=6, cstride=6, color='gray', alpha=0.3, linewidth=1)
-
-        ax.set_box_aspect([1, 1, 1])
-        ax.set_xlim([-1, 1])
-        ax.set_ylim([-1, 1])
-        ax.set_zlim([-1, 1])
-        ax.view_init(elev=elev, azim=azim)
-        ax.set_xlabel('X')
-        ax.set_ylabel('Y')
-        ax.set_zlabel('Z')
-
-        # Color legend for shells
-        ax.legend(handles=legend_handles, title="b-shells", loc='lower center', bbox_to_anchor=(0.5, -0.2), borderaxespad=0.)
-
-        plt.tight_layout()
-        ax.grid(False)
-        ax.set_xticks([])
-        ax.set_yticks([])
-        ax.set_zticks([])
-        return ax
-
-    @staticmethod
-    def render_rotation(bvals, bvecs, report, filename, figsize=(4, 4), dpi=72, elev=20, frames=45, fps=8, scale_mode="relative"):
-        """
-        Create a 360° rotation animation around the vertical axis (azimuth).
-        filename: ends with .mp4 (preferred) or .gif (needs ImageMagick or Pillow writer).
-        """
-        fig = plt.figure(figsize=figsize)
-        ax = fig.add_subplot(111, projection='3d')
-        if bvecs.shape[1] != 3:
-            bvecs = np.transpose(bvecs)
-        DWI.plot_shells_as_arrows(ax, bvals, bvecs, report, scale_mode=scale_mode)
-
-        def init():
-            ax.view_init(elev=elev, azim=0)
-            return (fig,)
-
-        def animate(f):
-            az = 360.0 * (f / frames)
-            ax.view_init(elev=elev, azim=az)
-            return (fig,)
-
-        anim = animation.FuncAnimation(fig, animate, init_func=init, frames=frames, interval=1000 / fps, blit=False)
-
-        if filename.lower().endswith(".mp4"):
-            try:
-                writer = animation.FFMpegWriter(fps=fps, bitrate=3000)
-                anim.save(filename, writer=writer, dpi=dpi)
-            except Exception as e:
-                print("FFmpeg writer not available or failed:", e)
-                print("Try installing FFmpeg, or save as GIF instead.")
-        elif filename.lower().endswith(".gif"):
-            try:
-                anim.save(filename, writer='pillow', fps=fps)
-            except Exception as e:
-                print("Pillow writer not available or failed:", e)
-                print("Ensure Pillow is installed and try again.")
-        else:
-            print("Unsupported extension. Use .mp4 or .gif.")
-
-        plt.close(fig)
\ No newline at end of file
@@ -1,8 +1,8 @@
 from mrpipe.meta import LoggerModule
 from abc import ABC, abstractmethod
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.SidecarCache import SidecarCache
 import os
-import json
 
 logger = LoggerModule.Logger()
 
@@ -19,7 +19,8 @@ class ImageWithSideCar():
         self.attributes = {}
         self.attributesLoaded = False
         self.jsonCorrupted = False
-        if os.path.basename(self.imagePath).split(".")[0] != os.path.basename(self.jsonPath).split(".")[0]:
+        if isinstance(imagePath, Path) and isinstance(jsonPath, Path) and \
+                os.path.basename(self.imagePath).split(".")[0] != os.path.basename(self.jsonPath).split(".")[0]:
             logger.error("Image name and json name differ, this is an unlikely occursion. Please check whether they truely match. Processing will continue as normal though.")
 
     def _loadAttributesFromJson(self):
@@ -33,8 +34,7 @@ class ImageWithSideCar():
         if len(self.attributes) != 0:
             logger.info(f"Found {len(self.attributes)} file patterns already in class. This will overwrite any existing patterns")
         try:
-            with open(self.jsonPath, 'r') as file:
-                self.attributes.update(json.load(file))
+            self.attributes.update(SidecarCache().get(self.jsonPath))
         except Exception as e:
             logger.error(f"Error while trying to read json file: {e}")
             self.jsonCorrupted = True
@@ -15,8 +15,8 @@ def inputParser():
         description='Fully automated graph-based multimodal integrative MRI pre- and postprocessing pipeline.',
         formatter_class=ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument(dest="mode", type=str, choices=['config', 'process', 'step', 'flowchart', 'scriptexport'],
-                        help="Mode of operation: \nconfig creates a data config for a dataset. Be aware, that config sets up everything at the same level as the input directory.\nprocess takes a configured data set and processes it.\nstep is an internal method to run a processing step. May be used for debugging if given a PipeJop directory to run a single job. Be aware that it will also run all followup steps if specified.\nflowchart generates flow charts for processing modules showing tasks, input/output files, and dependencies.\nscriptexport creates a processing script (shell script) for each configured modul which must be then edited for paths and commands. This can be used to export the pipeline logic to different computers/clusters where implementing mrpipe is not an option.")
+    parser.add_argument(dest="mode", type=str, choices=['config', 'process', 'step', 'flowchart', 'scriptexport', 'gc', 'collect', 'stats', 'trace', 'efficiency', 'metrics'],
+                        help="Mode of operation: \nconfig creates a data config for a dataset. Be aware, that config sets up everything at the same level as the input directory.\nprocess takes a configured data set and processes it.\nstep is an internal method to run a processing step. May be used for debugging if given a PipeJop directory to run a single job. Be aware that it will also run all followup steps if specified.\nflowchart generates flow charts for processing modules showing tasks, input/output files, and dependencies.\nscriptexport creates a processing script (shell script) for each configured modul which must be then edited for paths and commands. This can be used to export the pipeline logic to different computers/clusters where implementing mrpipe is not an option.\ngc removes intermediate files of a configured pipe which are not read by any unfinished task anymore.\ncollect moves the spooled resource records and outputs of finished tasks into the log database. Also done at the start of every job.\nstats prints runtime, memory and failure rate of the task runs in the log database (see --statsBy).\ntrace exports a timeline of the task runs and Slurm jobs (queue wait, setup, tasks) as Chrome trace json for ui.perfetto.dev or chrome://tracing.\nefficiency compares requested and used cores and memory per processing module and task class and recommends cpusPerTask and memPerCPU (printed and as html).\nmetrics writes jobs by status, finished and failed tasks, queue depth, task runtimes and the estimated completion time in the Prometheus text format, e.g. for the node_exporter textfile collector.")
     parser.add_argument(dest="input", type=str,
                         metavar="/path/to/input",
                         help="Input: Either path to data bids directory if in config or process mode or path to to PipeJop directory if in step mode.")
@@ -52,7 +52,15 @@ def inputParser():
                         help="""Visualization mode:\n\t- "per_module": One flow chart per module (default)\n\t- "all_modules": Single comprehensive flow chart with all modules\n\t- "minimal": Single flow chart with minimal design (task names only, file nodes as dots)""")
     # Optional export of per-modality scan inventory during process mode
     parser.add_argument('--noScanInventory', dest='noScanInventory', action='store_true',
-                        help='Disable exporting per-modality scan inventory CSVs during process mode (default is to export).')
+                        help='Disable exporting the per-modality scan inventory during configuration (default is to export).')
+    parser.add_argument('--scanInventoryCSV', dest='scanInventoryCSV', action='store_true',
+                        help='Also write the scan inventory as one csv per modality, next to scanInventory.sqlite in meta_QC/scan_inventory.')
+    parser.add_argument('--dagVis', dest='dagVis', type=str, default="auto", choices=["auto", "on", "off"],
+                        help='Render the job dependency graph (DependencyGraph2.svg in the pipe directory) in a background process. auto renders only when started from a terminal, not in batch runs. The graph is only rendered again if it changed.')
+    parser.add_argument('--dagCollapse', dest='dagCollapse', action='store_true',
+                        help='Render one node per processing module instead of one node per job (DependencyGraph2_modules.svg), a fast and readable overview of large pipelines.')
+    parser.add_argument('--noDWIShellVis', dest='noDWIShellVis', action='store_true',
+                        help='Do not render the rotating 3D view of the DWI diffusion directions per session (QC job dwi_base_shellVis). The protocol checks of the scan inventory are not affected.')
     parser.add_argument('--bval_tol', dest='bval_tol', type=check_positive, default=20,
                         help='Tolerance to determine shells and b0 values for DWI data. Sometimes the b-values are slightly varying e.g. 995/1000/1005 or 0/5, and this is to capture this range and assign it to the same shell. The difference in b-values between shells is usually > 100')
     parser.add_argument('--non_gaussian_cutoff', dest='non_gaussian_cutoff', type=check_positive, default=1500,
@@ -64,6 +72,72 @@ def inputParser():
     parser.add_argument('--schedulerType', dest="schedulerType", type=str, default="Slurm", choices=['Slurm', 'Local'],
                        help="""Scheduler mode: How to run the pipeline: "Slurm" submits a self submitting pipeline of jobs using sbatch. "Local" runs as continuous job locally in the terminal.""")
 
+    parser.add_argument('--profile', dest="profile", action="store_true",
+                        help="Record wall time, cpu time, filesystem call counts and memory growth per configure phase and per processing module. The report is written as json and html to the profile directory inside the pipe directory.")
+    parser.add_argument('--profileCProfile', dest="profileCProfile", action="store_true",
+                        help="Implies --profile. Additionally captures a cProfile (.prof) file per top level configure phase, which can be inspected with e.g. snakeviz or pstats.")
+    parser.add_argument('--noFsCache', dest="noFsCache", action="store_true",
+                        help="Disable the directory listing cache used for file existence checks and query the file system for every file instead. Only useful for debugging or for file systems where directory modification times are unreliable.")
+    parser.add_argument('--fsCacheSeconds', dest="fsCacheSeconds", type=float, default=5.0,
+                        help="Seconds a cached directory listing is trusted before the directory modification time is checked again.")
+    parser.add_argument('--crawlerThreads', dest="crawlerThreads", type=int, default=16,
+                        help="Number of threads used to crawl the BIDS directory. Higher numbers help on network file systems with high latency.")
+    parser.add_argument('--fullRescan', dest="fullRescan", action="store_true",
+                        help="Ignore the BIDS manifest of previous runs and rescan every directory of the BIDS tree.")
+    parser.add_argument('--noSidecarsInManifest', dest="noSidecarsInManifest", action="store_true",
+                        help="Do not keep the parsed json sidecars in the BIDS manifest. Sidecars are then parsed once per configuration instead of once while unchanged, which keeps the manifest small for very large datasets.")
+    parser.add_argument('--configThreads', dest="configThreads", type=int, default=8,
+                        help="Number of threads used to configure subject paths in parallel. Subjects which need user input (e.g. to confirm a new file pattern) are configured afterwards one by one. Set to 1 to configure all subjects sequentially.")
+    parser.add_argument('--materializeMode', dest="materializeMode", type=str, default="auto", choices=["auto", "reflink", "hardlink", "symlink", "copy"],
+                        help="How raw input images are made available in the derivatives tree. auto tries a reflink (copy-on-write clone) and falls back to a copy. hardlink and symlink share the content with the raw BIDS file: a processing tool writing its input in place would change the raw data, only use them if no tool does.")
+    parser.add_argument('--compressionPolicy', dest="compressionPolicy", type=str, default="declared", choices=["declared", "keep", "compress", "decompress"],
+                        help="What to do with final files which exist in another compression variant (.nii vs .nii.gz) than declared. declared converts them to the declared name, keep uses them as they are, compress/decompress convert only towards .gz/uncompressed. Conversions run as a job of their own instead of during configuration.")
+    parser.add_argument('--compressionPolicyIntermediate', dest="compressionPolicyIntermediate", type=str, default="keep", choices=["declared", "keep", "compress", "decompress"],
+                        help="Same as --compressionPolicy, for intermediate files which are removed during cleanup. Defaults to keep, which avoids (de)compressing files that are only read by the next step.")
+    parser.add_argument('--identifyStrategy', dest="identifyStrategy", type=str, default="acceptSingle", choices=["ask", "acceptSingle", "first", "last"],
+                        help="How new input files are identified. acceptSingle (default): accept single matches, leave ambiguous ones unresolved. ask: confirm single matches and choose between ambiguous matches interactively. first/last: accept single matches and take the first/last of ambiguous matches in sorted order. Anything not asked is listed in identificationReport.json in the pipe directory. All strategies except ask never block, e.g. for configuration on a cluster node.")
+
+    parser.add_argument('--sampleInterval', dest="sampleInterval", type=float, default=2.0,
+                        help="Seconds between two resource samples (cpu, memory, threads, I/O) of the process tree of each task. The records are collected into the log database.")
+    parser.add_argument('--stageIO', dest="stageIO", action="store_true",
+                        help="Run I/O heavy tasks (eddy, topup, antsRegistrationSyN, QSM) on node-local scratch space: declared inputs are copied to the node, the task runs there and its outputs are moved back atomically once it succeeded. Failed tasks leave no partial outputs in the derivatives.")
+    parser.add_argument('--stageRoot', dest="stageRoot", type=str, default=None,
+                        help="Node-local directory used by --stageIO. Defaults to $SLURM_TMPDIR, $TMPDIR or /tmp on the node running the task.")
+    parser.add_argument('--gcAction', dest="gcAction", type=str, default="delete", choices=["delete", "archive", "report"],
+                        help="What the garbage collector does with intermediate files (files marked for cleanup) which are not read by any unfinished task anymore: delete them, move them below --gcArchiveRoot or only report them. Used by gc mode and --gcDuringRun. Patterns in gcKeep.txt in the pipe directory are never collected.")
+    parser.add_argument('--gcArchiveRoot', dest="gcArchiveRoot", type=str, default=None,
+                        help="Directory below which collected files are moved with --gcAction archive, mirroring their absolute path.")
+    parser.add_argument('--gcDuringRun', dest="gcDuringRun", action="store_true",
+                        help="Collect intermediate files continuously while processing, before each job starts, instead of only in gc mode.")
+    parser.add_argument('--stepCaller', dest="stepCaller", type=str, default=None,
+                        help="Internal, step mode: PipeJob directory of the job starting this step. Only this job counts as done while it is still running, e.g. for --gcDuringRun.")
+
+    parser.add_argument('--statsBy', dest="statsBy", type=str, default="taskclass", choices=["taskclass", "task", "module", "subject", "job", "host"],
+                        help="stats mode: group the task runs by task class, task name, processing module, subject, job or host.")
+    parser.add_argument('--statsTaskClass', dest="statsTaskClass", type=str, default=None,
+                        help="stats and efficiency mode: only task runs of this task class, e.g. CAT12.")
+    parser.add_argument('--statsModule', dest="statsModule", type=str, default=None,
+                        help="stats and efficiency mode: only task runs of this processing module.")
+    parser.add_argument('--statsSince', dest="statsSince", type=str, default=None,
+                        help="stats and efficiency mode: only task runs started at or after this date (YYYY-MM-DD). Also compares their peak memory to the runs before.")
+    parser.add_argument('--statsLastSubjects', dest="statsLastSubjects", type=int, default=None,
+                        help="stats and efficiency mode: only task runs of the subjects processed last.")
+    parser.add_argument('--statsCSV', dest="statsCSV", type=str, default=None,
+                        help="stats and efficiency mode: also write the statistics to this csv file.")
+
+    parser.add_argument('--traceRows', dest="traceRows", type=str, default="pipejob", choices=["pipejob", "node", "subject"],
+                        help="trace mode: one row of the timeline per pipe job, node or subject.")
+    parser.add_argument('--traceOut', dest="traceOut", type=str, default=None,
+                        help="trace mode: json file to write the trace to. Defaults to trace.json in the pipe directory.")
+
+    parser.add_argument('--efficiencyOut', dest="efficiencyOut", type=str, default=None,
+                        help="efficiency mode: html file to write the report to. Defaults to efficiencyReport.html in the pipe directory.")
+
+    parser.add_argument('--metricsOut', dest="metricsOut", type=str, default=None,
+                        help="metrics mode: file to write the metrics to, should end with .prom. Defaults to mrpipe.prom in the pipe directory.")
+    parser.add_argument('--metricsInterval', dest="metricsInterval", type=float, default=0,
+                        help="metrics mode: rewrite the metrics every this many seconds until interrupted. 0 writes them once, e.g. for a cron job.")
+
     args = parser.parse_args()
     #perform some cleanup to match arugment structure
     args.input = args.input.rstrip("/")
@@ -0,0 +1,35 @@
+import threading
+import contextlib
+from mrpipe.meta import LoggerModule
+
+logger = LoggerModule.Logger()
+
+# Guards user prompts during configure. Worker threads (e.g. parallel subject configuration) run non-interactive: a
+# prompt raises InteractionDeferred instead, and the caller repeats that unit of work in the main thread afterwards.
+_state = threading.local()
+
+
+class InteractionDeferred(Exception):
+    def __init__(self, what: str):
+        super().__init__(f"User interaction required but not possible in this context: {what}")
+        self.what = what
+
+
+def interactive() -> bool:
+    return getattr(_state, "interactive", True)
+
+
+@contextlib.contextmanager
+def nonInteractive():
+    previous = interactive()
+    _state.interactive = False
+    try:
+        yield
+    finally:
+        _state.interactive = previous
+
+
+def requireInteraction(what: str):
+    if not interactive():
+        logger.debug(f"Deferring user interaction: {what}")
+        raise InteractionDeferred(what)
@@ -0,0 +1,135 @@
+import os
+import glob
+import json
+import shutil
+import fcntl
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LogToDB import LogToDB
+
+logger = LoggerModule.Logger()
+
+
+class LogCollector:
+    """
+    Moves the task run records (and the state changes of the pipe jobs) from the log spool into the log database. Tasks never touch the database: the resource
+    sampler of every task writes one json record (plus its gzipped stdout / stderr) into a per node directory of the
+    spool. The collector inserts them in batches with one transaction each and removes them afterwards. Only one
+    collector runs at a time (lock file in the spool); a second one returns right away instead of waiting.
+
+    Outputs up to maxBlobBytes (compressed) are stored in the database, larger ones are moved to outputPath and only
+    referenced.
+    """
+
+    lockName = ".collector.lock"
+
+    def __init__(self, spoolPath, dbPath, outputPath, batchSize: int = 500, maxBlobBytes: int = 4 * 1024 ** 2):
+        self.spoolPath = str(spoolPath)
+        self.dbPath = str(dbPath)
+        self.outputPath = str(outputPath)
+        self.batchSize = batchSize
+        self.maxBlobBytes = maxBlobBytes
+
+    def _pending(self, extension=".json"):
+        return sorted(glob.glob(os.path.join(self.spoolPath, "*", "*" + extension)))
+
+    def _collectJobStates(self, logDB):
+        # state changes of pipe jobs (PipeJob.spoolState), only the latest one per job is kept in the database
+        stateFiles = self._pending(".jobstate")
+        states = []
+        for stateFile in stateFiles:
+            try:
+                with open(stateFile, "r") as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.logExceptionError(f"Could not read job state {stateFile}, moving it aside.", e)
+                os.replace(stateFile, stateFile + ".broken")
+        if states:
+            logDB.setJobStates(states)
+        for stateFile in stateFiles:
+            if os.path.isfile(stateFile):
+                os.remove(stateFile)
+        return len(states)
+
+    def _readOutputs(self, recordid, record, directory):
+        # returns the output rows and the side files to move to outputPath once the rows are committed
+        outputs = []
+        moves = []
+        for stream in ["stdout", "stderr"]:
+            name = record.get(f"{stream}File")
+            if not name or not os.path.isfile(os.path.join(directory, name)):
+                continue
+            sideFile = os.path.join(directory, name)
+            size = os.path.getsize(sideFile)
+            if size <= self.maxBlobBytes:
+                with open(sideFile, "rb") as f:
+                    outputs.append((recordid, stream, size, f.read(), None))
+            else:
+                target = os.path.join(self.outputPath, name)
+                moves.append((sideFile, target))
+                outputs.append((recordid, stream, size, None, target))
+        return outputs, moves
+
+    def _moveOutputs(self, recordFile, moves) -> bool:
+        # a record whose side files could not be moved stays in the spool, the next collector retries (inserting the
+        # record again is ignored)
+        try:
+            for sideFile, target in moves:
+                os.makedirs(self.outputPath, exist_ok=True)
+                shutil.move(sideFile, target)
+        except OSError as e:
+            logger.logExceptionError(f"Could not move the output of {recordFile} to {self.outputPath}, keeping it in the spool.", e)
+            return False
+        return True
+
+    def _remove(self, recordFile, record):
+        directory = os.path.dirname(recordFile)
+        for name in [record.get("stdoutFile"), record.get("stderrFile")]:
+            if name and os.path.isfile(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+        os.remove(recordFile)
+
+    def collect(self) -> int:
+        if not os.path.isdir(self.spoolPath):
+            return 0
+        lockFile = open(os.path.join(self.spoolPath, LogCollector.lockName), "w")
+        try:
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.info("Another log collector is running, not collecting.")
+                return 0
+            pending = self._pending()
+            if not pending and not self._pending(".jobstate"):
+                return 0
+            logDB = LogToDB(self.dbPath)
+            self._collectJobStates(logDB)
+            collected = 0
+            for start in range(0, len(pending), self.batchSize):
+                batch = []
+                records = []
+                outputs = []
+                for recordFile in pending[start:start + self.batchSize]:
+                    try:
+                        with open(recordFile, "r") as f:
+                            record = json.load(f)
+                    except (OSError, ValueError) as e:
+                        logger.logExceptionError(f"Could not read log record {recordFile}, moving it aside.", e)
+                        os.replace(recordFile, recordFile + ".broken")
+                        continue
+                    record["recordid"] = os.path.splitext(os.path.basename(recordFile))[0]
+                    recordOutputs, moves = self._readOutputs(record["recordid"], record, os.path.dirname(recordFile))
+                    outputs.extend(recordOutputs)
+                    records.append(record)
+                    batch.append((recordFile, record, moves))
+                if not records:
+                    continue
+                logDB.insertTaskRuns(records, outputs)
+                # large outputs are moved only after the transaction committed: if the insert fails, the spool is intact
+                for recordFile, record, moves in batch:
+                    if self._moveOutputs(recordFile, moves):
+                        self._remove(recordFile, record)
+                collected += len(records)
+            logger.process(f"Collected {collected} task run records into {self.dbPath}")
+            return collected
+        finally:
+            lockFile.close()
@@ -0,0 +1,131 @@
+import os
+import time
+import sqlite3
+import datetime
+import pandas as pd
+from mrpipe.meta import LoggerModule
+
+logger = LoggerModule.Logger()
+
+ValidGroupings = {"taskclass": "taskclass", "task": "task", "module": "processingmodule", "subject": "subject",
+                  "job": "job", "host": "host"}
+
+
+def _timestamp(value):
+    # epoch seconds from a number, a datetime / date or an ISO date string (e.g. 2024-05-01)
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return value.timestamp()
+
+
+def _p95(series):
+    return series.quantile(0.95)
+
+
+class LogQuery:
+    """
+    Read only queries on the task runs of the log database (see LogCollector), e.g.
+
+        LogQuery(dbPath).aggregate(by="taskclass", taskClass="CAT12", lastSubjects=500)["runtimeP95"]
+        LogQuery(dbPath).memoryGrowth(since="2024-05-01")
+
+    Filters narrow down the runs before aggregating: task, taskClass, module and subject match exactly, since / until
+    limit the start time and lastSubjects keeps the runs of the subjects processed last.
+    """
+
+    columns = ["recordid", "subject", "session", "task", "taskclass", "job", "processingmodule", "host",
+               "timestampstart", "timestampend", "returncode", "Realtime", "Cputime", "PeakRSS", "ReadBytes",
+               "WriteBytes", "RequestedCPUs", "RequestedMemory"]
+
+    def __init__(self, dbPath):
+        self.dbPath = str(dbPath)
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.dbPath}?mode=ro", uri=True, timeout=120)
+
+    def runs(self, task=None, taskClass=None, module=None, subject=None, since=None, until=None,
+             lastSubjects: int = None) -> pd.DataFrame:
+        conditions = []
+        parameters = []
+        for column, value in [("task", task), ("taskclass", taskClass), ("processingmodule", module), ("subject", subject)]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if since is not None:
+            conditions.append("timestampstart >= ?")
+            parameters.append(_timestamp(since))
+        if until is not None:
+            conditions.append("timestampstart < ?")
+            parameters.append(_timestamp(until))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if lastSubjects:
+            # subjects ordered by their latest run matching the other filters
+            where += f"{' AND' if conditions else ' WHERE'} subject IN (SELECT subject FROM task_runs{where} " \
+                     f"GROUP BY subject ORDER BY MAX(timestampstart) DESC LIMIT ?)"
+            parameters = parameters + parameters + [int(lastSubjects)]
+        if not os.path.isfile(self.dbPath):
+            logger.error(f"Log database {self.dbPath} does not exist.")
+            return pd.DataFrame(columns=LogQuery.columns)
+        with self._connect() as conn:
+            return pd.read_sql_query(f"SELECT {', '.join(LogQuery.columns)} FROM task_runs{where}", conn, params=parameters)
+
+    def aggregate(self, by: str = "taskclass", **filters) -> pd.DataFrame:
+        # runtime (s), peak memory of the process tree (bytes) and failure rate per group
+        if by not in ValidGroupings:
+            raise ValueError(f"Can not group task runs by {by}, must be one of {list(ValidGroupings)}.")
+        runs = self.runs(**filters)
+        runs["failed"] = runs["returncode"] != 0
+        runs["cpuEfficiency"] = runs["Cputime"] / runs["Realtime"].where(runs["Realtime"] > 0)
+        stats = runs.groupby(ValidGroupings[by], dropna=False).agg(
+            runs=("recordid", "count"),
+            failures=("failed", "sum"),
+            runtimeMean=("Realtime", "mean"),
+            runtimeMedian=("Realtime", "median"),
+            runtimeP95=("Realtime", _p95),
+            runtimeMax=("Realtime", "max"),
+            peakRSSMedian=("PeakRSS", "median"),
+            peakRSSP95=("PeakRSS", _p95),
+            peakRSSMax=("PeakRSS", "max"),
+            cpuEfficiency=("cpuEfficiency", "median"),
+            lastRun=("timestampstart", "max"))
+        stats["failureRate"] = stats["failures"] / stats["runs"]
+        return stats.sort_values("runs", ascending=False)
+
+    def memoryGrowth(self, since, by: str = "taskclass", minRuns: int = 3, **filters) -> pd.DataFrame:
+        # median peak memory of the runs starting after since compared to the runs before, largest growth first
+        if by not in ValidGroupings:
+            raise ValueError(f"Can not group task runs by {by}, must be one of {list(ValidGroupings)}.")
+        since = _timestamp(since)
+        runs = self.runs(**filters)
+        runs["period"] = (runs["timestampstart"] >= since).map({False: "before", True: "after"})
+        grouped = runs.groupby([ValidGroupings[by], "period"])["PeakRSS"].agg(["median", "count"]).unstack("period")
+        if grouped.empty or "before" not in grouped["median"] or "after" not in grouped["median"]:
+            return pd.DataFrame(columns=["peakRSSBefore", "peakRSSAfter", "runsBefore", "runsAfter", "growth"])
+        growth = pd.DataFrame({"peakRSSBefore": grouped["median"]["before"], "peakRSSAfter": grouped["median"]["after"],
+                               "runsBefore": grouped["count"]["before"], "runsAfter": grouped["count"]["after"]})
+        growth = growth[(growth["runsBefore"] >= minRuns) & (growth["runsAfter"] >= minRuns)]
+        growth["growth"] = growth["peakRSSAfter"] / growth["peakRSSBefore"]
+        return growth.sort_values("growth", ascending=False)
+
+    @staticmethod
+    def formatted(stats: pd.DataFrame) -> pd.DataFrame:
+        # human readable units for printing: runtimes in minutes, memory in GB, rates in percent
+        table = stats.copy()
+        units = {}
+        for column in table.columns:
+            if column.startswith("runtime"):
+                table[column] = (table[column] / 60).round(1)
+                units[column] = f"{column} [min]"
+            elif column.startswith("peakRSS"):
+                table[column] = (table[column] / 1024 ** 3).round(2)
+                units[column] = f"{column} [GB]"
+            elif column in ["failureRate", "cpuEfficiency", "growth"]:
+                table[column] = (table[column] * 100).round(1)
+                units[column] = f"{column} [%]"
+            elif column == "lastRun":
+                table[column] = table[column].map(lambda t: time.strftime("%Y-%m-%d %H:%M", time.localtime(t)) if pd.notna(t) else "")
+        return table.rename(columns=units)
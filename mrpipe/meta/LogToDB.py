@@ -1,5 +1,7 @@
 import sqlite3
 import hashlib
+import json
+import zlib
 from mrpipe.meta import LoggerModule
 from tqdm import tqdm
 
@@ -10,7 +12,9 @@ class LogToDB:
         self.path = path
         self.dbName = "logs"
         with sqlite3.connect(self.path, timeout=120) as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")
+            # Only the log collector writes task runs, so the rollback journal suffices. WAL relies on shared memory,
+            # which is not reliable on network file systems.
+            conn.execute("PRAGMA journal_mode=DELETE;")
             conn.execute("""
             CREATE TABLE IF NOT EXISTS logs (
                 -- Primary key (computed from subject, session, jobname)
@@ -64,33 +68,164 @@ class LogToDB:
                 slurmtaskspernode TEXT --  SLURM_TASKS_PER_NODE
             )
             """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_runs (
+                id INTEGER PRIMARY KEY,
+                recordid TEXT UNIQUE, -- name of the spool record, makes collecting a record twice harmless
+                subject TEXT,
+                session TEXT,
+                task TEXT,
+                taskclass TEXT,
+                job TEXT,
+                processingmodule TEXT,
+                host TEXT,
+                command TEXT,
+                timestampstart REAL,
+                timestampend REAL,
+                returncode INTEGER,
+                
+                -- Resource usage, seconds and bytes
+                Realtime REAL,
+                Usertime REAL,
+                Systime REAL,
+                Cputime REAL,
+                PeakRSS INTEGER, -- summed over the process tree
+                MaxRSSSingleProcess INTEGER,
+                PeakThreads INTEGER,
+                PeakProcesses INTEGER,
+                ReadBytes INTEGER,
+                WriteBytes INTEGER,
+                SampleInterval REAL,
+                RequestedCPUs REAL, -- cpus per task of the job
+                RequestedMemory INTEGER, -- memory of the cpus per task of the job
+                series BLOB, -- zlib compressed json of the sampled time series
+                
+                slurmjobid TEXT,
+                slurmstepid TEXT,
+                environment TEXT -- json of the SLURM_* and MRPIPE_* environment variables
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS task_output (
+                recordid TEXT,
+                stream TEXT, -- stdout or stderr
+                size INTEGER, -- compressed size in bytes
+                data BLOB, -- gzip compressed output, NULL if it was too large and is stored in sidefile
+                sidefile TEXT,
+                PRIMARY KEY (recordid, stream)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_states (
+                job TEXT PRIMARY KEY, -- module/name of the pipe job
+                module TEXT,
+                name TEXT,
+                status TEXT, -- name of the ProcessStatus
+                tasks INTEGER, -- tasks of the job which are not precomputed
+                slurmjobid TEXT,
+                updated REAL
+            )
+            """)
+            self._addMissingColumns(conn, "task_runs", {"taskclass": "TEXT", "RequestedCPUs": "REAL", "RequestedMemory": "INTEGER"})
+            for index, table, columns in LogToDB.indices:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns})")
         logger.info(f"Tried to create database for logs (if not already exist): {path}")
 
+    # secondary indices for the lookups of the log collector, set_processed and LogQuery
+    indices = [("idx_logs_job", "logs", "subject, session, jobname"),
+               ("idx_logs_jobname", "logs", "jobname"),
+               ("idx_logs_start", "logs", "timestampstart"),
+               ("idx_task_runs_task", "task_runs", "task"),
+               ("idx_task_runs_taskclass", "task_runs", "taskclass"),
+               ("idx_task_runs_job", "task_runs", "job"),
+               ("idx_task_runs_module", "task_runs", "processingmodule"),
+               ("idx_task_runs_subject", "task_runs", "subject, session"),
+               ("idx_task_runs_start", "task_runs", "timestampstart")]
+
     @staticmethod
-    def compute_row_hash(subject, session, jobname) -> str:
-        out_hash = hashlib.sha256(f"{subject}:{session}:{jobname}".encode()).hexdigest()
-        logger.debug(f"Computed hash for {subject}:{session}:{jobname}: {out_hash}")
-        return out_hash
+    def _addMissingColumns(conn, table, columns):
+        # databases created by older versions lack columns added later
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, columnType in columns.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {columnType}")
 
-    def create_entry_unprocessed(self, module) -> bool:
+    def insertTaskRuns(self, records, outputs=None) -> int:
+        # Bulk insert of task run records (as written by ResourceSampler.py) in one transaction.
+        # outputs: list of (recordid, stream, size, data, sidefile)
+        rows = []
+        for record in records:
+            labels = record.get("labels", {})
+            environment = record.get("environment", {})
+            rows.append((record["recordid"], labels.get("subject"), labels.get("session"), labels.get("task"),
+                         labels.get("taskClass"), labels.get("job"), labels.get("module"), record.get("host"), " ".join(record.get("command") or []),
+                         record.get("start"), record.get("end"), record.get("returncode"), record.get("wall"),
+                         record.get("user"), record.get("sys"), record.get("cpu"), record.get("peakRss"),
+                         record.get("maxRssSingleProcess"), record.get("peakThreads"), record.get("peakProcesses"),
+                         record.get("readBytes"), record.get("writeBytes"), record.get("interval"),
+                         LogToDB._number(labels.get("cpus")), LogToDB._number(labels.get("memory")),
+                         zlib.compress(json.dumps(record.get("series", {}), separators=(",", ":")).encode()),
+                         environment.get("SLURM_JOB_ID", environment.get("SLURM_JOBID")), environment.get("SLURM_STEP_ID", environment.get("SLURM_STEPID")),
+                         json.dumps(environment)))
         with sqlite3.connect(self.path, timeout=120) as conn:
-            for session in module.sessions:
-                for job in module.pipeJobs:
-                    try:
-                        h = LogToDB.compute_row_hash(subject=session.subjectName, session=session.name, jobname=job.name)
-                        conn.execute("INSERT OR IGNORE INTO logs (hash, subject, session, jobname, processingmodule) VALUES (?, ?, ?, ?, ?)",
-                                         (h, session.subjectName, session.name, job.name, module.moduleName))
-                        logger.debug(f"Created entry for {session.subjectName}:{session.name}:{job.name} in database {self.path}")
-                    except Exception as e:
-                        logger.logExceptionError(f"Could not create entry for {session.subjectName}:{session.name}:{job.name} in database {self.path}", e)
+            cursor = conn.executemany("""INSERT OR IGNORE INTO task_runs (recordid, subject, session, task, taskclass, job, processingmodule,
+                host, command, timestampstart, timestampend, returncode, Realtime, Usertime, Systime, Cputime, PeakRSS,
+                MaxRSSSingleProcess, PeakThreads, PeakProcesses, ReadBytes, WriteBytes, SampleInterval, RequestedCPUs, RequestedMemory, series, slurmjobid,
+                slurmstepid, environment) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            inserted = cursor.rowcount
+            if outputs:
+                conn.executemany("INSERT OR IGNORE INTO task_output (recordid, stream, size, data, sidefile) VALUES (?, ?, ?, ?, ?)", outputs)
+        return inserted
 
+    def setJobStates(self, states, replace: bool = False) -> int:
+        # Bulk upsert of job states (dicts as written by PipeJob.stateRecord), older states never replace newer ones.
+        # replace: the states are all jobs of a newly configured pipe, states of other jobs are removed.
+        rows = [(state["job"], state.get("module"), state.get("name"), state.get("status"), state.get("tasks"),
+                 state.get("slurmJobId"), state.get("updated")) for state in states]
+        with sqlite3.connect(self.path, timeout=120) as conn:
+            if replace:
+                conn.execute("DELETE FROM job_states")
+            conn.executemany("""INSERT INTO job_states (job, module, name, status, tasks, slurmjobid, updated) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job) DO UPDATE SET module = excluded.module, name = excluded.name, status = excluded.status,
+                tasks = excluded.tasks, slurmjobid = COALESCE(excluded.slurmjobid, job_states.slurmjobid), updated = excluded.updated
+                WHERE excluded.updated >= job_states.updated""", rows)
+        return len(rows)
 
+    @staticmethod
+    def _number(value):
+        # labels are strings
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def compute_row_hash(subject, session, jobname) -> str:
+        return hashlib.sha256(f"{subject}:{session}:{jobname}".encode()).hexdigest()
+
+    def create_entry_unprocessed(self, module) -> bool:
+        return self.create_entries_unprocessed([module])
+
+    def create_entries_unprocessed(self, modules) -> bool:
+        # one transaction for all subjects, sessions and jobs of the modules instead of one statement each
+        rows = [(LogToDB.compute_row_hash(subject=session.subjectName, session=session.name, jobname=job.name),
+                 session.subjectName, session.name, job.name, module.moduleName)
+                for module in modules for session in module.sessions for job in module.pipeJobs]
+        try:
+            with sqlite3.connect(self.path, timeout=120) as conn:
+                conn.executemany("INSERT OR IGNORE INTO logs (hash, subject, session, jobname, processingmodule) VALUES (?, ?, ?, ?, ?)", rows)
+            logger.debug(f"Created {len(rows)} entries in database {self.path}")
+            return True
+        except Exception as e:
+            logger.logExceptionError(f"Could not create {len(rows)} entries in database {self.path}", e)
+            return False
 
     def set_processed(self, subject, session, jobname, processed) -> bool:
+        # looked up by the indexed columns, no need to hash
         try:
             with sqlite3.connect(self.path, timeout=120) as conn:
-                h = LogToDB.compute_row_hash(subject=subject, session=session, jobname=jobname)
-                conn.execute("UPDATE logs SET processed = ? WHERE hash = ?", (processed, h))
+                conn.execute("UPDATE logs SET processed = ? WHERE subject = ? AND session = ? AND jobname = ?",
+                             (processed, subject, session, jobname))
             logger.debug(f"Set processed status for {subject}:{session}:{jobname} in database {self.path}. Status: {processed}")
             return True
         except Exception as e:
@@ -0,0 +1,106 @@
+import os
+import time
+import sqlite3
+from mrpipe.meta import LoggerModule
+
+logger = LoggerModule.Logger()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricsExporter:
+    """
+    Writes the state of a pipe in the Prometheus text format, for the textfile collector of node_exporter
+    (--collector.textfile.directory) or any other scraper reading files. Everything is read from the log database:
+    the job states (see Pipe.recordJobStates and PipeJob.spoolState) and the task runs, never from the pickled jobs.
+
+    The estimated completion time divides the tasks of unfinished jobs by the throughput of the last throughputWindow
+    seconds, it is only written while tasks complete.
+    """
+
+    runtimeBuckets = [60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400]
+    throughputWindow = 6 * 3600
+    openStates = ["notStarted", "setup", "submitted", "running", "unkown"]
+
+    def __init__(self, dbPath, pipeName: str):
+        self.dbPath = str(dbPath)
+        self.pipeName = pipeName
+        self.lines = []
+
+    def _metric(self, name, metricType, helpText, samples):
+        # samples: list of (labels dict, value)
+        self.lines.append(f"# HELP {name} {helpText}")
+        self.lines.append(f"# TYPE {name} {metricType}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(pipe=self.pipeName, **labels)} {value}")
+
+    def _jobMetrics(self, conn):
+        rows = conn.execute("SELECT module, status, COUNT(*), SUM(tasks) FROM job_states GROUP BY module, status").fetchall()
+        self._metric("mrpipe_jobs", "gauge", "Pipe jobs by processing module and status.",
+                     [({"module": module, "status": status}, count) for module, status, count, _ in rows])
+        self._metric("mrpipe_queue_depth", "gauge", "Pipe jobs submitted to the scheduler which did not start yet.",
+                     [({}, sum(count for _, status, count, _ in rows if status == "submitted"))])
+        remaining = sum(tasks or 0 for _, status, _, tasks in rows if status in MetricsExporter.openStates)
+        self._metric("mrpipe_tasks_remaining", "gauge", "Tasks of pipe jobs which did not finish yet.", [({}, remaining)])
+        return remaining
+
+    def _taskMetrics(self, conn, remaining, now):
+        rows = conn.execute("""SELECT processingmodule, SUM(returncode = 0), SUM(returncode != 0) FROM task_runs
+                               GROUP BY processingmodule""").fetchall()
+        samples = []
+        for module, completed, failed in rows:
+            samples.append(({"module": module, "result": "completed"}, completed or 0))
+            samples.append(({"module": module, "result": "failed"}, failed or 0))
+        self._metric("mrpipe_tasks_total", "counter", "Finished task runs by processing module and result.", samples)
+
+        samples = []
+        for module, taskClass in conn.execute("SELECT DISTINCT processingmodule, taskclass FROM task_runs").fetchall():
+            runtimes = [row[0] for row in conn.execute(
+                "SELECT Realtime FROM task_runs WHERE processingmodule IS ? AND taskclass IS ? AND Realtime IS NOT NULL",
+                (module, taskClass))]
+            labels = {"module": module, "taskclass": taskClass}
+            for bucket in MetricsExporter.runtimeBuckets:
+                samples.append(({**labels, "le": bucket}, sum(1 for r in runtimes if r <= bucket)))
+            samples.append(({**labels, "le": "+Inf"}, len(runtimes)))
+        self.lines.append("# HELP mrpipe_task_runtime_seconds Runtime of the task runs by processing module and task class.")
+        self.lines.append("# TYPE mrpipe_task_runtime_seconds histogram")
+        for labels, value in samples:
+            self.lines.append(f"mrpipe_task_runtime_seconds_bucket{_labels(pipe=self.pipeName, **labels)} {value}")
+        for module, taskClass, total, count in conn.execute(
+                "SELECT processingmodule, taskclass, SUM(Realtime), COUNT(Realtime) FROM task_runs GROUP BY processingmodule, taskclass"):
+            labels = _labels(pipe=self.pipeName, module=module, taskclass=taskClass)
+            self.lines.append(f"mrpipe_task_runtime_seconds_sum{labels} {total or 0}")
+            self.lines.append(f"mrpipe_task_runtime_seconds_count{labels} {count}")
+
+        recent = conn.execute("SELECT COUNT(*) FROM task_runs WHERE returncode = 0 AND timestampend >= ?",
+                              (now - MetricsExporter.throughputWindow,)).fetchone()[0]
+        throughput = recent / MetricsExporter.throughputWindow
+        self._metric("mrpipe_task_throughput", "gauge", "Completed tasks per second over the last hours.", [({}, throughput)])
+        if throughput > 0 and remaining:
+            self._metric("mrpipe_estimated_completion_timestamp_seconds", "gauge",
+                         "Estimated end of the pipe from the remaining tasks and the current throughput.",
+                         [({}, round(now + remaining / throughput))])
+
+    def render(self) -> str:
+        now = time.time()
+        self.lines = []
+        with sqlite3.connect(f"file:{self.dbPath}?mode=ro", uri=True, timeout=120) as conn:
+            remaining = self._jobMetrics(conn)
+            self._taskMetrics(conn, remaining, now)
+        self._metric("mrpipe_metrics_timestamp_seconds", "gauge", "Time these metrics were written.", [({}, round(now))])
+        return "\n".join(self.lines) + "\n"
+
+    def write(self, path):
+        # atomic, the textfile collector must never read a partially written file
+        text = self.render()
+        tmpPath = f"{path}.{os.getpid()}.tmp"
+        with open(tmpPath, "w") as f:
+            f.write(text)
+        os.replace(tmpPath, str(path))
+        logger.info(f"Wrote pipeline metrics to {path}")
@@ -0,0 +1,99 @@
+import os
+from collections import Counter
+from typing import List
+import pandas as pd
+from mrpipe.meta import LoggerModule
+
+logger = LoggerModule.Logger()
+
+
+class ModalityAvailability:
+    """
+    Which modalities are available for which session, as one bit mask per session (bit i set if modality i is there).
+    Sessions are counted per mask, so the summary grows with the number of distinct modality combinations in the data
+    instead of with all subsets of the modalities. How many sessions have at least a given set of modalities is answered
+    on demand from these counts, e.g.
+
+        availability.count(["T1w", "flair", "pet_av45"])
+    """
+
+    def __init__(self, modalityNames: List[str] = None):
+        self.bits = {}  # modality name -> bit index
+        for name in modalityNames or []:
+            self._bit(name)
+        self.patterns = Counter()  # mask -> number of sessions
+        self.sessions = []  # (subject, session, mask)
+
+    def _bit(self, name):
+        if name not in self.bits:
+            self.bits[name] = len(self.bits)
+        return self.bits[name]
+
+    def mask(self, modalities: List[str]) -> int:
+        mask = 0
+        for name in modalities:
+            mask |= 1 << self._bit(name)
+        return mask
+
+    def _query(self, modalities: List[str]):
+        # mask of registered modalities without registering new ones; None if any of them is unknown (no session has it)
+        mask = 0
+        for name in modalities:
+            if name not in self.bits:
+                return None
+            mask |= 1 << self.bits[name]
+        return mask
+
+    def _used(self) -> int:
+        used = 0
+        for mask in self.patterns:
+            used |= mask
+        return used
+
+    def names(self, mask: int) -> List[str]:
+        return [name for name, bit in self.bits.items() if mask >> bit & 1]
+
+    def add(self, subject: str, session: str, modalities: List[str]):
+        mask = self.mask(modalities)
+        self.patterns[mask] += 1
+        self.sessions.append((subject, session, mask))
+
+    def count(self, modalities: List[str]) -> int:
+        # sessions with at least these modalities
+        query = self._query(modalities)
+        if query is None:
+            return 0
+        return sum(n for mask, n in self.patterns.items() if mask & query == query)
+
+    def sessionsWith(self, modalities: List[str]) -> List[tuple]:
+        query = self._query(modalities)
+        if query is None:
+            return []
+        return [(subject, session) for subject, session, mask in self.sessions if mask & query == query]
+
+    def patternTable(self) -> pd.DataFrame:
+        # first one row per modality available in any session, then one row per other combination of modalities found
+        # in the data: sessions with exactly these modalities and sessions with at least these modalities (possibly more)
+        columns = ["Modalities", "Count", "AtLeast"]
+        singles = [{"Modalities": name, "Count": self.patterns.get(1 << self.bits[name], 0), "AtLeast": self.count([name])}
+                   for name in self.names(self._used())]
+        combinations = [{"Modalities": ", ".join(self.names(mask)),
+                         "Count": n,
+                         "AtLeast": sum(m for other, m in self.patterns.items() if other & mask == mask)}
+                        for mask, n in self.patterns.items() if bin(mask).count("1") != 1]
+        order = dict(by=["AtLeast", "Count", "Modalities"], ascending=[False, False, True])
+        table = pd.concat([pd.DataFrame(singles, columns=columns).sort_values(**order),
+                           pd.DataFrame(combinations, columns=columns).sort_values(**order)])
+        return table.set_index("Modalities")
+
+    def matrix(self) -> pd.DataFrame:
+        # subject x session rows, one 0/1 column per modality available in any session
+        columns = self.names(self._used())
+        rows = [[subject, session] + [mask >> self.bits[name] & 1 for name in columns] for subject, session, mask in self.sessions]
+        return pd.DataFrame(rows, columns=["Subject", "Session"] + columns)
+
+    def writeMatrix(self, path):
+        tmpPath = str(path) + ".tmp"
+        self.matrix().to_csv(tmpPath, index=False)
+        os.replace(tmpPath, str(path))
+        logger.info(f"Wrote modality availability of {len(self.sessions)} sessions to {path}")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 import os
+import sys
 from mrpipe.meta import LoggerModule
 import gzip
 import shutil
@@ -11,12 +12,24 @@ import pathlib
 import json
 import nibabel as nib
 from typing import List
+from mrpipe.meta.DirectoryCache import DirectoryCache
+from mrpipe.meta.PatternIdentifier import PatternIdentifier
+from mrpipe.meta.CompressionManager import CompressionManager
 
 
 
 logger = LoggerModule.Logger()
+dirCache = DirectoryCache()
+compressionManager = CompressionManager()
+patternIdentifier = PatternIdentifier()
 
 class Path:
+    # Paths are created by the hundred thousands during configure: slots instead of an instance dict, interned path
+    # strings and a compact pickle state keep them small. Paths compare and hash by the absolute file name without a
+    # trailing .gz, i.e. both compression variants of a file are the same Path. This key does not change when exists()
+    # switches a Path to the other variant, so Paths can be used in sets and as dict keys.
+    __slots__ = ("_path", "_key", "isDirectory", "clobber", "static", "cleanup", "optional", "existCached")
+
     def __init__(self, path, isDirectory=False, create=False, clobber=False, shouldExist=False, static=False,
                  cleanup=False, optional=False):
         self.optional = optional
@@ -26,7 +39,7 @@ class Path:
         self.isDirectory = isDirectory
         self.clobber = clobber
         self.static = static  # static = True implies, that the filename can not be changed, i.e. when written to and read from yml. This would be the case if a program outputs unchangeable file names.
-        self.cleanup = cleanup  # cleanup = True implies that the file/dir is removed at the cleanup state #TODO implement cleanup stage
+        self.cleanup = cleanup  # cleanup = True marks an intermediate file/dir, which the garbage collector removes once no unfinished task reads it (gc mode, --gcDuringRun)
         self.exists()
 
         logger.debug(f"Created Path class: {self}")
@@ -36,6 +49,67 @@ class Path:
             if not self.exists():
                 logger.error(f"Path {self.path} does not exists, but shouldExist is True. This may lead to unexpected errors.")
 
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        # Invariant: once a Path has been hashed or compared (e.g. it is in a FileRegistry set or dict), its path may
+        # only switch between the two compression variants, which share one key. Renaming it would move it into
+        # another hash bucket. Renaming is fine before that, e.g. on a fresh copy.
+        value = sys.intern(str(value))
+        key = getattr(self, "_key", None)
+        if key is not None:
+            assert Path._keyOf(value) == key, f"Path {self._path} was renamed to {value} after it was hashed"
+        self._path = value
+        self._key = key
+
+    @staticmethod
+    def _keyOf(path: str) -> str:
+        key = os.path.abspath(path)
+        return key[:-3] if key.endswith(".gz") else key
+
+    def _hashKey(self):
+        if self._key is None:
+            self._key = Path._keyOf(self._path)
+        return self._key
+
+    def __eq__(self, other):
+        if isinstance(other, Path):
+            return self._hashKey() == other._hashKey()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._hashKey())
+
+    _flagNames = ("isDirectory", "clobber", "static", "cleanup", "optional")
+
+    def __getstate__(self):
+        flags = 0
+        for bit, name in enumerate(Path._flagNames):
+            if getattr(self, name):
+                flags |= 1 << bit
+        instanceDict = getattr(self, "__dict__", None)  # attributes of subclasses without slots
+        return (self._path, flags, self.existCached, instanceDict) if instanceDict else (self._path, flags, self.existCached)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pickled before Path had slots
+            state = dict(state)
+            self.path = state.pop("path")
+            self.existCached = state.pop("existCached", None)
+            for name in Path._flagNames:
+                setattr(self, name, state.pop(name, False))
+            for name, value in state.items():
+                setattr(self, name, value)
+            return
+        self.path = state[0]
+        for bit, name in enumerate(Path._flagNames):
+            setattr(self, name, bool(state[1] & (1 << bit)))
+        self.existCached = state[2]
+        if len(state) > 3:
+            self.__dict__.update(state[3])
+
     def get_filename(self) -> str:
         return os.path.basename(self.path)
 
@@ -85,6 +159,7 @@ class Path:
                 target.remove()
             target.createDirectory()
             os.symlink(os.path.realpath(self.path), target.path)
+            dirCache.invalidate(target.path)
         except Exception as e:
             logger.logExceptionError(f"Symlink could not be created: {target}", e)
             return None
@@ -102,42 +177,43 @@ class Path:
             logger.warning(f"File {newPath.path} already exists, and clobber is false. Not Overwriting existing file. Assuming that existing and new file are the same.")
             return newPath
         try:
-            if not os.path.isdir(newPath.get_directory()):
+            if not dirCache.isDir(newPath.get_directory()):
                 pathlib.Path(newPath.get_directory()).mkdir(parents=True, exist_ok=False)
+                dirCache.invalidate(newPath.get_directory())
             if unzip and self.checkIfZipped():
                 shutil.copy(os.path.realpath(str(self.path)), str(newPathZipped.path))
+                dirCache.invalidate(newPathZipped.path)
                 newPathZipped.unzipFile()
                 newPath.exists(acceptCache=False)
             else:
                 shutil.copy(str(self.path), str(newPath.path))
+                dirCache.invalidate(newPath.path)
         except Exception as e:
             logger.logExceptionError(f"File could not be copied: {self.path}", e)
             return None
         return newPath
 
     def exists(self, acceptZipped : bool = True, acceptUnzipped : bool = True, transform : bool = True, acceptCache : bool = True):
+        # Lookups are answered from the directory listing cache. acceptCache=False also forces a fresh read of the
+        # containing directory.
         if acceptCache and self.existCached is True:
             return self.existCached
         if self.isDirectory:
-            exists = os.path.isdir(self.path)
+            exists = dirCache.isDir(self.path, refresh=not acceptCache)
             self.existCached = exists
             return exists
         else:
-            exists = os.path.isfile(self.path)
+            exists = dirCache.isFile(self.path, refresh=not acceptCache)
+            # If only the other compression variant exists, the compression policy decides whether the file is used as
+            # it is or converted later by the conversion job. Nothing is (un)zipped here.
             if (not exists) and acceptZipped:
-                if os.path.isfile(self.path + ".gz"):
-                    logger.warning(f"File does not exist unzipped, but exist zipped: {self.path}.gz. Assuming you also accept the zipped version.")
-                    self.path = self.path + ".gz"
-                    if transform:
-                        self.unzipFile(removeAfter=True)
+                if dirCache.isFile(self.path + ".gz"):
+                    self.path = compressionManager.resolve(self, self.path + ".gz", transform=transform)
                     self.existCached = True
                     return True
             if (not exists) and acceptUnzipped:
-                if os.path.isfile(self.path.rstrip(".gz")):
-                    logger.warning(f"File does not exist zipped, but exist unzipped: {self.path.rstrip('.gz')}. Assuming you also accept the unzipped version.")
-                    self.path = self.path.rstrip(".gz")
-                    if transform:
-                        self.zipFile(removeAfter=True)
+                if dirCache.isFile(self.path.rstrip(".gz")):
+                    self.path = compressionManager.resolve(self, self.path.rstrip(".gz"), transform=transform)
                     self.existCached = True
                     return True
             self.existCached = exists
@@ -153,6 +229,7 @@ class Path:
         else:
             try:
                 os.remove(self.path)
+                dirCache.invalidate(self.path)
                 return True
             except Exception as e:
                 logger.error(f'Error while trying to remove file {self.path}: \n{e}')
@@ -165,6 +242,7 @@ class Path:
             return
         if self.isDirectory:
             pathlib.Path(self.path).mkdir(exist_ok=True, parents=True)
+            dirCache.invalidateTree(self.path)
             logger.info(f"Created Directory: {self}")
         else:
             logger.warning(f"You tried to create a file, this can only create directories yet: {self}")
@@ -172,9 +250,11 @@ class Path:
     def createDirectory(self):
         if self.isDirectory:
             pathlib.Path(self.path).mkdir(exist_ok=True, parents=True)
+            dirCache.invalidateTree(self.path)
             logger.info(f"Created Directory: {self}")
         else:
             pathlib.Path(self.get_directory()).mkdir(exist_ok=True, parents=True)
+            dirCache.invalidateTree(self.get_directory())
             logger.info(f"Created Directory: {self}")
 
     def checkIfZipped(self):
@@ -186,83 +266,11 @@ class Path:
     @classmethod
     def Identify(cls, fileDescription, pattern, searchDir: Path, previousPatterns, negativePattern):
         #TODO For now, it is not possible to ignore the input given for now, so this may lead to issues, when an already defined pattern matches a file, but the user wants to specify a different file (However, this is unlikely)
-
-        #TODO Add logic to identify duplicated file from multiple different files.
-        for pp in previousPatterns:
-            r = glob.glob(str(searchDir.join(pp)))
-            if len(r) == 1:
-                logger.debug(f"Found file with pattern {pp} in {searchDir}: \n{r[0]}")
-                return Path(r[0], shouldExist=True, static=True), None, None
-            elif len(r) == 2: #case when bot *.nii and *.nii.gz file exist
-                l0 = len(r[0])
-                l1 = len(r[1])
-                if l0 < l1:
-                    short = r[0]
-                    long = r[1]
-                else:
-                    short = r[1]
-                    long = r[0]
-                if long == (short + ".gz"):
-                    logger.debug(f"Found file with pattern {pp} in {searchDir}: \n{long}")
-                    return Path(long, shouldExist=True, static=True), None, None
-
-        matches = {}
-        for file in os.listdir(str(searchDir)):
-            if any(re.match(neg_pat, file) for neg_pat in negativePattern):
-                continue  # Skip files that match any negative pattern
-            if m := re.match(pattern, file):
-                matches[m.group(1)] = file
-
-        if len(matches) == 0:
-            return None, None, None
-        elif len(matches) == 1:
-            key = list(matches.keys())[0]
-            logger.info(f'Found pattern Match for {fileDescription} in {searchDir}: {key}')
-            if Path._confirmChoosen(fileDescription, matches[key], key):
-                return Path(os.path.join(searchDir, matches[key]), shouldExist=True, static=True), key, None
-            else:
-                return None, None, key
-        elif len(matches) > 1:
-            key = Path._identifyChoose(fileDescription=fileDescription, matches=matches)
-            if key is not None:
-                logger.info(f'Found pattern Match for {fileDescription} in {searchDir}: {key}')
-                return Path(os.path.join(searchDir, matches[key]), shouldExist=True, static=True), key
-            else:
-                return None, None, None
-        logger.error(f'File not found for {fileDescription} with patterns {pattern} and {previousPatterns}. This will probably break the modality for this session: {searchDir}')
-        return None, None, None
-
-    @staticmethod
-    def _identifyChoose(fileDescription, matches):
-        while True:
-            try:
-                print(f"Please select the correct match for '{fileDescription}' from the following list. This will be used as Template for other Subjects and Sessions if possible:")
-                print("0: No Valid match")
-                for i, key in enumerate(matches, 1):
-                    print(f"{i}: {matches[key]}")
-                # Wait for the user to enter a number to specify the correct match
-                correct_match_index = int(input()) - 1
-                if 0 <= correct_match_index < len(matches):
-                    return list(matches)[correct_match_index]
-                elif correct_match_index == -1:
-                    return None
-                else:
-                    print("Invalid Input, please try again:")
-            except Exception as e:
-                print("Invalid Input, please try again:")
-
-    @staticmethod
-    def _confirmChoosen(fileDescription, match, key):
-        while True:
-            print(f"Please verify that for '{fileDescription}' the following is correct:\n File: {match}\n Pattern: {key}\n For: {fileDescription}")
-            print(f"(y)es or (n)o?:")
-            response = input().lower()
-            if response == "y" or response == "yes":
-                return True
-            if response == "n" or response == "no":
-                return False
-            else:
-                print("Invalid Input, please try again:")
+        # Matching (and the handling of ambiguous matches) is done by the PatternIdentifier, see there.
+        file, key, negativeKey = patternIdentifier.identify(fileDescription, pattern, searchDir, previousPatterns, negativePattern)
+        if file is None:
+            return None, key, negativeKey
+        return Path(os.path.join(searchDir, file), shouldExist=True, static=True), key, negativeKey
 
 
     def zipFile(self, removeAfter : bool = True):
@@ -271,7 +279,7 @@ class Path:
             return
         if not self.checkIfZipped():
             try:
-                if os.path.exists(self.path + ".gz"):
+                if dirCache.exists(self.path + ".gz"):
                     logger.warning(
                         f"Unzipped file already seem to exist, overwriting: {self.path + '.gz'}")
                     os.remove(self.path + ".gz")
@@ -279,10 +287,12 @@ class Path:
                 with open(self.path, 'rb') as f_in:
                     with gzip.open(self.path + ".gz", 'wb') as f_out:
                         shutil.copyfileobj(f_in, f_out)
+                dirCache.invalidate(self.path)
                 oldpath = self.path
                 self.path = self.path + ".gz"
                 if self.exists() and removeAfter:
                     os.remove(oldpath)
+                    dirCache.invalidate(oldpath)
             except Exception as e:
                 logger.logExceptionError(f"Gzip of file failed: {self.path}", e)
         else:
@@ -308,7 +318,7 @@ class Path:
             return
         if self.checkIfZipped():
             try:
-                if os.path.exists(self.path.rstrip(".gz")):
+                if dirCache.exists(self.path.rstrip(".gz")):
                     logger.warning(
                         f"Zipped file already seem to exist, overwriting: {self.path.rstrip('.gz')}")
                     os.remove(self.path.rstrip(".gz"))
@@ -316,10 +326,12 @@ class Path:
                 with gzip.open(self.path, 'rb') as f_in:
                     with open(self.path.rstrip(".gz"), 'wb') as f_out:
                         shutil.copyfileobj(f_in, f_out)
+                dirCache.invalidate(self.path)
                 oldpath = self.path
                 self.path = self.path.rstrip(".gz")
                 if self.exists() and removeAfter:
                     os.remove(oldpath)
+                    dirCache.invalidate(oldpath)
             except Exception as e:
                 logger.logExceptionError(f"Gzip of file failed: {self.path}", e)
         else:
@@ -337,7 +349,7 @@ class Path:
         return self
 
     def setCleanup(self):
-        #TODO files and folders to be removed at cleanup stage.
+        # intermediate file or folder, collected by the GarbageCollector once it is not needed anymore
         self.cleanup = True
         return self
 
@@ -355,14 +367,6 @@ class Path:
     def __fspath__(self):
         return os.path.abspath(self.path)
 
-    #TODO: Think about getstate and setstate to clean up yaml structure.
-    # def __getstate__(self):
-    #     return {'path': self.path}
-    # def __setstate__(self, state):
-    #     self.path = state['path']
-    #     self.isDirectory = False
-    #     self.clobber = False
-
     def __add__(self, other):
         if isinstance(other, Path):
             return Path(os.path.join(self.path, other.path), isDirectory=other.isDirectory, clobber=other.clobber)
@@ -385,6 +389,10 @@ class StatsFilePath(Path):
             self.path = self.get_directory().join(self.get_filename_sans_ending() + ".json")
         self.attributeName = attributeName
 
+    def _hashKey(self):
+        # several attributes are written into the same stats file, each one is a file of its own for the pipeline
+        return super()._hashKey(), getattr(self, "attributeName", None)
+
     def exists(self, *args, **kwargs):
         if not super().exists(*args, **kwargs):
             logger.info(f"StatsFilePath does not exist (yet): {self.path}")
@@ -415,6 +423,7 @@ class StatsFilePath(Path):
             logger.info(f"Created Directory (if it does not already exist): {self.get_directory()}")
             with open(self.path, 'w') as file:
                 json.dump({'Subject': self.subject, 'Session': self.session}, file, indent=4)
+            dirCache.invalidateTree(self.get_directory())
             logger.info(f"Created File: {self}")
             return True
         except Exception as e:
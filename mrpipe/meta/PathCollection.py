@@ -4,6 +4,8 @@ from mrpipe.Helper import Helper
 from mrpipe.meta.PathClass import Path
 import yaml
 import json
+import os
+import threading
 from mrpipe.meta import LoggerModule
 logger = LoggerModule.Logger()
 
@@ -13,6 +15,11 @@ class PathCollection(ABC):
     filePatternPath = None
     config = {}
     configPath = None
+    registryLock = threading.RLock()  # file patterns and config are shared by all subjects, which may be configured in parallel
+    # Changes to file patterns and config are kept in memory and written once by flushRegistry(), at the end of
+    # configure or at explicit checkpoints, instead of rewriting the json files on every change.
+    _filePatternsDirty = False
+    _configDirty = False
 
     @abstractmethod
     def __init__(self, name, inputArgs=None):
@@ -45,20 +52,23 @@ class PathCollection(ABC):
 
     @staticmethod
     def getFilePatterns(name: str):
-        if name not in PathCollection.filePatterns.keys():
-            return []
-        else:
-            patterns = PathCollection.filePatterns[name]
-            logger.debug(f"Found file patterns for {name}: {str(patterns)}")
-            return patterns
+        with PathCollection.registryLock:
+            if name not in PathCollection.filePatterns.keys():
+                return []
+            else:
+                patterns = list(PathCollection.filePatterns[name])
+        logger.debug(f"Found file patterns for {name}: {str(patterns)}")
+        return patterns
 
     @staticmethod
     def setFilePatterns(name: str, filePatterns):
-        if name not in PathCollection.filePatterns:
-            PathCollection.filePatterns[name] = []
-        for pattern in Helper.ensure_list(filePatterns, flatten=True):
-            PathCollection.filePatterns[name].append(pattern)
-        PathCollection.filePatternsToJSON()
+        with PathCollection.registryLock:
+            if name not in PathCollection.filePatterns:
+                PathCollection.filePatterns[name] = []
+            for pattern in Helper.ensure_list(filePatterns, flatten=True):
+                if pattern not in PathCollection.filePatterns[name]:
+                    PathCollection.filePatterns[name].append(pattern)
+                    PathCollection._filePatternsDirty = True
 
     @classmethod
     def from_yaml(cls, filepath):
@@ -66,16 +76,36 @@ class PathCollection(ABC):
             data = yaml.safe_load(file)
         return cls(**data)
 
+    @staticmethod
+    def _writeJSONAtomic(path, content):
+        # written to a temporary file next to the target and moved into place, so the file is never partially written
+        tmpPath = str(path) + ".tmp"
+        with open(tmpPath, 'w') as file:
+            json.dump(content, file)
+        os.replace(tmpPath, str(path))
+        if isinstance(path, Path):
+            path.exists(acceptCache=False)
+
+    @staticmethod
+    def flushRegistry():
+        # Writes file patterns and config, if they changed since the last flush.
+        with PathCollection.registryLock:
+            if PathCollection._filePatternsDirty:
+                PathCollection.filePatternsToJSON()
+            if PathCollection._configDirty:
+                PathCollection.configToJSON()
+
     @staticmethod
     def filePatternsToJSON():
         if PathCollection.filePatternPath is None:
             logger.warning(f"No file pattern Path found, not saving")
             return False
         logger.debug("Writing file patterns to json: {}".format(PathCollection.filePatternPath))
-        for key, patterns in PathCollection.filePatterns.items(): #TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
-            PathCollection.filePatterns[key] = list(set(patterns))
-        with open(PathCollection.filePatternPath, 'w') as file:
-            json.dump(PathCollection.filePatterns, file)
+        with PathCollection.registryLock:
+            for key, patterns in PathCollection.filePatterns.items(): #TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
+                PathCollection.filePatterns[key] = list(dict.fromkeys(patterns))
+            PathCollection._writeJSONAtomic(PathCollection.filePatternPath, PathCollection.filePatterns)
+            PathCollection._filePatternsDirty = False
         return True
 
     @staticmethod
@@ -87,30 +117,38 @@ class PathCollection(ABC):
             logger.warning(f"Pattern file does not exist (maybe not yet), returning empty")
             return False
         logger.debug("Reading file patterns from json: {}".format(PathCollection.filePatternPath))
-        if len(PathCollection.filePatterns) != 0:
-            logger.info(f"Found {len(PathCollection.filePatterns)} file patterns already in class. This will overwrite any existing patterns")
-        with open(PathCollection.filePatternPath, 'r') as file:
-            PathCollection.filePatterns.update(json.load(file))
-        for key, patterns in PathCollection.filePatterns.items(): #TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
-            PathCollection.filePatterns[key] = list(set(patterns))
+        with PathCollection.registryLock:
+            if len(PathCollection.filePatterns) != 0:
+                logger.info(f"Found {len(PathCollection.filePatterns)} file patterns already in class. This will overwrite any existing patterns")
+            with open(PathCollection.filePatternPath, 'r') as file:
+                loaded = json.load(file)
+            if PathCollection._filePatternsDirty:  # changes which were not flushed yet take precedence
+                loaded.update(PathCollection.filePatterns)
+            PathCollection.filePatterns.update(loaded)
+            for key, patterns in PathCollection.filePatterns.items(): #TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
+                PathCollection.filePatterns[key] = list(dict.fromkeys(patterns))
         return True
 
     @staticmethod
     def setConfigElement(name: str, value, overwrite=True):
-        if name in PathCollection.config and not overwrite:
-            logger.warning(f"Config element already exists and overwrite is False. Not(!) setting {name} to {value}.")
-        else:
-            PathCollection.config[name] = Helper.ensure_list(value, flatten=True)
-            PathCollection.configToJSON()
+        with PathCollection.registryLock:
+            if name in PathCollection.config and not overwrite:
+                logger.warning(f"Config element already exists and overwrite is False. Not(!) setting {name} to {value}.")
+            else:
+                value = Helper.ensure_list(value, flatten=True)
+                if PathCollection.config.get(name) != value:
+                    PathCollection.config[name] = value
+                    PathCollection._configDirty = True
 
     @staticmethod
     def getConfigElement(name: str):
-        if name not in PathCollection.config.keys():
-            PathCollection.configFromJSON()
+        with PathCollection.registryLock:
             if name not in PathCollection.config.keys():
-                return None
+                PathCollection.configFromJSON()
+                if name not in PathCollection.config.keys():
+                    return None
 
-        setting = PathCollection.config[name]
+            setting = PathCollection.config[name]
         logger.debug(f"Found config setting for {name}: {str(setting)}")
         return setting
 
@@ -120,10 +158,11 @@ class PathCollection(ABC):
             logger.warning(f"No config file path found, not saving")
             return False
         logger.debug("Writing config to json: {}".format(PathCollection.configPath))
-        for key, patterns in PathCollection.config.items():  # TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
-            PathCollection.config[key] = list(set(patterns))
-        with open(PathCollection.configPath, 'w') as file:
-            json.dump(PathCollection.config, file)
+        with PathCollection.registryLock:
+            for key, patterns in PathCollection.config.items():  # TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
+                PathCollection.config[key] = list(dict.fromkeys(patterns))
+            PathCollection._writeJSONAtomic(PathCollection.configPath, PathCollection.config)
+            PathCollection._configDirty = False
         return True
 
     @staticmethod
@@ -135,13 +174,17 @@ class PathCollection(ABC):
             logger.warning(f"config file does not exist (maybe not yet), returning empty")
             return False
         logger.debug("Reading config from json: {}".format(PathCollection.configPath))
-        if len(PathCollection.config) != 0:
-            logger.info(
-                f"Found {len(PathCollection.config)} config settings already in class. This will overwrite any existing patterns")
-        with open(PathCollection.configPath, 'r') as file:
-            PathCollection.config.update(json.load(file))
-        for key, patterns in PathCollection.config.items():  # TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
-            PathCollection.config[key] = list(set(patterns))
+        with PathCollection.registryLock:
+            if len(PathCollection.config) != 0:
+                logger.info(
+                    f"Found {len(PathCollection.config)} config settings already in class. This will overwrite any existing patterns")
+            with open(PathCollection.configPath, 'r') as file:
+                loaded = json.load(file)
+            if PathCollection._configDirty:  # changes which were not flushed yet take precedence
+                loaded.update(PathCollection.config)
+            PathCollection.config.update(loaded)
+            for key, patterns in PathCollection.config.items():  # TODO Silly solution to fix the bug that patterns would be added to the JSON file multiple times for whatever reason
+                PathCollection.config[key] = list(dict.fromkeys(patterns))
         return True
 
     def __str__(self):
@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import fnmatch
+import threading
+from functools import lru_cache
+from mrpipe.meta import LoggerModule
+from mrpipe.meta import Interaction
+from mrpipe.meta.LoggerModule import Singleton
+from mrpipe.meta.DirectoryCache import DirectoryCache
+
+logger = LoggerModule.Logger()
+
+ValidIdentifyStrategies = ["ask", "acceptSingle", "first", "last"]
+
+
+@lru_cache(maxsize=None)
+def _compileRegex(pattern: str):
+    return re.compile(pattern)
+
+
+@lru_cache(maxsize=None)
+def _compileGlob(pattern: str):
+    return re.compile(fnmatch.translate(pattern))
+
+
+class PatternIdentifier(metaclass=Singleton):
+    """
+    Identifies input files of a session from the (cached) directory listing. All regular expressions and glob patterns
+    are compiled once and every call reads the listing of the search directory a single time.
+
+    How new files are accepted depends on the strategy:
+        acceptSingle: single matches are accepted, ambiguous matches are left unresolved (default)
+        ask:          single matches are confirmed and ambiguous matches are chosen by the user (blocks on input)
+        first / last: single matches are accepted, of ambiguous matches the first / last one in sorted order is taken
+    Files that could not be resolved without the user are collected and written as one report at the end of configure.
+    """
+
+    def __init__(self):
+        self.strategy = "acceptSingle"
+        self.unresolved = []
+        self.autoResolved = []
+        self._lock = threading.Lock()
+
+    def configure(self, strategy: str = None):
+        if strategy is None:
+            return
+        if strategy not in ValidIdentifyStrategies:
+            logger.error(f"Invalid identification strategy '{strategy}', must be one of {ValidIdentifyStrategies}. Using acceptSingle.")
+            strategy = "acceptSingle"
+        self.strategy = strategy
+        logger.info(f"File identification strategy: {self.strategy}")
+
+    @staticmethod
+    def _globMatches(names, pattern):
+        # glob semantics for a pattern relative to the search directory: hidden files only match explicit dot patterns
+        compiled = _compileGlob(pattern)
+        hidden = pattern.startswith(".")
+        return [name for name in names if compiled.match(name) and (hidden or not name.startswith("."))]
+
+    def _record(self, collection, fileDescription, searchDir, matches, reason):
+        with self._lock:
+            collection.append({"file": fileDescription, "directory": str(searchDir),
+                               "candidates": sorted(matches.values()), "reason": reason})
+
+    def identify(self, fileDescription, pattern, searchDir, previousPatterns, negativePattern):
+        # Returns (file name or None, new pattern or None, new negative pattern or None).
+        searchDir = str(searchDir)
+        try:
+            names = DirectoryCache().listdir(searchDir)
+        except FileNotFoundError:
+            names = []
+
+        for pp in previousPatterns:
+            if os.sep in pp:
+                # relative to searchDir, which keeps the subdirectories of the pattern
+                r = [os.path.relpath(f, searchDir) for f in DirectoryCache().glob(os.path.join(searchDir, pp))]
+            else:
+                r = self._globMatches(names, pp)
+            if len(r) == 1:
+                logger.debug(f"Found file with pattern {pp} in {searchDir}: \n{r[0]}")
+                return r[0], None, None
+            elif len(r) == 2:  # case when both *.nii and *.nii.gz file exist
+                short, long = sorted(r, key=len)
+                if long == (short + ".gz"):
+                    logger.debug(f"Found file with pattern {pp} in {searchDir}: \n{long}")
+                    return long, None, None
+
+        compiled = _compileRegex(pattern)
+        negatives = [_compileRegex(neg) for neg in negativePattern]
+        matches = {}
+        for file in names:
+            if any(neg.match(file) for neg in negatives):
+                continue  # Skip files that match any negative pattern
+            if m := compiled.match(file):
+                matches[m.group(1)] = file
+
+        if len(matches) == 0:
+            return None, None, None
+        if len(matches) == 1:
+            key = next(iter(matches))
+            logger.info(f'Found pattern Match for {fileDescription} in {searchDir}: {key}')
+            if self.strategy != "ask":
+                return matches[key], key, None
+            if self._confirmChoosen(fileDescription, matches[key], key):
+                return matches[key], key, None
+            return None, None, key
+
+        if self.strategy == "ask":
+            key = self._identifyChoose(fileDescription=fileDescription, matches=matches)
+        elif self.strategy in ["first", "last"]:
+            ordered = sorted(matches, key=lambda k: matches[k])
+            key = ordered[0] if self.strategy == "first" else ordered[-1]
+            self._record(self.autoResolved, fileDescription, searchDir, matches, f"{self.strategy}: {matches[key]}")
+        else:
+            key = None
+            self._record(self.unresolved, fileDescription, searchDir, matches, "ambiguous")
+            logger.warning(f"Multiple files match {fileDescription} in {searchDir}, leaving it unresolved: {sorted(matches.values())}")
+        if key is not None:
+            logger.info(f'Found pattern Match for {fileDescription} in {searchDir}: {key}')
+            return matches[key], key, None
+        return None, None, None
+
+    @staticmethod
+    def _identifyChoose(fileDescription, matches):
+        Interaction.requireInteraction(f"choose file for {fileDescription}")
+        while True:
+            try:
+                print(f"Please select the correct match for '{fileDescription}' from the following list. This will be used as Template for other Subjects and Sessions if possible:")
+                print("0: No Valid match")
+                for i, key in enumerate(matches, 1):
+                    print(f"{i}: {matches[key]}")
+                # Wait for the user to enter a number to specify the correct match
+                correct_match_index = int(input()) - 1
+                if 0 <= correct_match_index < len(matches):
+                    return list(matches)[correct_match_index]
+                elif correct_match_index == -1:
+                    return None
+                else:
+                    print("Invalid Input, please try again:")
+            except Exception as e:
+                print("Invalid Input, please try again:")
+
+    @staticmethod
+    def _confirmChoosen(fileDescription, match, key):
+        Interaction.requireInteraction(f"confirm file for {fileDescription}")
+        while True:
+            print(f"Please verify that for '{fileDescription}' the following is correct:\n File: {match}\n Pattern: {key}\n For: {fileDescription}")
+            print(f"(y)es or (n)o?:")
+            response = input().lower()
+            if response == "y" or response == "yes":
+                return True
+            if response == "n" or response == "no":
+                return False
+            else:
+                print("Invalid Input, please try again:")
+
+    def writeReport(self, path):
+        # One report of all files which were chosen automatically or could not be resolved.
+        if not self.unresolved and not self.autoResolved:
+            if os.path.isfile(str(path)):
+                os.remove(str(path))  # report of an earlier run
+            return
+        with self._lock:
+            report = {"strategy": self.strategy, "unresolved": self.unresolved, "autoResolved": self.autoResolved}
+        with open(str(path), "w") as f:
+            json.dump(report, f, indent=2)
+        if self.unresolved:
+            logger.process(f"{len(self.unresolved)} input files could not be identified without user input. See {path}. Rerun configure with --identifyStrategy ask to resolve them interactively, or add negative patterns.")
+        if self.autoResolved:
+            logger.process(f"{len(self.autoResolved)} ambiguous input files were chosen automatically ({self.strategy}). See {path}.")
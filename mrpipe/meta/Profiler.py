@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import json
+import html
+import cProfile
+import resource
+import threading
+import contextlib
+from datetime import datetime
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LoggerModule import Singleton
+
+logger = LoggerModule.Logger()
+
+
+class Profiler(metaclass=Singleton):
+    """
+    Lightweight instrumentation for the configure step. Each phase records wall time, cpu time, memory growth and the
+    number of filesystem metadata calls issued while it was active. Phases may be nested (e.g. one phase per processing
+    module within the module setup phase); all numbers are inclusive of nested phases.
+    Disabled by default, in which case phase() costs next to nothing.
+    """
+    # os functions whose calls are counted. os.path.exists/isfile/isdir/getsize and glob all route through these.
+    fsFunctions = ("stat", "lstat", "listdir", "scandir", "open", "remove", "rename", "replace", "makedirs", "mkdir")
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.records = []
+        # one counter dict per thread (the --configThreads workers call the wrappers concurrently), summed on demand
+        self._threadCounts = []
+        self._local = threading.local()
+        self._countsLock = threading.Lock()
+        self._originalFs = {}
+        self._stack = []
+        self._cprofileActive = False
+        self._startedAt = None
+        self._pageSize = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def enable(self, cprofile=False):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.cprofile = cprofile
+        self._startedAt = datetime.now()
+        self._patchFilesystem()
+        logger.process(f"Profiling enabled (cProfile per phase: {cprofile}).")
+
+    def disable(self):
+        self._restoreFilesystem()
+        self.enabled = False
+
+    def _patchFilesystem(self):
+        for name in self.fsFunctions:
+            original = getattr(os, name, None)
+            if original is None:
+                continue
+            self._originalFs[name] = original
+            setattr(os, name, self._countingWrapper(name, original))
+
+    def _restoreFilesystem(self):
+        for name, original in self._originalFs.items():
+            setattr(os, name, original)
+        self._originalFs = {}
+
+    def _countsOfThread(self):
+        counts = getattr(self._local, "counts", None)
+        if counts is None:
+            counts = {name: 0 for name in self.fsFunctions}
+            with self._countsLock:
+                self._threadCounts.append(counts)
+            self._local.counts = counts
+        return counts
+
+    def fsCounts(self) -> dict:
+        total = {name: 0 for name in self.fsFunctions}
+        with self._countsLock:
+            for counts in self._threadCounts:
+                for name, n in counts.items():
+                    total[name] += n
+        return total
+
+    def _countingWrapper(self, name, original):
+        def wrapper(*args, **kwargs):
+            self._countsOfThread()[name] += 1
+            return original(*args, **kwargs)
+        wrapper.__wrapped__ = original
+        return wrapper
+
+    def _rss(self):
+        # current resident set size in bytes; falls back to peak rss where /proc is not available
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * self._pageSize
+        except Exception:
+            return self._maxRss()
+
+    @staticmethod
+    def _maxRss():
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    @contextlib.contextmanager
+    def phase(self, name, group="phase"):
+        if not self.enabled:
+            yield
+            return
+        parent = self._stack[-1] if self._stack else None
+        self._stack.append(name)
+        fsStart = self.fsCounts()
+        rssStart = self._rss()
+        profile = None
+        if self.cprofile and not self._cprofileActive:
+            profile = cProfile.Profile()
+            self._cprofileActive = True
+            profile.enable()
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wallStart
+            cpu = time.process_time() - cpuStart
+            if profile is not None:
+                profile.disable()
+                self._cprofileActive = False
+            rssEnd = self._rss()
+            self._stack.pop()
+            fsEnd = self.fsCounts()
+            fsCalls = {key: fsEnd[key] - fsStart[key] for key in fsEnd if fsEnd[key] - fsStart[key] > 0}
+            self.records.append({
+                "name": name,
+                "group": group,
+                "parent": parent,
+                "depth": len(self._stack),
+                "wallSeconds": round(wall, 4),
+                "cpuSeconds": round(cpu, 4),
+                "rssStartMB": round(rssStart / 1024 ** 2, 2),
+                "rssEndMB": round(rssEnd / 1024 ** 2, 2),
+                "rssGrowthMB": round((rssEnd - rssStart) / 1024 ** 2, 2),
+                "fsCalls": fsCalls,
+                "fsCallsTotal": sum(fsCalls.values()),
+                "profile": profile,
+            })
+
+    def summary(self):
+        groups = {}
+        for record in self.records:
+            group = groups.setdefault(record["group"], {"count": 0, "wallSeconds": 0.0, "cpuSeconds": 0.0, "fsCallsTotal": 0})
+            group["count"] += 1
+            group["wallSeconds"] += record["wallSeconds"]
+            group["cpuSeconds"] += record["cpuSeconds"]
+            group["fsCallsTotal"] += record["fsCallsTotal"]
+        return groups
+
+    def writeReport(self, outDir, prefix="configure"):
+        if not self.enabled or not self.records:
+            return None
+        os.makedirs(outDir, exist_ok=True)
+        stamp = self._startedAt.strftime("%Y%m%d_%H%M%S")
+        basename = f"{prefix}_{stamp}"
+
+        records = []
+        for idx, record in enumerate(self.records):
+            entry = {key: value for key, value in record.items() if key != "profile"}
+            if record["profile"] is not None:
+                profPath = os.path.join(outDir, f"{basename}_{idx:03d}_{self._safeName(record['name'])}.prof")
+                record["profile"].dump_stats(profPath)
+                entry["cProfile"] = profPath
+            records.append(entry)
+
+        report = {
+            "started": self._startedAt.isoformat(timespec="seconds"),
+            "peakRssMB": round(self._maxRss() / 1024 ** 2, 2),
+            "fsCallsTotal": self.fsCounts(),
+            "groups": self.summary(),
+            "phases": records,
+        }
+        jsonPath = os.path.join(outDir, basename + ".json")
+        with open(jsonPath, "w") as f:
+            json.dump(report, f, indent=2)
+        htmlPath = os.path.join(outDir, basename + ".html")
+        with open(htmlPath, "w") as f:
+            f.write(self._toHtml(report))
+        logger.process(f"Profiling report written to {jsonPath} and {htmlPath}")
+        self.logSummary(records)
+        return jsonPath
+
+    def logSummary(self, records, top=10):
+        topLevel = sorted([r for r in records if r["depth"] == 0], key=lambda r: r["wallSeconds"], reverse=True)
+        lines = [f"{r['name']:<40} wall {r['wallSeconds']:>9.2f}s  cpu {r['cpuSeconds']:>9.2f}s  fs {r['fsCallsTotal']:>9d}  rss {r['rssGrowthMB']:>+8.1f}MB" for r in topLevel[:top]]
+        logger.process("Slowest configure phases:\n" + "\n".join(lines))
+
+    @staticmethod
+    def _safeName(name):
+        return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)[:60]
+
+    @staticmethod
+    def _toHtml(report):
+        maxWall = max([r["wallSeconds"] for r in report["phases"]] + [1e-9])
+        rows = []
+        for r in sorted(report["phases"], key=lambda r: (r["group"] != "phase", -r["wallSeconds"])):
+            width = int(300 * r["wallSeconds"] / maxWall)
+            fs = ", ".join(f"{k}: {v}" for k, v in r["fsCalls"].items())
+            rows.append(
+                f"<tr><td>{html.escape(r['group'])}</td><td style='padding-left:{r['depth'] * 16}px'>{html.escape(r['name'])}</td>"
+                f"<td>{r['wallSeconds']:.3f}</td><td><div style='background:#4a90d9;height:10px;width:{width}px'></div></td>"
+                f"<td>{r['cpuSeconds']:.3f}</td><td>{r['rssGrowthMB']:+.1f}</td><td>{r['rssEndMB']:.1f}</td>"
+                f"<td>{r['fsCallsTotal']}</td><td>{html.escape(fs)}</td><td>{html.escape(r.get('cProfile', ''))}</td></tr>")
+        groups = "".join(
+            f"<tr><td>{html.escape(name)}</td><td>{g['count']}</td><td>{g['wallSeconds']:.3f}</td><td>{g['cpuSeconds']:.3f}</td><td>{g['fsCallsTotal']}</td></tr>"
+            for name, g in report["groups"].items())
+        return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>mrpipe configure profile</title>
+<style>body{{font-family:sans-serif;font-size:13px}} table{{border-collapse:collapse}} td,th{{border:1px solid #ccc;padding:2px 6px;text-align:left}}</style>
+</head><body>
+<h2>mrpipe configure profile ({html.escape(report['started'])})</h2>
+<p>Peak RSS: {report['peakRssMB']} MB</p>
+<h3>Groups</h3>
+<table><tr><th>group</th><th>count</th><th>wall [s]</th><th>cpu [s]</th><th>fs calls</th></tr>{groups}</table>
+<h3>Phases</h3>
+<table><tr><th>group</th><th>name</th><th>wall [s]</th><th></th><th>cpu [s]</th><th>rss growth [MB]</th><th>rss end [MB]</th><th>fs calls</th><th>fs call breakdown</th><th>cProfile</th></tr>
+{''.join(rows)}
+</table></body></html>
+"""
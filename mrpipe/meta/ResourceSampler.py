@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# Runs a command and samples the resource usage of its whole process tree from /proc. Unlike /usr/bin/time -v, which
+# only reports the largest single process, this captures memory and I/O of multi-process tools over time.
+# Only uses the standard library, as it runs in the environment of the wrapped tool.
+import argparse
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import signal
+import socket
+import threading
+import subprocess
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+SERIES_FIELDS = ["t", "cpu", "rss", "threads", "nproc", "read", "write"]
+
+
+class ResourceSampler:
+    """
+    Samples the process tree below pid every interval seconds. Per sample: cumulative cpu seconds, summed resident
+    memory, threads, number of processes and cumulative read / write bytes of the tree. CPU and I/O of processes which
+    exited and were reaped are contained in the counters of their parents, so the sums over the live tree keep growing.
+    The time series is thinned to at most maxSamples entries by dropping every other sample and doubling the interval.
+    """
+
+    def __init__(self, pid: int, interval: float = 1.0, maxSamples: int = 2000):
+        self.pid = pid
+        self.interval = interval
+        self.maxSamples = maxSamples
+        self.start = time.time()
+        self.series = {field: [] for field in SERIES_FIELDS}
+        self.peak = {"rss": 0, "threads": 0, "nproc": 0, "cpu": 0.0, "read": 0, "write": 0}
+        self.available = os.path.isdir("/proc/self")
+
+    @staticmethod
+    def _readStat(pid):
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read().decode("utf-8", "replace")
+        fields = data[data.rindex(")") + 2:].split()  # the command name may contain spaces
+        # fields[0] is field 3 (state) of proc(5)
+        return {"ppid": int(fields[1]),
+                "cpu": (int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])) / CLOCK_TICKS,
+                "threads": int(fields[17]),
+                "rss": int(fields[21]) * PAGE_SIZE}
+
+    @staticmethod
+    def _readIO(pid):
+        try:
+            with open(f"/proc/{pid}/io", "r") as f:
+                values = dict(line.split(": ") for line in f.read().splitlines())
+            return int(values.get("read_bytes", 0)), int(values.get("write_bytes", 0))
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _tree(self):
+        stats = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    stats[int(entry)] = self._readStat(entry)
+                except (OSError, ValueError, IndexError):
+                    continue  # process exited while reading
+        children = {}
+        for pid, stat in stats.items():
+            children.setdefault(stat["ppid"], []).append(pid)
+        tree = []
+        pending = [self.pid] if self.pid in stats else []
+        while pending:
+            pid = pending.pop()
+            tree.append(pid)
+            pending.extend(children.get(pid, []))
+        return {pid: stats[pid] for pid in tree}
+
+    def sample(self):
+        if not self.available:
+            return
+        tree = self._tree()
+        if not tree:
+            return
+        values = {"t": round(time.time() - self.start, 2), "nproc": len(tree),
+                  "cpu": round(sum(s["cpu"] for s in tree.values()), 2),
+                  "rss": sum(s["rss"] for s in tree.values()),
+                  "threads": sum(s["threads"] for s in tree.values())}
+        io = [self._readIO(pid) for pid in tree]
+        values["read"] = sum(r for r, _ in io)
+        values["write"] = sum(w for _, w in io)
+        for field in self.peak:
+            self.peak[field] = max(self.peak[field], values[field])
+        for field in SERIES_FIELDS:
+            self.series[field].append(values[field])
+        if len(self.series["t"]) >= self.maxSamples:
+            for field in SERIES_FIELDS:
+                self.series[field] = self.series[field][::2]
+            self.interval *= 2
+
+    def summary(self, returncode, rusage):
+        wall = time.time() - self.start
+        record = {"command": None, "host": socket.gethostname(), "start": self.start, "end": self.start + wall,
+                  "wall": round(wall, 3), "returncode": returncode, "interval": self.interval,
+                  "peakRss": self.peak["rss"], "peakThreads": self.peak["threads"], "peakProcesses": self.peak["nproc"],
+                  "readBytes": self.peak["read"], "writeBytes": self.peak["write"], "series": self.series}
+        if rusage is not None:
+            # rusage of the reaped child contains all of its reaped descendants
+            record["user"] = round(rusage.ru_utime, 3)
+            record["sys"] = round(rusage.ru_stime, 3)
+            record["maxRssSingleProcess"] = rusage.ru_maxrss * 1024
+        else:
+            record["user"] = record["sys"] = None
+            record["maxRssSingleProcess"] = None
+        record["cpu"] = round(max(self.peak["cpu"], (record["user"] or 0) + (record["sys"] or 0)), 3)
+        return record
+
+
+def slurmEnvironment():
+    return {key: value for key, value in os.environ.items() if key.startswith("SLURM") or key.startswith("MRPIPE_")}
+
+
+def writeRecord(record, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(record, f, separators=(",", ":"))
+    os.replace(tmpPath, path)
+
+
+class Tee(threading.Thread):
+    # copies a pipe of the command to the own stream (the job log) and into a gzip side file
+    def __init__(self, pipe, stream, path):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.stream = stream
+        self.path = path
+
+    def run(self):
+        with gzip.open(self.path, "wb", compresslevel=6) as side:
+            for chunk in iter(lambda: self.pipe.read1(1 << 16), b""):
+                self.stream.write(chunk)
+                self.stream.flush()
+                side.write(chunk)
+
+
+def spoolName(spool):
+    # one file per task run, in a directory per node: runs never write to the same file and need no locking
+    directory = os.path.join(spool, socket.gethostname())
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{time.strftime('%Y%m%d%H%M%S')}_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+
+
+def printSummary(record):
+    gb = 1024 ** 3
+    print("")
+    print("----------------------------------------")
+    print(f" Command: {' '.join(record['command'])}")
+    print("----------------------------------------")
+    print(f" Real time : {record['wall']}s")
+    print(f" User time : {record['user']}s")
+    print(f" Sys time  : {record['sys']}s")
+    print(f" Max RSS   : {record['peakRss'] / gb:.3f} GB (process tree), {(record['maxRssSingleProcess'] or 0) / gb:.3f} GB (largest process)")
+    print(f" I/O       : {record['readBytes'] / gb:.3f} GB read, {record['writeBytes'] / gb:.3f} GB written")
+    print(f" Processes : {record['peakProcesses']} (peak), {record['peakThreads']} threads (peak)")
+    print("----------------------------------------", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a command and record the resource usage of its process tree.")
+    parser.add_argument('-i', '--interval', dest="interval", type=float, default=1.0,
+                        help="Seconds between two samples.")
+    parser.add_argument('-o', '--output', dest="output", type=str, default=None,
+                        help="Write the record as json to this file.")
+    parser.add_argument('-s', '--spool', dest="spool", type=str, default=None,
+                        help="Spool directory: writes the record and the gzipped stdout / stderr of the command there, to be collected into the log database.")
+    parser.add_argument('-l', '--label', dest="labels", action="append", default=[],
+                        help="KEY=VALUE added to the record, e.g. subject=sub-01. Can be given multiple times.")
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="Command to run, optionally separated by --.")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command and args.command[0] == "--" else args.command
+    if not command:
+        parser.error("No command given.")
+
+    spoolBase = None
+    tees = []
+    if args.spool:
+        try:
+            spoolBase = spoolName(args.spool)
+        except OSError as e:
+            print(f"Could not create spool directory in {args.spool}, not capturing output: {e}", file=sys.stderr)
+    if spoolBase:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        tees = [Tee(proc.stdout, sys.stdout.buffer, spoolBase + ".stdout.gz"),
+                Tee(proc.stderr, sys.stderr.buffer, spoolBase + ".stderr.gz")]
+        for tee in tees:
+            tee.start()
+    else:
+        proc = subprocess.Popen(command)
+
+    def forward(signum, frame):
+        try:
+            proc.send_signal(signum)
+        except ProcessLookupError:
+            pass
+    for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGUSR2]:
+        signal.signal(signum, forward)
+
+    sampler = ResourceSampler(proc.pid, interval=args.interval)
+    rusage = None
+    while True:
+        sampler.sample()
+        deadline = time.time() + sampler.interval
+        while time.time() < deadline:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            time.sleep(min(0.05, sampler.interval))
+        else:
+            continue
+        break
+    returncode = os.waitstatus_to_exitcode(status)
+    proc.returncode = returncode
+    for tee in tees:
+        tee.join()
+
+    record = sampler.summary(returncode, rusage)
+    record["command"] = command
+    record["environment"] = slurmEnvironment()
+    record["labels"] = dict(label.split("=", 1) for label in args.labels if "=" in label)
+    outputs = [args.output] if args.output else []
+    if spoolBase:
+        record["stdoutFile"] = os.path.basename(spoolBase) + ".stdout.gz"
+        record["stderrFile"] = os.path.basename(spoolBase) + ".stderr.gz"
+        outputs.append(spoolBase + ".json")  # written last, the collector only picks up complete records
+    for output in outputs:
+        try:
+            writeRecord(record, output)
+        except OSError as e:
+            print(f"Could not write resource record to {output}: {e}", file=sys.stderr)
+    printSummary(record)
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.SidecarCache import SidecarCache
+
+logger = LoggerModule.Logger()
+
+# raw sidecar fields stored in the cache, the inventory columns are derived from these
+SidecarFields = ["EchoTime", "MagneticFieldStrength", "Manufacturer", "ManufacturersModelName", "ManufacturerModelName",
+                 "DeviceSerialNumber", "StationName", "InstitutionName", "InstitutionAddress", "InstitutionalDepartmentName",
+                 "SoftwareVersions", "SequenceName", "SeriesDescription", "ProtocolName", "ScanningSequence",
+                 "SequenceVariant", "ScanOptions", "ReceiveCoilName", "CoilString", "FlipAngle", "RepetitionTime",
+                 "InversionTime", "PhaseEncodingDirection"]
+
+HeaderFields = ["voxel_size_x", "voxel_size_y", "voxel_size_z", "voxel_size_t", "image_size_x", "image_size_y",
+                "image_size_z", "image_size_t", "image_size", "slope", "intercept", "data_type", "orientation", "descrip",
+                "aux_file"]
+
+
+def _headerString(value):
+    # descrip / aux_file are stored as byte arrays
+    return value.tobytes().decode(errors="ignore").strip("\x00") if hasattr(value, "tobytes") else str(value)
+
+
+def niftiHeaderInfo(imagePath) -> dict:
+    info = dict.fromkeys(HeaderFields)
+    try:
+        import nibabel as nib
+        from nibabel.orientations import aff2axcodes
+    except ImportError:
+        return info
+    try:
+        img = nib.load(str(imagePath))
+        hdr = img.header
+        zooms = hdr.get_zooms()
+        shape = hdr.get_data_shape()
+        for axis, zoom, size in zip("xyzt", zooms, shape):
+            info[f"voxel_size_{axis}"] = float(zoom)
+            info[f"image_size_{axis}"] = int(size)
+        # scl_slope and scl_inter may not always be present
+        for key, field, default in [("slope", "scl_slope", 1.0), ("intercept", "scl_inter", 0.0)]:
+            try:
+                info[key] = float(hdr.get(field, default))
+            except Exception:
+                pass
+        try:
+            info["data_type"] = str(hdr.get_data_dtype())
+        except Exception:
+            pass
+        try:
+            info["orientation"] = "".join(aff2axcodes(img.affine))
+        except Exception:
+            pass
+        for key in ["descrip", "aux_file"]:
+            try:
+                if hdr.get(key) is not None:
+                    info[key] = _headerString(hdr.get(key))
+            except Exception:
+                pass
+    except Exception as e:
+        logger.debug(f"Failed reading NIfTI header for {imagePath}: {e}")
+    return info
+
+
+def sidecarInfo(jsonPath) -> dict:
+    try:
+        attributes = SidecarCache().get(jsonPath)
+    except Exception as e:
+        logger.debug(f"Failed reading sidecar {jsonPath}: {e}")
+        return {}
+    return {field: attributes[field] for field in SidecarFields if field in attributes}
+
+
+class ScanInventory:
+    """
+    Header and sidecar information of the input scans, for the scan inventory written during configuration.
+
+    Reading a NIfTI header means opening (and for .nii.gz decompressing the start of) every image, which dominates the
+    inventory of large cohorts on network file systems. Files are therefore read by a thread pool and the results are
+    cached in a sqlite file keyed by path, size and modification time: unchanged scans are never opened again.
+    The cache stores the raw values, so which columns the inventory derives from them may change without invalidating it.
+    """
+
+    cacheVersion = 1
+    readers = {"nifti": niftiHeaderInfo, "sidecar": sidecarInfo}
+
+    def __init__(self, cachePath, threads: int = 8):
+        self.cachePath = str(cachePath)
+        self.threads = max(1, threads)
+        self.cache = {}  # (path, kind) -> (size, mtime, info)
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.cachePath, timeout=120)
+        conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT, kind TEXT, size INTEGER, mtime REAL, info TEXT, PRIMARY KEY (path, kind))")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return conn
+
+    def _load(self):
+        try:
+            with self._connect() as conn:
+                version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+                if version is None or int(version[0]) != ScanInventory.cacheVersion:
+                    conn.execute("DELETE FROM files")
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(ScanInventory.cacheVersion),))
+                    return
+                for path, kind, size, mtime, info in conn.execute("SELECT path, kind, size, mtime, info FROM files"):
+                    self.cache[(path, kind)] = (size, mtime, info)
+        except (sqlite3.Error, ValueError) as e:
+            logger.logExceptionError(f"Could not read the scan inventory cache {self.cachePath}, reading all scans.", e)
+            self.cache = {}
+
+    def _read(self, path, kind):
+        # returns (info, cache row or None if the cached entry was valid)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {}, None
+        cached = self.cache.get((path, kind))
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return json.loads(cached[2]), None
+        info = ScanInventory.readers[kind](path)
+        return info, (path, kind, stat.st_size, stat.st_mtime, json.dumps(info, default=str))
+
+    def lookup(self, requests) -> dict:
+        # requests: iterable of (path, kind) with kind nifti or sidecar; returns (path, kind) -> info
+        requests = list(dict.fromkeys((str(path), kind) for path, kind in requests if path is not None))
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            results = list(executor.map(lambda request: self._read(*request), requests))
+        updates = [row for _, row in results if row is not None]
+        self.misses += len(updates)
+        self.hits += len(results) - len(updates)
+        if updates:
+            try:
+                with self._connect() as conn:
+                    conn.executemany("INSERT OR REPLACE INTO files (path, kind, size, mtime, info) VALUES (?, ?, ?, ?, ?)", updates)
+            except sqlite3.Error as e:
+                logger.logExceptionError(f"Could not update the scan inventory cache {self.cachePath}", e)
+            for path, kind, size, mtime, info in updates:
+                self.cache[(path, kind)] = (size, mtime, info)
+        return {request: info for request, (info, _) in zip(requests, results)}
+
+    @staticmethod
+    def _sqlValue(value):
+        # sqlite only stores scalars; BIDS allows arrays for e.g. ScanningSequence, SequenceVariant and ScanOptions
+        if isinstance(value, (list, tuple, dict)):
+            return json.dumps(value, default=str)
+        return value
+
+    @staticmethod
+    def write(modalityRows: dict, outPath, csvDir=None):
+        # one table per modality in a sqlite file, replaced as a whole; optionally also one csv per modality. The csv
+        # files are written even if the sqlite file fails.
+        tmpPath = str(outPath) + ".tmp"
+        try:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            with sqlite3.connect(tmpPath) as conn:
+                for modality, rows in modalityRows.items():
+                    table = pd.DataFrame(rows)
+                    table = table.apply(lambda column: column.map(ScanInventory._sqlValue) if column.dtype == object else column)
+                    table.to_sql(modality, conn, index=False)
+            conn.close()
+            os.replace(tmpPath, str(outPath))
+            logger.process(f"Wrote scan inventory of {len(modalityRows)} modalities to {outPath}")
+        except Exception as e:
+            logger.logExceptionError(f"Failed writing the scan inventory {outPath}", e)
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        if csvDir is not None:
+            for modality, rows in modalityRows.items():
+                outfile = os.path.join(str(csvDir), f"{modality}_scans.csv")
+                try:
+                    pd.DataFrame(rows).to_csv(outfile, index=False)
+                    logger.process(f"Wrote scan inventory for {modality} to {outfile}")
+                except Exception as e:
+                    logger.logExceptionError(f"Failed writing the scan inventory for {modality} to {outfile}", e)
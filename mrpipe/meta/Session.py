@@ -3,6 +3,7 @@ from typing import List
 from mrpipe.modalityModules.PathDicts.SubjectPaths import SubjectPaths
 from mrpipe.meta import LoggerModule
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.DirectoryCache import DirectoryCache
 from mrpipe.modalityModules.Modalities import Modalities
 import os
 
@@ -27,7 +28,7 @@ class Session:
     def identifyModalities(self, suggestedModalities: dict = {}):
         dummyModality = Modalities()
         # potential = os.listdir(self.path + "/unprocessed")
-        potential = [f for f in os.listdir(self.path) if not f.startswith('.')]
+        potential = [f for f in DirectoryCache().listdir(self.path) if not f.startswith('.')]
         matches = {}
         for name in potential:
             if suggestedModalities and suggestedModalities.get(name):
@@ -0,0 +1,50 @@
+import os
+import json
+import threading
+from mrpipe.meta import LoggerModule
+from mrpipe.meta.LoggerModule import Singleton
+
+logger = LoggerModule.Logger()
+
+
+class SidecarCache(metaclass=Singleton):
+    """
+    Parsed content of json sidecars, shared by the whole process and keyed by path and mtime: every sidecar is read and
+    parsed once, however many ImageWithSideCar instances (or the scan inventory) query its attributes. A changed mtime
+    makes the next query read the file again.
+    The BidsCrawler seeds the cache from its manifest, so unchanged sidecars are not opened at all on reruns.
+    The returned dicts are shared, callers must not modify them.
+    """
+
+    def __init__(self):
+        self._entries = {}  # abs path -> (mtime, attributes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.reads = 0
+
+    def seed(self, path, mtime, attributes: dict):
+        with self._lock:
+            self._entries[os.path.abspath(str(path))] = (mtime, attributes)
+
+    def get(self, path) -> dict:
+        # raises OSError if the file can not be read and ValueError (json.JSONDecodeError) if it is not valid json
+        path = os.path.abspath(str(path))
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.hits += 1
+                return cached[1]
+        with open(path, "r") as f:
+            attributes = json.load(f)
+        with self._lock:
+            self._entries[path] = (mtime, attributes)
+            self.reads += 1
+        return attributes
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def logStats(self):
+        logger.info(f"Sidecar cache: {len(self._entries)} sidecars, {self.reads} read from disk, {self.hits} answered from memory.")
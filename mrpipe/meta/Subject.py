@@ -3,6 +3,7 @@ from mrpipe.meta import LoggerModule
 from typing import List
 from mrpipe.meta.PathClass import Path
 from mrpipe.modalityModules.PathDicts.BasePaths import PathBase
+from mrpipe.modalityModules.PathDicts.SubjectPaths import SubjectPaths
 
 logger = LoggerModule.Logger()
 
@@ -21,6 +22,14 @@ class Subject:
             self.sessions.append(session)
             logger.info(f"Added Session: {session} to subject: {self.id}")
 
+    def resetPaths(self):
+        # discard partially configured paths, e.g. when configuration has to be repeated interactively. Only the path
+        # objects are reset: file patterns added to PathCollection.filePatterns and directories created by the aborted
+        # attempt stay in place. Those patterns were established without user input, so a clean run adds the same ones.
+        for session in self.sessions:
+            session.subjectPaths = SubjectPaths()
+            session.pathsConfigured = False
+
     def configurePaths(self, basePaths: PathBase):
         for session in self.sessions:
             logger.info(f"Configuring paths for subject {self.id} with session: {session}")
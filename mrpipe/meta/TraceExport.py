@@ -0,0 +1,160 @@
+import os
+import json
+import pandas as pd
+from mrpipe.meta import LoggerModule
+
+logger = LoggerModule.Logger()
+
+ValidTraceRows = ["pipejob", "node", "subject"]
+
+
+def _us(seconds):
+    return int(round(seconds * 1e6))
+
+
+def _lanes(spans):
+    # assigns every (start, end, ...) span to the first lane which is free at its start, so spans within a lane never
+    # overlap (trace viewers only nest spans of one thread, overlapping ones are drawn on top of each other)
+    laneEnds = []
+    assigned = []
+    for span in sorted(spans, key=lambda s: (s[0], s[1])):
+        for lane, end in enumerate(laneEnds):
+            if end <= span[0]:
+                laneEnds[lane] = span[1]
+                break
+        else:
+            lane = len(laneEnds)
+            laneEnds.append(span[1])
+        assigned.append((lane, span))
+    return assigned
+
+
+class TraceExporter:
+    """
+    Writes the task runs of the log database and the Slurm times of the pipe jobs as Chrome trace event json, which opens
+    in Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+    Rows (processes in the viewer) are pipe jobs, nodes or subjects; concurrent tasks of a row are spread over lanes.
+    With rows per pipe job, the first lane shows the Slurm phases of the job: queued (submit to start), setup (start to
+    the first task) and teardown (last task to end). Arrows connect the jobs of the self submitting step chain. Counters
+    of running tasks and queued jobs show idle periods of the whole pipeline.
+
+    jobs: list of dicts with name, module, nextJob (module/name of the next job in the chain or None) and the Slurm times
+    submit, start, end (epoch seconds or None).
+    """
+
+    def __init__(self, runs: pd.DataFrame, jobs: list = None, rows: str = "pipejob"):
+        if rows not in ValidTraceRows:
+            raise ValueError(f"Invalid trace rows {rows}, must be one of {ValidTraceRows}.")
+        self.runs = runs.dropna(subset=["timestampstart", "timestampend"])
+        self.jobs = jobs or []
+        self.rows = rows
+        self.events = []
+        self.origin = None
+        self._pids = {}
+
+    def _pid(self, name):
+        if name not in self._pids:
+            self._pids[name] = len(self._pids) + 1
+            self.events.append({"name": "process_name", "ph": "M", "pid": self._pids[name], "args": {"name": str(name)}})
+            self.events.append({"name": "process_sort_index", "ph": "M", "pid": self._pids[name], "args": {"sort_index": self._pids[name]}})
+        return self._pids[name]
+
+    def _span(self, name, category, start, end, pid, tid, args=None):
+        self.events.append({"name": name, "cat": category, "ph": "X", "ts": _us(start - self.origin),
+                            "dur": max(_us(end - start), 1), "pid": pid, "tid": tid, "args": args or {}})
+
+    def _threadName(self, pid, tid, name):
+        self.events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+    def _rowName(self, run):
+        if self.rows == "pipejob":
+            return f"{run['processingmodule']}/{run['job']}"
+        if self.rows == "node":
+            return run["host"]
+        return f"{run['subject']} {run['session']}"
+
+    def _jobSpans(self):
+        # Slurm phases of each job in the first lane of its row, only for rows per pipe job
+        firstLast = self.runs.groupby(["processingmodule", "job"]).agg(first=("timestampstart", "min"), last=("timestampend", "max"))
+        for job in self.jobs:
+            submit, start, end = job.get("submit"), job.get("start"), job.get("end")
+            if not (submit or start):
+                continue  # not run on Slurm (yet)
+            pid = self._pid(f"{job['module']}/{job['name']}")
+            self._threadName(pid, 0, "slurm")
+            first, last = firstLast.loc[(job["module"], job["name"])] if (job["module"], job["name"]) in firstLast.index else (None, None)
+            if submit and start:
+                self._span("queued", "slurm", submit, start, pid, 0, {"slurmJobId": job.get("slurmJobId")})
+            if start and first and first >= start:
+                self._span("setup", "slurm", start, first, pid, 0)
+            if end and last and end >= last:
+                self._span("teardown", "slurm", last, end, pid, 0)
+
+    def _chainFlows(self):
+        # arrows from the end of a job to the submission of the next job of the step chain
+        jobs = {f"{job['module']}/{job['name']}": job for job in self.jobs}
+        for index, job in enumerate(self.jobs):
+            nextJob = jobs.get(job.get("nextJob"))
+            if not nextJob or not job.get("end") or not (nextJob.get("submit") or nextJob.get("start")):
+                continue
+            source = self._pid(f"{job['module']}/{job['name']}")
+            target = self._pid(f"{nextJob['module']}/{nextJob['name']}")
+            self.events.append({"name": "next step", "cat": "chain", "ph": "s", "id": index, "pid": source, "tid": 0,
+                                "ts": _us(job["end"] - self.origin) - 1})
+            self.events.append({"name": "next step", "cat": "chain", "ph": "f", "bp": "e", "id": index, "pid": target,
+                                "tid": 0, "ts": _us((nextJob.get("submit") or nextJob.get("start")) - self.origin)})
+
+    def _counters(self):
+        pid = self._pid("pipeline")
+        changes = [(start, 1) for start in self.runs["timestampstart"]] + [(end, -1) for end in self.runs["timestampend"]]
+        running = 0
+        for t, change in sorted(changes):
+            running += change
+            self.events.append({"name": "running tasks", "ph": "C", "pid": pid, "ts": _us(t - self.origin), "args": {"tasks": running}})
+        changes = [(job["submit"], 1) for job in self.jobs if job.get("submit") and job.get("start")] + \
+                  [(job["start"], -1) for job in self.jobs if job.get("submit") and job.get("start")]
+        queued = 0
+        for t, change in sorted(changes):
+            queued += change
+            self.events.append({"name": "queued jobs", "ph": "C", "pid": pid, "ts": _us(t - self.origin), "args": {"jobs": queued}})
+
+    def build(self) -> dict:
+        times = list(self.runs["timestampstart"]) + [job[key] for job in self.jobs for key in ["submit", "start"] if job.get(key)]
+        if not times:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        self.origin = min(times)
+        self.events = []
+        self._pids = {}
+        self._pid("pipeline")
+        firstLane = 0
+        if self.rows == "pipejob":
+            self._jobSpans()
+            self._chainFlows()
+            firstLane = 1
+        rows = {}
+        for run in self.runs.to_dict("records"):
+            rows.setdefault(self._rowName(run), []).append((run["timestampstart"], run["timestampend"], run))
+        for rowName, spans in rows.items():
+            pid = self._pid(rowName)
+            lanes = set()
+            for lane, (start, end, run) in _lanes(spans):
+                tid = firstLane + lane
+                if tid not in lanes:
+                    self._threadName(pid, tid, f"lane {lane + 1}")
+                    lanes.add(tid)
+                args = {key: run.get(key) for key in ["subject", "session", "job", "host", "returncode", "Realtime",
+                                                      "Cputime", "PeakRSS", "ReadBytes", "WriteBytes"]}
+                self._span(run.get("task") or "task", "failed" if run.get("returncode") else "task", start, end, pid, tid,
+                           {key: (None if pd.isna(value) else value) for key, value in args.items()})
+        self._counters()
+        return {"traceEvents": self.events, "displayTimeUnit": "ms",
+                "otherData": {"origin": self.origin, "rows": self.rows}}
+
+    def write(self, path):
+        trace = self.build()
+        tmpPath = str(path) + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(trace, f, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+        os.replace(tmpPath, str(path))
+        logger.process(f"Wrote trace of {len(self.runs)} task runs and {len(self.jobs)} jobs to {path}. Open it in ui.perfetto.dev or chrome://tracing.")
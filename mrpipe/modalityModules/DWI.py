@@ -10,6 +10,7 @@ from mrpipe.Toolboxes.MRtrix3.mrconvert import MRCONVERTTOMIF, MRCONVERTTONIFTI
 from mrpipe.Toolboxes.MRtrix3.dwidenoise import DWIDENOISE
 from mrpipe.Toolboxes.MRtrix3.mrdegibbs import MRDEGIBBS
 from mrpipe.Toolboxes.MRtrix3.dwiextract import DWIEXTRACTFIRSTB0, DWIEXTRACTMEANB0, DWIEXTRACTTRACE, DWIEXTRACTForDTI
+from mrpipe.Toolboxes.standalone.DWIShellVis import DWIShellVis
 from mrpipe.Toolboxes.standalone.HDBet import HDBET
 from mrpipe.Toolboxes.standalone.QCVis import QCVis
 from mrpipe.Toolboxes.standalone.QCVisWithoutMask import QCVisWithoutMask
@@ -68,6 +69,17 @@ class DWI_base(ProcessingModule):
                                        zoom=1,
                                        session=session) for session in self.sessions]), env=self.envs.envQCVis)
 
+        # QC only, nothing depends on it: renders whenever resources are free, sessions with the same protocol share one video.
+        if not self.inputArgs.noDWIShellVis:
+            self.dwi_base_shellVis = PipeJobPartial(name="dwi_base_shellVis", job=SchedulerPartial(
+                taskList=[DWIShellVis(bval=session.subjectPaths.dwi.bids.dwi.get_bval_path(),
+                                      bvec=session.subjectPaths.dwi.bids.dwi.get_bvec_path(),
+                                      outfile=session.subjectPaths.dwi.meta_QC.shellVisMp4,
+                                      cacheDir=self.basepaths.shellVisCachePath,
+                                      bvalTolerance=self.inputArgs.bval_tol,
+                                      session=session) for session in self.sessions],
+                cpusPerTask=1, memPerCPU=2, minimumMemPerNode=2), env=self.envs.envMRPipe)
+
         self.dwi_base_b0ForTopup = PipeJobPartial(name="dwi_base_b0ForTopup", job=SchedulerPartial(
             taskList=[B0FORTOPUP(inputDWI=session.subjectPaths.dwi.bids.dwi,
                                  inputReverseMif=session.subjectPaths.dwi.bids_processed.basemif_reverse,
@@ -30,6 +30,10 @@ class PathBase(PathCollection):
         self.configPath = self.pipePath.join("config.json")
         self.moduleListPath = self.pipePath.join("ProcessingModuleList.yml")
         self.logDBPath = self.pipePath.join("logDB.db")
+        self.logSpoolPath = Path([self.pipePath, "logSpool"], isDirectory=True, create=True)
+        self.taskOutputPath = Path([self.pipePath, "taskOutputs"], isDirectory=True)
+        self.bidsManifestPath = self.pipePath.join("bidsManifest.json")
+        self.shellVisCachePath = Path([self.qcPath, "dwiShellVisCache"], isDirectory=True)
 
         #Set and read in attributes universal to all Pathcollections
         PathCollection.configPath = self.configPath
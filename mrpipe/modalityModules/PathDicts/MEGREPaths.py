@@ -7,6 +7,7 @@ from mrpipe.modalityModules.PathDicts.BasePaths import PathBase
 from mrpipe.meta.PathClass import Path
 from mrpipe.meta.PathClass import StatsFilePath
 from mrpipe.meta.PathCollection import PathCollection
+from mrpipe.meta import Interaction
 from mrpipe.meta.ImageSeries import MEGRE
 
 logger = LoggerModule.Logger()
@@ -103,8 +104,8 @@ class PathDictMEGRE(PathCollection):
             self.basename = self.basedir.join(basenameWithoutPath)
             self.phase4D = Path(self.basename + "_phase4D.nii.gz")
             self.magnitude4d = Path(self.basename + "_mag4D.nii.gz")
-            self.phase4DScaled0p65 = Path(self.basename + "_phase4D_ScaledMax0p65.nii.gz")
-            self.magnitude4dScaled0p65 = Path(self.basename + "_mag4D_ScaledMax0p65.nii.gz")
+            self.phase4DScaled0p65 = Path(self.basename + "_phase4D_ScaledMax0p65.nii.gz").setCleanup()
+            self.magnitude4dScaled0p65 = Path(self.basename + "_mag4D_ScaledMax0p65.nii.gz").setCleanup()
             self.magnitudeE1Scaled0p65 = Path(self.basename + "_mag_e1_ScaledMax0p65.nii.gz")
 
             self.chiSepDir = self.basedir.join("ChiSeperation", isDirectory=True)
@@ -378,6 +379,7 @@ class PathDictMEGRE(PathCollection):
                 logger.process(f'Got MEGRE Echo number from config: {confEchoNumber}')
                 self.setEchoNumber(confEchoNumber)
             else:
+                Interaction.requireInteraction("MEGRE echo number")
                 while True:
                     try:
                         print(f"Please specify the number of Echoes:")
@@ -399,6 +401,7 @@ class PathDictMEGRE(PathCollection):
                 logger.process(f'Got MEGRE Echo Timings from config: {confEchoTimings}')
                 self.setEchoTimings(confEchoTimings)
             else:
+                Interaction.requireInteraction("MEGRE echo timings")
                 while True:
                     try:
                         print(f"Please specify the Echo Timings seperated by spaces in seconds\n"
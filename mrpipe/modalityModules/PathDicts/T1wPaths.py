@@ -41,7 +41,7 @@ class PathDictT1w(PathCollection):
             super().__init__(name="T1w_bidsProcessed")
             self.basedir = Path(os.path.join(basepaths.bidsProcessedPath, filler), isDirectory=True)
             self.basename = self.basedir.join(nameFormatter.format(subj=sub, ses=ses, basename=basename))
-            self.T1w = t1w.copy(self.basename + ".nii.gz")
+            self.T1w = self.basename + ".nii.gz" # materialized from the raw image by T1w_base_materializeT1w, not copied during configuration
             self.json = Path(self.basename + ".json")
             self.recentered = self.basename + "_recentered.nii.gz"
             self.N4BiasCorrected = self.basename + "_N4.nii.gz"
@@ -168,7 +168,7 @@ class PathDictT1w(PathCollection):
                 self.cat12Basename = self.cat12Dir.join(nameFormatter.format(subj=sub, ses=ses, basename=basename), isDirectory=False)
                 self.cat12Script = self.cat12Dir.join("cat12script.m", isDirectory=False)
                 self.cat12ScriptWrapper = self.cat12Dir.join("cat12scriptWrapper.sh", isDirectory=False)
-                self.cat12BaseImage = t1wImage.copy(self.cat12Dir.join(t1wImage.get_filename(), onlyPathStr=True), unzip=False) #TODO fix this so that it does not zip/unzip files on every run.
+                self.cat12BaseImage = self.cat12Dir.join(t1wImage.get_filename()) # materialized from the raw image by T1w_base_materializeT1w.
 
                 #TODO: Next Steps: fix more cat12 output files and add further processing of cat12 masks and volumetric atlasses.
 
@@ -31,6 +31,7 @@ from mrpipe.Toolboxes.standalone.CAT12_WarpToTemplate import CAT12_WarpToTemplat
 from mrpipe.Toolboxes.standalone.CAT12_WarpToTemplate import ValidCat12Interps
 from mrpipe.Toolboxes.standalone.ReduceToLargestCC import ReduceToLargestCC
 from mrpipe.Toolboxes.standalone.CCByMaskCharacterization import CCByMaskCharacterization
+from mrpipe.Toolboxes.standalone.MaterializeInput import MaterializeInput
 
 
 class T1w_base(ProcessingModule):
@@ -53,6 +54,17 @@ class T1w_base(ProcessingModule):
         #               self.sessions]),
         #                                env=self.envs.envMRPipe)
 
+        # Step 0: Make the raw T1w image available in the derivatives tree, linked instead of copied where possible.
+        self.materializeT1w = PipeJobPartial(name="T1w_base_materializeT1w", job=SchedulerPartial(
+            taskList=[MaterializeInput(infile=session.subjectPaths.T1w.bids.T1w.imagePath,
+                                       outfile=outfile,
+                                       mode=self.inputArgs.materializeMode,
+                                       session=session) for session in self.sessions
+                      for outfile in [session.subjectPaths.T1w.bids_processed.T1w,
+                                      session.subjectPaths.T1w.bids_processed.cat12.cat12BaseImage]],
+            cpusPerTask=1, memPerCPU=1, minimumMemPerNode=2),
+                                    env=self.envs.envMRPipe)
+
         # Step 0.1: Run CAT12
         self.cat12 = PipeJobPartial(name="T1w_base_cat12", job=SchedulerPartial(
             taskList=[CAT12(t1w=session.subjectPaths.T1w.bids_processed.cat12.cat12BaseImage,
@@ -1,4 +1,5 @@
 import os
+import shlex
 
 from pandas.io.formats.console import in_ipython_frontend
 
@@ -39,9 +40,25 @@ class Script:
                     logger.error(f"Could not add job to script, unknown type (not str or [str]): {type(el)}")
                 logger.info(el)
                 if timed:
-                    el = f"{os.path.join(Helper.get_libpath(), 'meta', 'timed.sh')} {el}"
+                    el = Script.timedCommand(el)
                 self.jobLines.append(el)
 
+    @staticmethod
+    def timedCommand(command: str, record: str = None, interval: float = None, spool: str = None, labels: dict = None) -> str:
+        # wraps the command with the resource sampler, which prints a summary and optionally writes a json record
+        # and / or spools the record together with the output of the command for the log collector
+        sampler = os.path.join(Helper.get_libpath(), 'meta', 'ResourceSampler.py')
+        options = ""
+        if interval:
+            options += f" -i {interval}"
+        if record:
+            options += f" -o {record}"
+        if spool:
+            options += f" -s {spool}"
+        for key, value in (labels or {}).items():
+            options += f" -l {shlex.quote(f'{key}={value}')}"
+        return f"python {sampler}{options} -- {command}"
+
     def addSetup(self, setupLines, add=False, mode=List.append, **kwargs):
         if self.setupLines and not add:
             logger.error(f"Could not add setup lines to script, setup lines already set:\n{self.setupLines}")
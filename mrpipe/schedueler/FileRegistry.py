@@ -0,0 +1,113 @@
+import os
+import json
+from mrpipe.meta import LoggerModule
+from mrpipe.Helper import Helper
+
+logger = LoggerModule.Logger()
+
+
+class FileRegistry:
+    """
+    Maps every file of the pipeline to the tasks writing (producers) and reading (consumers) it. Built once from the job
+    list during configure, after which dependency, recompute and cleanup questions are dictionary lookups instead of
+    scans over all jobs. Paths hash by value, so the .nii and .nii.gz variant of a file share one entry.
+
+    Every file must have exactly one producer. Tasks which only convert a file into another representation (see
+    Task.isConversion, e.g. the compression job) are registered as additional producers without being a conflict.
+    """
+
+    fileName = "fileRegistry.json"
+
+    def __init__(self):
+        self._producers = {}  # Path -> [(PipeJob, Task)]
+        self._consumers = {}  # Path -> [(PipeJob, Task)]
+        self.duplicates = {}  # Path -> [(PipeJob, Task)], all non converting producers of files written more than once
+
+    @classmethod
+    def fromJobs(cls, jobList):
+        registry = cls()
+        for job in jobList:
+            for task in job.job.taskList:
+                registry.registerTask(job, task)
+        registry.reportDuplicates()
+        return registry
+
+    def registerTask(self, job, task):
+        for outFile in Helper.ensure_list(task.outFiles, flatten=True):
+            if outFile is None:
+                continue
+            producers = self._producers.setdefault(outFile, [])
+            if not task.isConversion:
+                previous = [entry for entry in producers if not entry[1].isConversion]
+                if previous:
+                    self.duplicates.setdefault(outFile, previous).append((job, task))
+            producers.append((job, task))
+        for inFile in Helper.ensure_list(task.inFiles, flatten=True):
+            if inFile is None:
+                continue
+            self._consumers.setdefault(inFile, []).append((job, task))
+
+    def reportDuplicates(self):
+        for path, producers in self.duplicates.items():
+            tasks = ", ".join(f"{job.name}/{task.name} ({task.subjectName}, {task.sessionName})" for job, task in producers)
+            logger.error(f"Configuration error: {path} is written by more than one task: {tasks}")
+        if self.duplicates:
+            logger.error(f"{len(self.duplicates)} files are written by more than one task. Processing modules must declare unique output files, the pipeline may overwrite results or run jobs in the wrong order.")
+
+    def producers(self, path):
+        return self._producers.get(path, [])
+
+    def consumers(self, path):
+        return self._consumers.get(path, [])
+
+    def producingJobs(self, paths, exclude=None):
+        # unique jobs writing any of the given paths, in order of first occurrence
+        jobs = {}
+        for path in paths:
+            for job, task in self._producers.get(path, []):
+                if job is not exclude:
+                    jobs[id(job)] = job
+        return list(jobs.values())
+
+    def hasPendingProducer(self, path, exclude=None):
+        # True if a task of another job writes the file and is scheduled to run, i.e. the file will be (re)written.
+        # Conversions only order the jobs: their outfile is missing until they ran, but its content does not change.
+        return any(job is not exclude and not task.isConversion and task.shouldRun()
+                   for job, task in self._producers.get(path, []))
+
+    def __len__(self):
+        return len(self._producers)
+
+    def save(self, path):
+        # tasks are written once and referenced by their index from the producers and consumers of each file.
+        # intermediate lists the files marked for cleanup, which the garbage collector may remove.
+        taskIds = {}
+        tasks = []
+
+        def taskId(job, task):
+            if id(task) not in taskIds:
+                taskIds[id(task)] = len(tasks)
+                tasks.append({"job": str(job.job.jobDir), "name": task.name, "subject": task.subjectName,
+                              "session": task.sessionName, "conversion": task.isConversion,
+                              "outFiles": [str(f) for f in Helper.ensure_list(task.outFiles, flatten=True) if f is not None]})
+            return taskIds[id(task)]
+
+        registry = {"tasks": tasks,
+                    "producers": {str(p): [taskId(*e) for e in entries] for p, entries in self._producers.items()},
+                    "consumers": {str(p): [taskId(*e) for e in entries] for p, entries in self._consumers.items()},
+                    "intermediate": [str(p) for p in self._producers if p.cleanup]}
+        tmpPath = str(path) + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(registry, f)
+        os.replace(tmpPath, str(path))
+        logger.info(f"Wrote file registry with {len(self._producers)} outputs to {path}")
+
+    @staticmethod
+    def loadSaved(path):
+        # the registry as written by save(), for tools which run without configuring the pipe (e.g. gc mode)
+        try:
+            with open(str(path), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.logExceptionError(f"Could not read file registry {path}. Run mrpipe config first.", e)
+            return None
@@ -12,6 +12,7 @@ from mrpipe.schedueler import PipeJob
 from typing import List
 from typing import Dict
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.PathCollection import PathCollection
 from mrpipe.modalityModules.PathDicts.BasePaths import PathBase
 from enum import Enum
 from mrpipe.meta.Subject import Subject
@@ -19,8 +20,8 @@ from mrpipe.meta.Session import Session
 from mrpipe.modalityModules.Modalities import Modalities
 from mrpipe.modalityModules.ModuleList import ProcessingModuleConfig
 from mrpipe.schedueler.Scheduler import ProcessStatus, Scheduler
+from mrpipe.schedueler.FileRegistry import FileRegistry
 from collections import Counter
-from itertools import combinations
 import pandas as pd
 from tabulate import tabulate
 import matplotlib.pyplot as plt
@@ -29,12 +30,10 @@ from mrpipe.Helper import Helper
 from matplotlib.colors import ListedColormap
 import matplotlib.patches as mpatches
 from mrpipe.modalityModules.PathDicts.LibPaths import LibPaths
-import dagviz
-from dagviz.render import render
-from dagviz.style.metro import svg_renderer, StyleConfig
 from mrpipe.modalityModules.PathDicts.Templates import Templates
 import glob
 import shutil
+from time import sleep
 from tqdm import tqdm
 import io
 import contextlib
@@ -42,10 +41,31 @@ from mrpipe.meta.ImageWithSideCar import ImageWithSideCar
 from mrpipe.meta.ImageSeries import MEGRE as MEGRESeries
 from mrpipe.meta.ImageSeries import DWI as DWISeries
 from mrpipe.meta.LogToDB import LogToDB
+from mrpipe.meta.LogCollector import LogCollector
+from mrpipe.meta.LogQuery import LogQuery
+from mrpipe.meta.TraceExport import TraceExporter
+from mrpipe.meta.EfficiencyReport import EfficiencyReport
+from mrpipe.meta.MetricsExporter import MetricsExporter
+from mrpipe.meta.ScanInventory import ScanInventory, SidecarFields, HeaderFields
+from mrpipe.meta.Profiler import Profiler
+from mrpipe.meta.DirectoryCache import DirectoryCache
+from mrpipe.meta.SidecarCache import SidecarCache
+from mrpipe.meta.ModalityAvailability import ModalityAvailability
+from mrpipe.meta.DagRenderer import DagRenderer
+from mrpipe.meta.BidsCrawler import BidsCrawler
+from mrpipe.meta import Interaction
+from concurrent.futures import ThreadPoolExecutor
+from mrpipe.meta.CompressionManager import CompressionManager
+from mrpipe.meta.PatternIdentifier import PatternIdentifier
+from mrpipe.meta.GarbageCollector import GarbageCollector
+from mrpipe.Toolboxes.Task import TaskStatus
+from mrpipe.Toolboxes.standalone.ConvertCompression import ConvertCompression
+from mrpipe.Toolboxes.envs.Envs import Envs
 # import pm4py
 
 
 logger = LoggerModule.Logger()
+profiler = Profiler()
 
 
 class PipeStatus(Enum):
@@ -71,11 +91,27 @@ class Pipe:
         self.subjects: List[Subject] = []
         self.pathBase: PathBase = None
         self.modalitySet = {}
+        self.modalityAvailability = None
         self.jobList: List[PipeJob.PipeJob] = []
         self.processingModules: List[ProcessingModule] = []
         self.libPaths: LibPaths = None
         self.templates: Templates = Templates()
         self.logDB: LogToDB = None
+        self.bidsCrawler: BidsCrawler = None
+        self.fileRegistry: FileRegistry = None
+        DirectoryCache().configure(enabled=not getattr(self.args, 'noFsCache', False),
+                                   revalidateSeconds=getattr(self.args, 'fsCacheSeconds', None))
+        if getattr(self.args, 'profile', False) or getattr(self.args, 'profileCProfile', False):
+            profiler.enable(cprofile=getattr(self.args, 'profileCProfile', False))
+        CompressionManager().configure(finalPolicy=getattr(self.args, 'compressionPolicy', None),
+                                       intermediatePolicy=getattr(self.args, 'compressionPolicyIntermediate', None))
+        PatternIdentifier().configure(strategy=getattr(self.args, 'identifyStrategy', None))
+        self.stageSettings = None
+        if getattr(self.args, 'stageIO', False):
+            self.stageSettings = {"root": self.args.stageRoot}
+        self.gcSettings = None
+        if getattr(self.args, 'gcDuringRun', False):
+            self.gcSettings = {"action": self.args.gcAction, "archiveRoot": self.args.gcArchiveRoot}
 
     def createPipeJob(self):
         pass
@@ -91,6 +127,9 @@ class Pipe:
                         sys.exit(1)
                 logger.info(f"Appending Job to Pipe: {el.name}")
                 logger.debug(f"{el}")
+                el.gcSettings = self.gcSettings
+                el.job.stageSettings = self.stageSettings
+                el.job.sampleInterval = getattr(self.args, 'sampleInterval', None)
                 self.jobList.append(el)
                 asyncio.run(el.pickleCallback())
             else:
@@ -102,62 +141,85 @@ class Pipe:
         if self.args.scratch is None:
             self.args.scratch = str(Path(os.path.abspath(os.path.join(self.args.input, os.pardir))).join("scratch"))
 
-        self.pathBase = PathBase(self.args.input, self.args.scratch)
-        self.pathBase.pipePath.create()
+        with profiler.phase("PathBase"):
+            self.pathBase = PathBase(self.args.input, self.args.scratch)
+            self.pathBase.pipePath.create()
+            GarbageCollector().load(self.pathBase.pipePath)
         # set pipeName
         if self.args.name is None:
             self.args.name = os.path.basename(self.pathBase.basePath)
         logger.info("Pipe Name: " + self.args.name)
 
         logger.info(f"Setting up sqlite database logging to {self.pathBase.logDBPath}")
-        self.logDB = LogToDB(self.pathBase.logDBPath)
+        with profiler.phase("LogToDB"):
+            self.logDB = LogToDB(self.pathBase.logDBPath)
 
         # remove old files
-        self.cleanup()
+        with profiler.phase("cleanup"):
+            self.cleanup()
 
         if reconfigure and not self.pathBase.libPathFile.exists():
             logger.critical("It seems like you never run mrpipe config yet. Please run mrpipe config first before you run process.")
 
         #write/read LibPaths:
-        if self.pathBase.libPathFile.exists():
-            self.libPaths = LibPaths.from_yaml(self.pathBase.libPathFile)
-            self.libPaths.to_yaml(self.pathBase.libPathFile) #write again in case of any LibPath changes which were added, so that they are added to the file.
-        else:
-            self.libPaths = LibPaths()
-            self.libPaths.to_yaml(self.pathBase.libPathFile)
+        with profiler.phase("LibPaths"):
+            if self.pathBase.libPathFile.exists():
+                self.libPaths = LibPaths.from_yaml(self.pathBase.libPathFile)
+                self.libPaths.to_yaml(self.pathBase.libPathFile) #write again in case of any LibPath changes which were added, so that they are added to the file.
+            else:
+                self.libPaths = LibPaths()
+                self.libPaths.to_yaml(self.pathBase.libPathFile)
         logger.process("Library Paths: \n" + str(self.libPaths))
 
-        self.identifySubjects()
-        self.identifySessions()
-        if reconfigure:
-            self.identifyModalities()
-            self.writeModalitySetToFile()
-        else:
-            self.readModalitySetFromFile()
-            self.writeModalitySetToFile()
+        with profiler.phase("crawlBids"):
+            self.crawlBids()
+        with profiler.phase("identifySubjects"):
+            self.identifySubjects()
+        with profiler.phase("identifySessions"):
+            self.identifySessions()
+        with profiler.phase("identifyModalities"):
+            if reconfigure:
+                self.identifyModalities()
+                self.writeModalitySetToFile()
+            else:
+                self.readModalitySetFromFile()
+                self.writeModalitySetToFile()
 
         logger.process("Configuring subject Paths: \n" + str(self.libPaths))
-        for subject in tqdm(self.subjects):
-            subject.configurePaths(basePaths=self.pathBase)
-        self.cleanModalitiesAfterPathConfiguration()
-        self.loadProcessingModules()
-        self.appendProcessingModules()
-        self.setupProcessingModules()
-
-        self.summarizeSubjects()
+        with profiler.phase("configurePaths"):
+            self.configureSubjectPaths()
+            PathCollection.flushRegistry()  # checkpoint: keeps patterns confirmed by the user even if a later step fails
+        with profiler.phase("cleanModalities"):
+            self.cleanModalitiesAfterPathConfiguration()
+        with profiler.phase("loadProcessingModules"):
+            self.loadProcessingModules()
+            self.appendProcessingModules()
+        with profiler.phase("setupProcessingModules"):
+            self.setupProcessingModules()
+        with profiler.phase("scheduleCompression"):
+            self.scheduleCompression()
+
+        with profiler.phase("summarizeSubjects"):
+            self.summarizeSubjects()
         if self.args.writeSubjectPaths:
-            self.writeSubjectPaths()
-        self.determineDependencies()  #must be before filtering to determine dependency reruns
-        self.topological_sort()  # also this
+            with profiler.phase("writeSubjectPaths"):
+                self.writeSubjectPaths()
+        with profiler.phase("determineDependencies"):
+            self.determineDependencies()  #must be before filtering to determine dependency reruns
+        with profiler.phase("topological_sort"):
+            self.topological_sort()  # also this
         if filterJobs:
-            self.filterPrecomputedJobs()
+            with profiler.phase("filterPrecomputedJobs"):
+                self.filterPrecomputedJobs()
 
-        self.visualize_dag2()
+        with profiler.phase("visualize_dag2"):
+            self.visualize_dag2()
         #self.visualize_dag3()
 
         # Export per-modality scan inventory CSVs before running the pipe
         if not getattr(self.args, 'noScanInventory', False):
-            self.export_scan_inventory()
+            with profiler.phase("export_scan_inventory"):
+                self.export_scan_inventory()
             # try:
             #     self.export_scan_inventory()
             # except Exception as e:
@@ -165,6 +227,15 @@ class Pipe:
         else:
             logger.process("Skipping scan inventory export (disabled by --noScanInventory)")
 
+        with profiler.phase("recordJobStates"):
+            self.recordJobStates()
+
+        PathCollection.flushRegistry()
+        PatternIdentifier().writeReport(self.pathBase.pipePath.join("identificationReport.json"))
+        SidecarCache().logStats()
+        profiler.writeReport(self.pathBase.pipePath.join("profile"))
+        profiler.disable()  # restores the os functions, process and step mode run uninstrumented
+
     def run(self):
         #TODO Somehow logs dir is required before made
         if self.args.scratch is None:
@@ -206,26 +277,157 @@ class Pipe:
         logger.process("Searching for precomputed jobs.")
         for job in self.jobList:
             job.filterPrecomputedTasks()
+        self.reviveCollectedInputs()
         for job in tqdm(self.jobList): #needs to first check which tasks are precomputed and only after that can determine which jobs to rerun.
-            job.setRecomputeDependencies()
+            job.setRecomputeDependencies(self.fileRegistry)
+        self.dropSupersededConversions()
+
+    def dropSupersededConversions(self):
+        # A conversion of a file whose producer runs again would replace the fresh output with the stale other variant.
+        # Such conversions are dropped. Otherwise the conversion job depends on the producer's job (source and target of
+        # a conversion share one registry entry), so it never runs before the producer.
+        changedJobs = {}
+        for job in self.jobList:
+            for task in list(job.job.taskList):
+                if task.isConversion and self.fileRegistry.hasPendingProducer(task.outfile, exclude=job):
+                    logger.info(f"{job.name}: not converting {task.infile}, because {task.outfile} is written again by its producer.")
+                    job.job.taskList.remove(task)
+                    changedJobs[id(job)] = job
+        for job in changedJobs.values():
+            asyncio.run(job.pickleCallback())
+
+    def reviveCollectedInputs(self):
+        # Tasks which have to run but read intermediate files removed by the garbage collector need these files again:
+        # their producers are recomputed (recursively, as their inputs may have been collected as well).
+        gc = GarbageCollector()
+        if not gc.ledger:
+            return
+        pending = [(job, task) for job in self.jobList for task in job.job.taskList if task.getState() is not TaskStatus.isPreComputed]
+        revived = {}
+        changedJobs = {}
+        while pending:
+            job, task = pending.pop()
+            for file in task.inFiles:
+                if not gc.isCollected(file) or file.exists(transform=False, acceptCache=False):
+                    continue
+                for producerJob, producerTask in self.fileRegistry.producers(file):
+                    if id(producerTask) in revived or producerTask.getState() is not TaskStatus.isPreComputed:
+                        continue
+                    logger.info(f"{producerJob.name}: recomputing {producerTask.name} ({producerTask.subjectName}, {producerTask.sessionName}), because {file} was removed by the garbage collector and is needed by {job.name}")
+                    producerTask.setStateRecompute()
+                    producerTask.clobber = True
+                    producerTask.cleanOutFiles()
+                    producerJob.job.setNotStarted(skipPickle=True)
+                    revived[id(producerTask)] = producerTask
+                    changedJobs[id(producerJob)] = producerJob
+                    pending.append((producerJob, producerTask))
+        for job in changedJobs.values():
+            asyncio.run(job.pickleCallback())
+        if revived:
+            logger.process(f"Recomputing {len(revived)} tasks, because their outputs were removed by the garbage collector but are needed again.")
+
+    def collectGarbage(self):
+        # gc mode: collect intermediate files of a configured pipe without configuring it again
+        if self.args.scratch is None:
+            self.args.scratch = str(Path(os.path.abspath(os.path.join(self.args.input, os.pardir))).join("scratch"))
+        self.pathBase = PathBase(self.args.input, self.args.scratch)
+        registry = FileRegistry.loadSaved(self.pathBase.pipePath.join(FileRegistry.fileName))
+        if registry is None:
+            return
+        GarbageCollector().load(self.pathBase.pipePath)
+        GarbageCollector().collect(registry, jobDone=PipeJob.isJobDone, action=self.args.gcAction,
+                                   archiveRoot=self.args.gcArchiveRoot)
+
+    def recordJobStates(self):
+        # the states of all jobs in one transaction, later changes are spooled by the jobs (PipeJob.spoolState)
+        try:
+            self.logDB.setJobStates([job.stateRecord() for job in self.jobList], replace=True)
+        except Exception as e:
+            logger.logExceptionError("Could not record the job states in the log database.", e)
+
+    def collectLogs(self):
+        # collect mode: move the spooled task run records into the log database, e.g. from a cron job or after a run
+        if self.args.scratch is None:
+            self.args.scratch = str(Path(os.path.abspath(os.path.join(self.args.input, os.pardir))).join("scratch"))
+        self.pathBase = PathBase(self.args.input, self.args.scratch)
+        collected = LogCollector(self.pathBase.logSpoolPath, self.pathBase.logDBPath, self.pathBase.taskOutputPath).collect()
+        logger.process(f"{collected} task run records collected.")
+
+    def stats(self):
+        # stats mode: runtime, memory and failure rate of the task runs in the log database
+        self.collectLogs()
+        query = LogQuery(self.pathBase.logDBPath)
+        filters = {"taskClass": self.args.statsTaskClass, "module": self.args.statsModule, "since": self.args.statsSince,
+                   "lastSubjects": self.args.statsLastSubjects}
+        stats = query.aggregate(by=self.args.statsBy, **filters)
+        if stats.empty:
+            logger.process("No task runs in the log database match the selection.")
+            return
+        logger.process("Task runs per " + self.args.statsBy + ":\n" +
+                       tabulate(LogQuery.formatted(stats), headers="keys", showindex=True))
+        if self.args.statsSince:
+            growth = query.memoryGrowth(since=self.args.statsSince, by=self.args.statsBy,
+                                        **{k: v for k, v in filters.items() if k != "since"})
+            if not growth.empty:
+                logger.process(f"Peak memory since {self.args.statsSince} compared to before:\n" +
+                               tabulate(LogQuery.formatted(growth), headers="keys", showindex=True))
+        if self.args.statsCSV:
+            stats.to_csv(self.args.statsCSV)
+            logger.process(f"Wrote task run statistics to {self.args.statsCSV}")
+
+    def efficiency(self):
+        # efficiency mode: requested versus used cores and memory per processing module and task class
+        self.collectLogs()
+        report = EfficiencyReport(LogQuery(self.pathBase.logDBPath), taskClass=self.args.statsTaskClass,
+                                  module=self.args.statsModule, since=self.args.statsSince,
+                                  lastSubjects=self.args.statsLastSubjects)
+        report.log()
+        report.writeHTML(self.args.efficiencyOut or str(self.pathBase.pipePath.join("efficiencyReport.html")))
+        if self.args.statsCSV:
+            report.table.to_csv(self.args.statsCSV)
+            logger.process(f"Wrote resource efficiency table to {self.args.statsCSV}")
+
+    def metrics(self):
+        # metrics mode: writes Prometheus metrics of the pipe once or every --metricsInterval seconds
+        self.collectLogs()
+        LogToDB(self.pathBase.logDBPath)  # creates the tables of a pipe which did not run yet
+        metricsOut = self.args.metricsOut or str(self.pathBase.pipePath.join("mrpipe.prom"))
+        exporter = MetricsExporter(self.pathBase.logDBPath, self.args.name or os.path.basename(self.pathBase.basePath))
+        while True:
+            exporter.write(metricsOut)
+            if not self.args.metricsInterval:
+                logger.process(f"Wrote pipeline metrics to {metricsOut}")
+                return
+            sleep(self.args.metricsInterval)
+            LogCollector(self.pathBase.logSpoolPath, self.pathBase.logDBPath, self.pathBase.taskOutputPath).collect()
+
+    def trace(self):
+        # trace mode: timeline of the task runs and Slurm jobs as Chrome trace event json
+        self.collectLogs()
+        jobs = []
+        for picklePath in sorted(glob.glob(os.path.join(str(self.pathBase.pipeJobPath), "*", "*", PipeJob.PipeJob.pickleNameStandard))):
+            job = PipeJob.PipeJob.fromPickled(os.path.dirname(picklePath), updateStatus=False)
+            if job is None:
+                continue
+            nextJob = str(job._nextJob) if job._nextJob else None
+            jobs.append({"name": job.name, "module": job.moduleName, "slurmJobId": job.job.SLURM_jobid,
+                         "nextJob": f"{os.path.basename(os.path.dirname(nextJob))}/{os.path.basename(nextJob)}" if nextJob else None})
+        if any(job["slurmJobId"] for job in jobs) and shutil.which("sacct"):
+            times = Scheduler.slurmTimes([job["slurmJobId"] for job in jobs])
+            for job in jobs:
+                job.update(times.get(str(job["slurmJobId"]), {}))
+        runs = LogQuery(self.pathBase.logDBPath).runs()
+        traceOut = self.args.traceOut or str(self.pathBase.pipePath.join("trace.json"))
+        TraceExporter(runs, jobs, rows=self.args.traceRows).write(traceOut)
 
     def determineDependencies(self):
         logger.process("Automatically determining dependencies...")
-        output_to_job = {outpath: job for job in self.jobList for outpath in job.getTaskOutFiles()}
-        # pathsAlreadyDone = []
-        #TODO Fix that it grows with the number of subjects.
+        # every task's input is looked up in the registry of all outputs, so tasks of one job may read from different
+        # jobs (e.g. different processing paths for different subjects).
+        self.fileRegistry = FileRegistry.fromJobs(self.jobList)
         for job in tqdm(self.jobList):
-            # for inpath in job.getTaskInFiles():
-            #     # pathName = inpath.get_varname()
-            #     # if pathName in pathsAlreadyDone:
-            #     #     continue
-            #     if inpath in output_to_job.keys() and job is not output_to_job[inpath]:
-            #         job.setDependencies(output_to_job[inpath])
-            #         # pathsAlreadyDone.append(pathName)
-            #TODO: Comes with the condition that the dependencies must be the same for every pipejob, as only the first job is take to determine dependencies, which might cause errors if there is different processing paths for different subjects (not for now i think)
-            for inpath in job.getFirstTaskInFiles():
-                if inpath in output_to_job.keys() and job is not output_to_job[inpath]:
-                    job.setDependencies(output_to_job[inpath])
+            job.setDependencies(self.fileRegistry.producingJobs(job.getTaskInFiles(), exclude=job))
+        self.fileRegistry.save(self.pathBase.pipePath.join(FileRegistry.fileName))
 
 
     def cleanup(self, deep=False):
@@ -258,9 +460,23 @@ class Pipe:
                 lastValidJob = i
         logger.process(f"Removed {countRemoved} jobs from pipeline, {len(self.jobList) - countRemoved} jobs remaining.")
 
+    def crawlBids(self):
+        logger.process(f"Crawling BIDS directory: {self.pathBase.bidsPath}")
+
+        def includeSubject(name):
+            return bool(re.match(self.args.subjectDescriptor, name)) and \
+                (self.args.select_subjects is None or bool(re.match(self.args.select_subjects, name)))
+
+        self.bidsCrawler = BidsCrawler(self.pathBase.bidsPath, self.pathBase.bidsManifestPath,
+                                       threads=getattr(self.args, 'crawlerThreads', 16),
+                                       includeTopLevel=includeSubject,
+                                       rescan=getattr(self.args, 'fullRescan', False),
+                                       storeSidecars=not getattr(self.args, 'noSidecarsInManifest', False))
+        self.bidsCrawler.crawl()
+
     def identifySubjects(self):
         logger.process("Identifying Subjects.")
-        potential = os.listdir(self.pathBase.bidsPath)
+        potential = DirectoryCache().listdir(self.pathBase.bidsPath)
         for path in potential:
             if re.match(self.args.subjectDescriptor, path):
                 if self.args.select_subjects is None or re.match(self.args.select_subjects, os.path.basename(path)):
@@ -278,7 +494,7 @@ class Pipe:
             logger.critical("Session matching not implemented yet, exiting.")
             sys.exit(1)
         for subject in self.subjects:
-            potential = os.listdir(subject.path)
+            potential = DirectoryCache().listdir(subject.path)
             for path in potential:
                 logger.debug(path)
                 if re.match(self.args.sessionDescriptor, path):
@@ -317,19 +533,16 @@ class Pipe:
         # Summary table for the amount of available sessions
         session_summary = Counter([len(subject.sessions) for subject in self.subjects])
 
-        # Summary table for the amount of available modality combinations
-        modality_summary = Counter()
+        # One modality bit mask per session, counted per modality combination
+        self.modalityAvailability = ModalityAvailability(Modalities().modalityNames())
         for subject in self.subjects:
             for session in subject.sessions:
-                modalities = session.modalities.available_modalities()
-                for r in range(1, len(modalities) + 1):
-                    for subset in combinations(modalities, r):
-                        modality_summary[subset] += 1
-
-        modality_summary = {", ".join(k): v for k, v in modality_summary.items()}
+                self.modalityAvailability.add(subject.id, session.name, session.modalities.available_modalities())
+        modality_summary = self.modalityAvailability.patternTable()
 
         self.summarizeSubjectsToCsv(session_summary, modality_summary)
         self.summarizeSubjectsToAscii(session_summary, modality_summary)
+        self.modalityAvailability.writeMatrix(self.pathBase.pipePath.join("modality_availability.csv"))
         #self.summarizeSubjectsToImage() #was causing issues when there are a lot of subjects&sessions: ValueError: Image size of 640x252940 pixels is too large. It must be less than 2^16 in each direction.
 
     def writeSubjectPaths(self):
@@ -341,16 +554,14 @@ class Pipe:
     def summarizeSubjectsToCsv(self, session_summary, modality_summary):
         # Convert the Counter objects to pandas DataFrames
         session_df = pd.DataFrame.from_dict(session_summary, orient='index', columns=['Count'])
-        modality_df = pd.DataFrame.from_dict(modality_summary, orient='index', columns=['Count'])
 
         # Write the DataFrames to CSV files
         session_df.to_csv(self.pathBase.pipePath.join("session_summary.csv"), mode='w')
-        modality_df.to_csv(self.pathBase.pipePath.join("modality_summary.csv"), mode='w')
+        modality_summary.to_csv(self.pathBase.pipePath.join("modality_summary.csv"), mode='w')
 
     def summarizeSubjectsToAscii(self, session_summary, modality_summary):
         # Convert the Counter objects to lists of tuples and sort them
         session_summary = sorted(session_summary.items())
-        modality_summary = sorted(modality_summary.items(), key=lambda x: (-x[1], x[0]))
 
         # Print the session summary as an ASCII table
         logger.process("Session Summary:")
@@ -359,7 +570,7 @@ class Pipe:
         # Print the modality summary as an ASCII table
         logger.process("Modality overview saved to {}".format(self.pathBase.pipePath))
         logger.info("Modality Summary:")
-        logger.info(tabulate(modality_summary, headers=['Modalities', 'Count']))
+        logger.info(tabulate(modality_summary, headers=['Modalities', 'Count (exactly)', 'Count (at least)']))
 
     def summarizeSubjectsToImage(self):
         # Assuming subjects is a list of custom class instances
@@ -423,12 +634,46 @@ class Pipe:
 
     def setupProcessingModules(self):
         logger.process("Setting up Processing Modules.")
+        setupModules = []
         for module in tqdm(self.processingModules):
-            isSetup = module.safeSetup(self.processingModules)
+            with profiler.phase(module.moduleName, group="moduleSetup"):
+                isSetup = module.safeSetup(self.processingModules)
             if isSetup:
-                self.appendJob(module.pipeJobs)
-                # logger.info("Creating missing entries in database for unprocessed jobs.")
-                # self.logDB.create_entry_unprocessed(module=module) #TODO: NOT DONE YET
+                with profiler.phase(module.moduleName, group="modulePickle"):
+                    self.appendJob(module.pipeJobs)
+                setupModules.append(module)
+        logger.info("Creating missing entries in database for unprocessed jobs.")
+        with profiler.phase("logDBEntries"):
+            self.logDB.create_entries_unprocessed(setupModules)  # one transaction for all modules
+
+    def scheduleCompression(self):
+        # Files found in the other compression variant than declared are converted by a job of their own, on which the
+        # jobs reading these files depend. Files outside of any session directory are converted right away, in parallel.
+        requests = CompressionManager().getRequests()
+        if not requests:
+            return
+        processedPath = os.path.abspath(str(self.pathBase.bidsProcessedPath))
+        sessions = {(subject.id, session.name): session for subject in self.subjects for session in subject.sessions if session}
+        cpusPerTask = 2
+        tasks = []
+        unassigned = []
+        for source, target in requests:
+            # <subject>/<session> of the target below the processed directory
+            parts = os.path.relpath(os.path.abspath(str(target)), processedPath).split(os.sep)
+            session = sessions.get(tuple(parts[:2])) if len(parts) > 2 and parts[0] != os.pardir else None
+            if session is None:
+                unassigned.append((source, target))
+                continue
+            tasks.append(ConvertCompression(infile=Path(source), outfile=target, session=session, nthreads=cpusPerTask))
+        logger.process(f"Scheduling {len(tasks)} compression conversions as job, converting {len(unassigned)} files outside of session directories now.")
+        if unassigned:
+            CompressionManager().convertLocal(unassigned, threads=max(1, self.args.ncores))
+        if tasks:
+            job = PipeJob.PipeJob(name="Compression_convert", job=Scheduler(taskList=tasks, cpusPerTask=cpusPerTask, cpusTotal=self.args.ncores,
+                                                                              memPerCPU=1, minimumMemPerNode=2, partition=self.args.partition),
+                                  basepaths=self.pathBase, moduleName="Compression", env=Envs(self.libPaths).envMRPipe)
+            job.setVerbosity(self.args.verbose)
+            self.appendJob(job)
 
     def loadProcessingModules(self):
         if self.pathBase.moduleListPath.exists():
@@ -482,6 +727,48 @@ class Pipe:
             logger.process(f'{key}: {value}')
 
 
+    def configureSubjectPaths(self):
+        threads = getattr(self.args, 'configThreads', 1)
+        if threads <= 1 or len(self.subjects) <= 2:
+            for subject in tqdm(self.subjects):
+                subject.configurePaths(basePaths=self.pathBase)
+            return
+
+        # The first subject is configured on its own, so that file patterns which need confirmation by the user are
+        # established before the workers start. Workers never prompt: subjects which would need user input are deferred.
+        # The first deferred subject is then configured in the main thread (which may establish new patterns) and the
+        # remaining ones are retried in parallel. If retrying does not help twice in a row, the rest runs sequentially.
+        self.subjects[0].configurePaths(basePaths=self.pathBase)
+
+        def configureNonInteractive(subject):
+            with Interaction.nonInteractive():
+                try:
+                    subject.configurePaths(basePaths=self.pathBase)
+                    return None
+                except Interaction.InteractionDeferred as e:
+                    logger.info(f"Deferring path configuration of subject {subject.id}: {e.what}")
+                    return subject
+
+        logger.process(f"Configuring subject paths with {threads} threads.")
+        pending = self.subjects[1:]
+        unsuccessfulRounds = 0
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while pending:
+                deferred = [subject for subject in tqdm(pool.map(configureNonInteractive, pending), total=len(pending)) if subject is not None]
+                if not deferred:
+                    break
+                unsuccessfulRounds = unsuccessfulRounds + 1 if len(deferred) == len(pending) else 0
+                for subject in deferred:
+                    subject.resetPaths()
+                if unsuccessfulRounds >= 2:
+                    logger.process(f"Configuring {len(deferred)} subjects which require user input sequentially.")
+                    for subject in deferred:
+                        subject.configurePaths(basePaths=self.pathBase)
+                    break
+                logger.process(f"{len(deferred)} subjects require user input, configuring {deferred[0].id} before retrying the others.")
+                deferred[0].configurePaths(basePaths=self.pathBase)
+                pending = deferred[1:]
+
     def cleanModalitiesAfterPathConfiguration(self):
         logger.process("Cleaning subjects modalities for which no data or only invalid data was found.")
         for subject in self.subjects:
@@ -565,18 +852,25 @@ class Pipe:
         plt.savefig(os.path.join(self.pathBase.pipePath, "DependencyGraph.png"), bbox_inches="tight")
 
     def visualize_dag2(self):
-        logger.process("Creating Pipeline visualisation.")
+        # skipped in batch runs unless requested; renders in a background process and only if the graph changed
+        mode = getattr(self.args, "dagVis", "auto")
+        if mode == "off" or (mode == "auto" and not sys.stdin.isatty()):
+            logger.process(f"Skipping pipeline visualisation (--dagVis {mode}).")
+            return
         job_dict = {job.job.jobDir: job for job in self.jobList}
-        G = nx.DiGraph()
-        for job in self.jobList:
-            G.add_node(job.name, community=job.moduleName)
-            for dependency_id in job.getDependencies():
-                G.add_edge(job_dict[dependency_id].name, job.name)
-
-        r = dagviz.make_abstract_plot(G) #, order=[job.name for job in self.jobList] # lets see, orders in the actual processing order
-        rsvg = render(r, dagviz.style.metro.svg_renderer())
-        with open(self.pathBase.pipePath.join("DependencyGraph2.svg"), "wt") as fs:
-            fs.write(rsvg)
+        renderer = DagRenderer(nodes={job.name: job.moduleName for job in self.jobList},
+                               edges=[(job_dict[dependency_id].name, job.name) for job in self.jobList
+                                      for dependency_id in job.getDependencies()])
+        outName = "DependencyGraph2.svg"
+        if getattr(self.args, "dagCollapse", False):
+            renderer = renderer.collapsed()
+            outName = "DependencyGraph2_modules.svg"
+        outPath = self.pathBase.pipePath.join(outName)
+        if renderer.isCurrent(outPath):
+            logger.process(f"Pipeline visualisation is up to date: {outPath}")
+            return
+        pid = renderer.renderInBackground(outPath, logPath=self.pathBase.pipePath.join(outName + ".log"))
+        logger.process(f"Creating pipeline visualisation of {len(renderer.nodes)} nodes in the background (pid {pid}): {outPath}")
 
     def visualize_dagPM4Py(self):
         job_dict = {job.job.jobDir: job for job in self.jobList}
@@ -1842,105 +2136,16 @@ class Pipe:
         return script_paths
 
     def export_scan_inventory(self):
-        """Create per-modality CSV files listing available scans and metadata.
-        Output directory: <base>/data_bids_statistics/scan_inventory
+        """Create a per-modality inventory of the available scans and their metadata.
+        Output: <base>/meta_QC/scan_inventory/scanInventory.sqlite, one table per modality (and <modality>_scans.csv with --scanInventoryCSV)
         """
         logger.process("Exporting scan inventory (per modality)...")
         # Prepare output directory
         outdir = self.pathBase.qcPath.join("scan_inventory", isDirectory=True)
         outdir.create()
 
-        modality_rows = {}
-
-        # Lazy imports to avoid hard dependency if not needed
-        try:
-            import nibabel as nib  # noqa: F401
-            from nibabel.orientations import aff2axcodes  # noqa: F401
-            nib_available = True
-        except Exception:
-            nib_available = False
-
-        def _nifti_info(image_path):
-            info = {
-                "voxel_size_x": None,
-                "voxel_size_y": None,
-                "voxel_size_z": None,
-                "voxel_size_t": None,
-                "image_size_x": None,
-                "image_size_y": None,
-                "image_size_z": None,
-                "image_size_t": None,
-                "image_size": None,
-                "slope": None,
-                "intercept": None,
-                "data_type": None,
-                "orientation": None,
-                "descrip": None,
-                "aux_file": None,
-            }
-            if not nib_available or image_path is None:
-                return info
-            try:
-                import nibabel as nib
-                from nibabel.orientations import aff2axcodes
-                img = nib.load(str(image_path))
-                hdr = img.header
-                zooms = hdr.get_zooms()
-                image_size = hdr.get_data_shape()
-                if len(zooms) == 3:
-                    info["voxel_size_x"], info["voxel_size_y"], info["voxel_size_z"] = zooms[0], zooms[1], zooms[2]
-                elif len(zooms) == 4:
-                    info["voxel_size_x"], info["voxel_size_y"], info["voxel_size_z"], info["voxel_size_t"] = zooms[0], zooms[1], zooms[2], zooms[3]
-
-                if len(image_size) == 3:
-                    info["image_size_x"], info["image_size_y"], info["image_size_z"] = image_size[0], image_size[1], image_size[2]
-                elif len(image_size) == 4:
-                    info["image_size_x"], info["image_size_y"], info["image_size_z"], info["image_size_t"] = image_size[0], image_size[1], image_size[2], image_size[3]
-                # scl_slope and scl_inter may not always be present; nibabel returns numpy arrays/values
-                try:
-                    info["slope"] = float(hdr.get("scl_slope", 1.0))
-                except Exception:
-                    pass
-                try:
-                    info["intercept"] = float(hdr.get("scl_inter", 0.0))
-                except Exception:
-                    pass
-                try:
-                    info["data_type"] = str(hdr.get_data_dtype())
-                except Exception:
-                    pass
-                try:
-                    info["orientation"] = "".join(list(aff2axcodes(img.affine)))
-                except Exception:
-                    pass
-                # descrip/aux_file are stored as byte arrays
-                try:
-                    d = hdr.get("descrip")
-                    if d is not None:
-                        info["descrip"] = d.tobytes().decode(errors="ignore").strip("\x00") if hasattr(d, "tobytes") else str(d)
-                except Exception:
-                    pass
-                try:
-                    a = hdr.get("aux_file")
-                    if a is not None:
-                        info["aux_file"] = a.tobytes().decode(errors="ignore").strip("\x00") if hasattr(a, "tobytes") else str(a)
-                except Exception:
-                    pass
-            except Exception as e:
-                logger.debug(f"Failed reading NIfTI header for {image_path}: {e}")
-            return info
-
-        # def _json_attrs(iwsc: ImageWithSideCar):
-        #     # Return sidecar JSON dict if available
-        #     try:
-        #         if iwsc is None or iwsc.jsonPath is None:
-        #             return {}
-        #         iwsc.loadAttributesFromJson()
-        #         return iwsc.attributes or {}
-        #     except Exception:
-        #         return {}
-
-        # Iterate over subjects/sessions and collect items
+        # Iterate over subjects/sessions and collect items: (subject, session, modality, series_component, ImageWithSideCar, extra)
+        entries = []
         for subject in tqdm(self.subjects):
             for session in subject.sessions:
                 sp = session.subjectPaths
@@ -1969,6 +2174,7 @@ class Pipe:
                             items.append(("PrincipleDirection", val.image, {
                                 "diffShemeExact": "; ".join([f"{int(k)}x{v}" for k,v in Counter(val.diffShemeExact).items()]),
                                 "diffShemeRounded": "; ".join([f"{int(k)}x{v}" for k,v in Counter(val.diffShemeRounded).items()]),
+                                "protocolFingerprint": val.protocolFingerprint,
                                 "image_encoding_direction": val.image_encoding_direction,
                                 "is_multishell": val.is_multishell,
                                 "is_fullshell": val.is_fullshell,
@@ -1978,11 +2184,11 @@ class Pipe:
                                 "nb0s": val.nb0s,
                                 "totalReadoutTime": val.TotalReadoutTime,
                             }))
-                            val.render_rotation_self(str(sp.dwi.meta_QC.shellVisMp4))
                             if val.image_reverse:
                                 items.append(("ReverseDirection", val.image_reverse, {
                                     "diffShemeExact_reverse": "; ".join([f"{int(k)}x{v}" for k,v in Counter(val.diffShemeExact_reverse).items()]),
                                     "diffShemeRounded_reverse": "; ".join([f"{int(k)}x{v}" for k,v in Counter(val.diffShemeRounded_reverse).items()]),
+                                    "protocolFingerprint_reverse": val.protocolFingerprint_reverse,
                                     "image_encoding_direction_reverse": val.image_encoding_direction_reverse,
                                     "is_fullshell_reverse": val.is_fullshell_reverse,
                                     "contains_b0_reverse": val.contains_b0_reverse,
@@ -1991,63 +2197,48 @@ class Pipe:
                                     "totalReadoutTime_reverse": val.TotalReadoutTime_reverse,
                                 }))
 
-                    if not items:
-                        continue
-
                     for series_component, iwsc, extra in items:
-                        if iwsc is None:
-                            continue
-                        img_path = str(iwsc.imagePath) if iwsc.imagePath is not None else None
-                        json_path = str(iwsc.jsonPath) if iwsc.jsonPath is not None else None
-
-                        header_info = _nifti_info(iwsc.imagePath if hasattr(iwsc, "imagePath") else None)
-                        #json_info = _json_attrs(iwsc)
-
-                        row = {
-                            "subject": subject.id,
-                            "session": session.name,
-                            "modality": modality_name,
-                            "series_component": series_component,
-                            "echo_time": extra.get("EchoTime") if extra else iwsc.getAttribute("EchoTime", suppressWarning=True),
-                            "image_path": img_path,
-                            "json_path": json_path,
-                            # Header fields
-                            **header_info,
-                            # Selected JSON fields (BIDS-compatible)
-                            "MagneticFieldStrength": iwsc.getAttribute("MagneticFieldStrength", suppressWarning=True),
-                            "Manufacturer": iwsc.getAttribute("Manufacturer", suppressWarning=True),
-                            "ManufacturersModelName": iwsc.getAttribute("ManufacturersModelName") or iwsc.getAttribute("ManufacturerModelName", suppressWarning=True),
-                            "DeviceSerialNumber": iwsc.getAttribute("DeviceSerialNumber", suppressWarning=True),
-                            "StationName": iwsc.getAttribute("StationName", suppressWarning=True),
-                            "InstitutionName": iwsc.getAttribute("InstitutionName", suppressWarning=True),
-                            "InstitutionAddress": iwsc.getAttribute("InstitutionAddress", suppressWarning=True) or iwsc.getAttribute("InstitutionalDepartmentName", suppressWarning=True),
-                            "InstitutionalDepartmentName": iwsc.getAttribute("InstitutionalDepartmentName", suppressWarning=True),
-                            "SoftwareVersions": iwsc.getAttribute("SoftwareVersions", suppressWarning=True),
-                            "SequenceName": iwsc.getAttribute("SequenceName", suppressWarning=True),
-                            "SeriesDescription": iwsc.getAttribute("SeriesDescription", suppressWarning=True),
-                            "ProtocolName": iwsc.getAttribute("ProtocolName", suppressWarning=True),
-                            "ScanningSequence": iwsc.getAttribute("ScanningSequence", suppressWarning=True),
-                            "SequenceVariant": iwsc.getAttribute("SequenceVariant", suppressWarning=True),
-                            "ScanOptions": iwsc.getAttribute("ScanOptions", suppressWarning=True),
-                            "ReceiveCoilName": iwsc.getAttribute("ReceiveCoilName", suppressWarning=True),
-                            "CoilString": iwsc.getAttribute("CoilString", suppressWarning=True),
-                            "FlipAngle": iwsc.getAttribute("FlipAngle", suppressWarning=True),
-                            "RepetitionTime": iwsc.getAttribute("RepetitionTime", suppressWarning=True),
-                            "InversionTime": iwsc.getAttribute("InversionTime", suppressWarning=True),
-                            "PhaseEncodingDirection": iwsc.getAttribute("PhaseEncodingDirection", suppressWarning=True),
-                        }
-                        row = row | extra
-                        modality_rows.setdefault(modality_name, []).append(row)
+                        if iwsc is not None:
+                            entries.append((subject, session, modality_name, series_component, iwsc, extra))
+
+        # Headers and sidecars are read in parallel, unchanged files come from the cache
+        inventory = ScanInventory(self.pathBase.pipePath.join("scanInventoryCache.sqlite"), threads=self.args.configThreads)
+        requests = []
+        for _, _, _, _, iwsc, _ in entries:
+            requests.append((iwsc.imagePath, "nifti"))
+            requests.append((iwsc.jsonPath, "sidecar"))
+        infos = inventory.lookup(requests)
+        logger.info(f"Scan inventory: {inventory.hits} files unchanged, {inventory.misses} files read.")
 
-        # Write CSVs per modality
-        for modality, rows in modality_rows.items():
-            try:
-                df = pd.DataFrame(rows)
-                outfile = outdir.join(f"{modality}_scans.csv")
-                df.to_csv(str(outfile), index=False)
-                logger.process(f"Wrote scan inventory for {modality} to {outfile}")
-            except Exception as e:
-                logger.error(f"Failed writing scan inventory for {modality}: {e}")
+        modality_rows = {}
+        for subject, session, modality_name, series_component, iwsc, extra in entries:
+            img_path = str(iwsc.imagePath) if iwsc.imagePath is not None else None
+            json_path = str(iwsc.jsonPath) if iwsc.jsonPath is not None else None
+            header_info = infos.get((img_path, "nifti")) or dict.fromkeys(HeaderFields)
+            sidecar = infos.get((json_path, "sidecar")) or {}
+            row = {
+                "subject": subject.id,
+                "session": session.name,
+                "modality": modality_name,
+                "series_component": series_component,
+                "echo_time": extra.get("EchoTime") if extra else sidecar.get("EchoTime"),
+                "image_path": img_path,
+                "json_path": json_path,
+                # Header fields
+                **header_info,
+                # Selected JSON fields (BIDS-compatible)
+                **{field: sidecar.get(field) for field in SidecarFields if field not in ["EchoTime", "ManufacturerModelName"]},
+                "ManufacturersModelName": sidecar.get("ManufacturersModelName") or sidecar.get("ManufacturerModelName"),
+                "InstitutionAddress": sidecar.get("InstitutionAddress") or sidecar.get("InstitutionalDepartmentName"),
+            }
+            row = row | extra
+            modality_rows.setdefault(modality_name, []).append(row)
+
+        try:
+            ScanInventory.write(modality_rows, outdir.join("scanInventory.sqlite"),
+                                csvDir=str(outdir) if getattr(self.args, "scanInventoryCSV", False) else None)
+        except Exception as e:
+            logger.logExceptionError("Failed writing the scan inventory", e)
 
     def __str__(self):
         return "\n".join([job.name for job in self.jobList])
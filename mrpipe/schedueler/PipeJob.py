@@ -6,7 +6,15 @@ from mrpipe.Helper import Helper
 from mrpipe.meta import LoggerModule
 from mrpipe.schedueler import Scheduler
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.DirectoryCache import DirectoryCache
+from mrpipe.meta.GarbageCollector import GarbageCollector
+from mrpipe.schedueler.FileRegistry import FileRegistry
+from mrpipe.meta.LogCollector import LogCollector
 import os
+import json
+import time
+import uuid
+import socket
 import pickle
 from typing import List
 from mrpipe.Toolboxes.envs import EnvClass
@@ -17,6 +25,8 @@ logger = LoggerModule.Logger()
 class PipeJob:
 
     pickleNameStandard = "PipeJob.pkl"
+    spooledStates = [Scheduler.ProcessStatus.submitted, Scheduler.ProcessStatus.running, Scheduler.ProcessStatus.finished,
+                     Scheduler.ProcessStatus.error, Scheduler.ProcessStatus.unkown]
     def __init__(self, name: str, job: Scheduler.Scheduler, basepaths: PathBase, moduleName: str, env: EnvClass = None, verbose:int = 0, recompute = False):
         #settable
         self.name = name
@@ -30,6 +40,7 @@ class PipeJob:
         #unsettable
         self.job.jobDir = self.basepaths.pipeJobPath.join(moduleName).join(name, isDirectory=True)
         self.job.logDir = self.basepaths.logPath.join(moduleName).join(name, isDirectory=True)
+        self.job.logSpool = str(self.basepaths.logSpoolPath)
         self.dag_visited = False
         self.dag_processing = False
         self.job.setPickleCallback(self.pickleCallback)
@@ -37,10 +48,11 @@ class PipeJob:
         self.filteredPrecomputedTasks = False
         self._nextJob: Path = None
         self._dependencies: List[str] = []
+        self.gcSettings = None  # set by the pipe to collect intermediate files before this job runs, see collectGarbage
         logger.debug(f"Created PipeJob, {self}")
 
     @classmethod
-    def fromPickled(cls, path: str, pickleName:str=None):
+    def fromPickled(cls, path: str, pickleName:str=None, updateStatus: bool = True):
         if not pickleName:
             pickleName = PipeJob.pickleNameStandard
         logger.info(f'Trying to load pickled job from path: {os.path.join(path, pickleName)}')
@@ -48,15 +60,17 @@ class PipeJob:
             with open(os.path.join(path, pickleName), 'rb') as file:
                 loadedPickle = pickle.load(file)
                 logger.debug(f'Job successfully unpickled:\n{loadedPickle}')
-                loadedPickle.job.updateSlurmStatus()
+                if updateStatus:
+                    loadedPickle.job.updateSlurmStatus()
                 return loadedPickle
         except Exception as e:
             logger.logExceptionCritical("Was not able to load the pickled job. Pipe breaks here and now.", e)
 
     def createJobDir(self) -> bool:
         try:
-            if not self.job.jobDir.exists(acceptCache=False):
+            if not self.job.jobDir.exists():
                 os.makedirs(self.job.jobDir, mode=0o777, exist_ok=True)
+                DirectoryCache().invalidateTree(self.job.jobDir)
             return True
         except Exception as e:
             logger.logExceptionCritical("Could not create Job Dir", e)
@@ -72,7 +86,8 @@ class PipeJob:
             #TODO: This should probably be reverted to logger.warning or an actual error, because it effects the user if the module name is changed. However for now i muted it because this gets also triggered by the load/configure step when running the pipeline.
             logger.info(f'Job dir already set: {self.job.jobDir}. Not changing.')
 
-    def runJob(self):
+    def runJob(self, callerJobDir=None):
+        # callerJobDir: job which starts this one from its postscript (step mode), it is still running but done with its tasks
         logger.info(f"Trying to run the following job: {self.name}")
         if self.hasJobStarted():
             logger.warning(f"Job already started. Not running again. Current job status: {self.getJobStatus()}")
@@ -82,6 +97,11 @@ class PipeJob:
             logger.error("Job dependencies not fulfilled. Not running. Returning dependencies")
             logger.error(dependentJobs)
             return dependentJobs
+        self.collectLogs()
+        # the ledger tells which missing intermediates were collected on purpose (see Task.checkIfDone), also without
+        # --gcDuringRun, e.g. after mrpipe gc
+        GarbageCollector().load(self.basepaths.pipePath)
+        self.collectGarbage(callerJobDir)
         if self.env:
             self.job.job.addSetup(self.env.getSetup(), add=True, mode=List.insert, index=0)
         else:
@@ -93,7 +113,7 @@ class PipeJob:
         if self._nextJob:
             # modulepath = os.path.dirname(inspect.getfile(mrpipe))
             self.job.jobWrapper.addPostscript(["source deactivate", "source activate mrpipe"], add=True)
-            self.job.jobWrapper.addPostscript(f"""{os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "mrpipe.py")} step {self._nextJob}{f" -{'v'*self.verbose}" if self.verbose else ''}""", add=True)
+            self.job.jobWrapper.addPostscript(f"""{os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "mrpipe.py")} step {self._nextJob} --stepCaller {self.job.jobDir}{f" -{'v'*self.verbose}" if self.verbose else ''}""", add=True)
 
         for index, task in enumerate(self.job.taskList):
             if (not task.verifyInFiles()) and (not task.verifyOutFiles()):
@@ -110,7 +130,7 @@ class PipeJob:
             logger.process(f"No tasks left in tasklist after preRunChecks. Job will not be run. Job name: {self.name}. Checking for next Job: {self._nextJob}.")
             if self._nextJob is not None:
                 next_job = PipeJob.fromPickled(self._nextJob)
-                next_job.runJob()
+                next_job.runJob(callerJobDir)
             else:
                 return None
         else:
@@ -119,6 +139,54 @@ class PipeJob:
             self.job.run()
         return None
 
+    def stateRecord(self) -> dict:
+        return {"job": f"{self.moduleName}/{self.name}", "module": self.moduleName, "name": self.name,
+                "status": self.job.status.name, "tasks": len([task for task in self.job.taskList if task.shouldRun()]),
+                "slurmJobId": self.job.SLURM_jobid, "updated": time.time()}
+
+    def spoolState(self):
+        # Changes to the states of running jobs are spooled for the log collector like task runs, so monitoring reads
+        # them from the log database instead of the pickles. The states set during configuration are written by the
+        # pipe in bulk (Pipe.recordJobStates).
+        status = self.job.status
+        spoolPath = getattr(self.basepaths, "logSpoolPath", None)  # jobs pickled by older versions
+        if spoolPath is None or status not in PipeJob.spooledStates or status == getattr(self, "_spooledStatus", None):
+            return
+        try:
+            directory = os.path.join(str(spoolPath), socket.gethostname())
+            os.makedirs(directory, exist_ok=True)
+            statePath = os.path.join(directory, f"{time.strftime('%Y%m%d%H%M%S')}_{os.getpid()}_{uuid.uuid4().hex[:8]}.jobstate")
+            with open(statePath + ".tmp", "w") as f:
+                json.dump(self.stateRecord(), f)
+            os.replace(statePath + ".tmp", statePath)
+            self._spooledStatus = status
+        except OSError as e:
+            logger.logExceptionError(f"Could not spool the state of job {self.name}", e)
+
+    def collectLogs(self):
+        # Moves the task run records spooled by the previous jobs into the log database. Skipped if another step
+        # is collecting right now, the records stay in the spool until the next one.
+        spoolPath = getattr(self.basepaths, "logSpoolPath", None)  # jobs pickled by older versions
+        if spoolPath is None:
+            return
+        try:
+            LogCollector(spoolPath, self.basepaths.logDBPath, self.basepaths.taskOutputPath).collect()
+        except Exception as e:
+            logger.logExceptionError("Could not collect the task run records into the log database. Processing continues.", e)
+
+    def collectGarbage(self, callerJobDir=None):
+        # Removes intermediate files which are not read by any unfinished task anymore. Runs at the start of every step,
+        # i.e. from within the previous job after its tasks finished: that job counts as done although it is still
+        # running. Every other running job may still read its inputs.
+        settings = getattr(self, "gcSettings", None)  # jobs pickled by older versions
+        if not settings:
+            return
+        registry = FileRegistry.loadSaved(self.basepaths.pipePath.join(FileRegistry.fileName))
+        if registry is None:
+            return
+        caller = os.path.abspath(str(callerJobDir)) if callerJobDir is not None else None
+        GarbageCollector().collect(registry, jobDone=lambda jobDir: isJobDone(jobDir, acceptRunning=os.path.abspath(str(jobDir)) == caller), **settings)
+
     def filterPrecomputedTasks(self, refilter=False):
         if self.filteredPrecomputedTasks and not refilter:
             return
@@ -165,14 +233,16 @@ class PipeJob:
         logger.debug(f'Pickling Job:\n{self}')
         try:
             self.createJobDir()
-            counter = 0
-            while not (self.job.jobDir.exists(acceptCache=False) or counter >= 100): #wait until directory is actually created.
-                counter += 1
-                sleep(0.01)
+            if not self.job.jobDir.exists():
+                counter = 0
+                while not (self.job.jobDir.exists(acceptCache=False) or counter >= 100): #wait until directory is actually created.
+                    counter += 1
+                    sleep(0.01)
             if not self.job.jobDir.exists(acceptCache=True):
                 if not self.createJobDir():
                     logger.error(f"Could not create job. Job dir: {self.job.jobDir}, Job could not be pickled. Job name: {self}. This will likely break the pipeline during processing.")
             else:
+                self.spoolState()
                 with open(self.picklePath, "wb") as file:
                     pickle.dump(obj=self, file=file)
                 logger.debug(f'Job successfully pickled:\n{self.picklePath}')
@@ -236,6 +306,7 @@ class PipeJob:
     def setDependencies(self, job) -> None:
         job = Helper.ensure_list(job)
         if isinstance(job, list):
+            added = False
             for el in job:
                 if isinstance(el, PipeJob):
                     if el.job.jobDir in self._dependencies:
@@ -243,10 +314,12 @@ class PipeJob:
                     else:
                         logger.info(f"Appending Job Dependency to {self.name}: {el.name}")
                         self._dependencies.append(el.job.jobDir)
-                        self._pickleJob()
+                        added = True
                 else:
                     logger.error(
                         f"Can only append PipeJobs or [PipeJobs] as dependency to PipeJob: {self.name}. You provided {type(el)}")
+            if added:
+                self._pickleJob()
         else:
             logger.error(f"Can only append PipeJobs or [PipeJobs] as dependency to PipeJob: {self.name}. You provided {type(job)}")
 
@@ -292,31 +365,20 @@ class PipeJob:
     def __str__(self):
         return f'Job Name: {self.name}\nJob Path: {self.picklePath}\nJob: {self.job}\nFollow-up Job: {self._nextJob}\nJob Status: {self.getJobStatus()}'
 
-    def setRecomputeDependencies(self):
+    def setRecomputeDependencies(self, registry):
         #DONT - TODO run only if anything is set to precomputed. / This is wrong because if one subject/Task is missing and another should be recomputed, this will avoid checking for the task that should be recomputed.
-        #inFiles = self.getTaskInFiles()
-        dependencies = self.getDependencies()
-        if not dependencies:
+        # registry: FileRegistry of the pipe. Jobs are processed in topological order, so the task states of the
+        # producers already include recomputes triggered further up the graph.
+        if not self.getDependencies():
             logger.debug(f"No dependencies found for {self.name}")
             return
-        computedOutputFilesOfDependencies = Helper.ensure_list([
-            PipeJob.fromPickled(dependency).getTaskOutFiles(excludePrecomputed=True) for dependency in dependencies
-        ], flatten=True)
-        if not computedOutputFilesOfDependencies:
-            logger.debug(f"No computed output files found for any of the dependencies {self.name}")
-            return
-        computedOutputFilesOfDependencies = [str(file) for file in computedOutputFilesOfDependencies]
         logger.debug(f"Checking dependencies for {self.name}")
-        logger.debug(f"Dependencies: {dependencies}")
-        logger.debug(f"Checking if any of these files are a dependency of the current job: {computedOutputFilesOfDependencies}")
         for task in self.job.taskList:
             if task.state is not TaskStatus.isPreComputed:
                 continue
-            logger.debug(f"Checking whether the following input files are part of the computed output files: {task.inFiles}")
-            searchVector = [str(file) in computedOutputFilesOfDependencies for file in task.inFiles]
-            logger.debug(f"SearchVector: {searchVector}")
-            if any(searchVector):
-                logger.info(f"Task {self.name} relies on input of dependency which does not exist yet but task state is precomputed. Will recompute current task with new input of depdendency {dependencies}")
+            pendingInputs = [file for file in task.inFiles if registry.hasPendingProducer(file, exclude=self)]
+            if pendingInputs:
+                logger.info(f"Task {self.name} relies on input of dependency which does not exist yet but task state is precomputed. Will recompute current task with new input: {pendingInputs}")
                 task.setStateRecompute()
                 self.job.setNotStarted(skipPickle=True)
                 task.clobber = True
@@ -324,3 +386,16 @@ class PipeJob:
             else:
                 logger.debug(f"No changes found in dependencies, so recomputing task is not necessary ({self.name})")
         self._pickleJob()
+
+
+def isJobDone(jobDir, acceptRunning: bool = False) -> bool:
+    # True if the job will not read its input files anymore
+    if not os.path.isfile(os.path.join(str(jobDir), PipeJob.pickleNameStandard)):
+        return False
+    job = PipeJob.fromPickled(str(jobDir))
+    if job is None:
+        return False
+    done = [Scheduler.ProcessStatus.finished, Scheduler.ProcessStatus.precomputed]
+    if acceptRunning:
+        done.append(Scheduler.ProcessStatus.running)
+    return job.job.status in done
@@ -2,6 +2,7 @@ import math
 import subprocess as sps
 from enum import Enum
 import re
+import datetime
 from time import sleep
 
 from networkx.algorithms.bipartite.cluster import modes
@@ -13,8 +14,11 @@ from mrpipe.schedueler import Bash
 from typing import List
 import os
 import asyncio
+import json
+import shlex
 from mrpipe.Toolboxes.Task import Task
 from mrpipe.meta.PathClass import Path
+from mrpipe.meta.DirectoryCache import DirectoryCache
 from mrpipe.Toolboxes.envs import EnvClass
 
 
@@ -77,6 +81,9 @@ class Scheduler:
         self.SLURM_jobid = None
         self.SLURM_jobidFound = False
         self.user = None
+        self.stageSettings = None  # set by the pipe with --stageIO, see taskCommand
+        self.sampleInterval = None  # seconds between resource samples of a task, set by the pipe
+        self.logSpool = None  # spool directory of the task run records, set by the pipe job
         self.pickleCallback = None
 
 
@@ -105,7 +112,7 @@ class Scheduler:
                 for task in self.taskList:
                     task.setParent(parent=self)
                 self.status = ProcessStatus.setup
-                self.job.appendJob([task.getCommand() for task in self.taskList if task.shouldRun()])
+                self.job.appendJob([self.timedTaskCommand(index, task) for index, task in enumerate(self.taskList) if task.shouldRun()], timed=False)
 
                 if Scheduler.SchedulerType == "Slurm":
                     self.job.addSetup("""launch() {
@@ -143,6 +150,37 @@ class Scheduler:
                 self.status = ProcessStatus.error
                 logger.logExceptionError(f'Job could not be set up, this job and every job after wont run.', e)
 
+    def taskCommand(self, index, task):
+        # With --stageIO, tasks marked with stageIO run through StageIO.py on node-local scratch space: their declared
+        # inputs are copied there, the command is rewritten to the local copies and the outputs are moved back only if
+        # the task succeeded. The command is passed as one argument, so that StageIO runs all of it (including && or
+        # redirections) in a shell of its own.
+        command = task.getCommand()
+        settings = getattr(self, "stageSettings", None)  # jobs pickled by older versions
+        if not settings or not task.stageIO:
+            return command
+        manifestPath = os.path.join(self.jobDir, f"stage_{index}.json")
+        outFiles = Helper.ensure_list(task.outFiles, flatten=True)
+        with open(manifestPath, "w") as f:
+            json.dump({"inputs": [str(p) for p in Helper.ensure_list(task.inFiles, flatten=True) if p is not None],
+                       "outputs": [str(p) for p in outFiles if p is not None and not p.isDirectory],
+                       "outputDirs": [str(p) for p in outFiles if p is not None and p.isDirectory]}, f)
+        stageScript = os.path.join(Helper.get_libpath(), "Toolboxes", "submodules", "custom", "StageIO.py")
+        rootOption = f" -r {settings['root']}" if settings.get("root") else ""
+        return f"python {stageScript} -m {manifestPath}{rootOption} -- {shlex.quote(command)}"
+
+    def timedTaskCommand(self, index, task):
+        # every task is run by the resource sampler. It spools one record per task run (with the output of the task) for
+        # the log collector. Without a spool (scheduler used outside of a pipe job) it only prints its summary.
+        spool = getattr(self, "logSpool", None)
+        if not spool:
+            return Bash.Script.timedCommand(self.taskCommand(index, task), interval=getattr(self, "sampleInterval", None))
+        labels = {"subject": task.subjectName, "session": task.sessionName, "task": task.name,
+                  "taskClass": type(task).__name__, "job": os.path.basename(str(self.jobDir)), "module": os.path.basename(os.path.dirname(str(self.jobDir))),
+                  "cpus": self.SLURM_cpusPerTask, "memory": int(self.SLURM_cpusPerTask * self.SLURM_memPerCPU * 1024 ** 3)}
+        return Bash.Script.timedCommand(self.taskCommand(index, task), interval=getattr(self, "sampleInterval", None),
+                                        spool=spool, labels=labels)
+
     def _gpuNodeCheck(self):
         # check for number of GPUs requested vs nodes and task mismatch and correct if necessary.
         if self.SLURM_ngpus: #and (self.SLURM_nnodes or self.SLURM_ntasks)
@@ -202,6 +240,8 @@ class Scheduler:
                 logger.info(decoded_line)
 
             returncode = proc.wait()
+            # the job changed files behind the back of the directory cache
+            DirectoryCache().clear()
             if returncode == 0:
                 logger.info(f'Job finished: {self.jobWrapper.path}')
                 self.status = ProcessStatus.finished
@@ -379,6 +419,32 @@ class Scheduler:
             logger.info("sacct output was:")
             logger.info(decoded_lines)
 
+    @staticmethod
+    def slurmTimes(jobIds) -> dict:
+        # submit, start and end time (epoch seconds, None if not yet known) of the given Slurm jobs, one sacct call per
+        # 500 jobs
+        times = {}
+        jobIds = [str(jobId) for jobId in jobIds if jobId]
+        for chunk in range(0, len(jobIds), 500):
+            proc = sps.run(f"sacct -X -n -P --format=JobID,Submit,Start,End,NodeList -j {','.join(jobIds[chunk:chunk + 500])}",
+                           shell=True, capture_output=True)
+            if proc.returncode != 0:
+                logger.error(f"Could not query Slurm job times: {proc.stderr.decode('utf-8')}")
+                return times
+            for line in proc.stdout.decode('utf-8').splitlines():
+                fields = line.split("|")
+                if len(fields) < 5:
+                    continue
+                parsed = {}
+                for key, value in zip(["submit", "start", "end"], fields[1:4]):
+                    try:
+                        parsed[key] = datetime.datetime.fromisoformat(value).timestamp()
+                    except ValueError:
+                        parsed[key] = None  # Unknown / None while pending or running
+                parsed["nodes"] = fields[4]
+                times[fields[0]] = parsed
+        return times
+
     def userJobs(self):
         if Scheduler.SchedulerType != "Slurm":
             return